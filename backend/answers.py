@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Almacenamiento compacto de respuestas
+StudentResponses guarda las respuestas de un estudiante en arreglos paralelos
+(índice de actividad internado, hora en milisegundos epoch, porcentaje,
+tiempo de respuesta) más un bitset de aciertos, en vez de un dict por
+respuesta con claves e ISO strings repetidos.
+
+Se comporta como un Mapping activity_id -> registro; los registros se arman
+al leerlos con el formato de siempre (ver StudentData.to_saveable), así el
+progreso guardado y los mensajes entre workers no cambian.
+
+ItemResponseStore guarda además las respuestas de cada actividad en columnas
+(estudiante, respuesta, acierto, tiempo) para calcular estadísticas por
+pregunta sin recorrer a los estudiantes; los cálculos se hacen con NumPy,
+vectorizados sobre las mismas columnas (vistas sin copia).
+"""
+import sys
+from array import array
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# ============================================================
+# ÍNDICE DE ACTIVIDADES
+# ============================================================
+
+# Compartido por todo el proceso: cada activity_id se guarda una sola vez
+_activity_ids: List[str] = []
+_activity_index: Dict[str, int] = {}
+
+
+def activity_index(activity_id: str) -> int:
+    """Índice internado de un activity_id (se asigna la primera vez)"""
+    index = _activity_index.get(activity_id)
+    if index is None:
+        activity_id = sys.intern(activity_id)
+        index = _activity_index.setdefault(activity_id, len(_activity_ids))
+        if index == len(_activity_ids):
+            _activity_ids.append(activity_id)
+    return index
+
+
+# ============================================================
+# HORAS
+# ============================================================
+
+def epoch_ms(value: Optional[str]) -> int:
+    """ISO (hora local, como datetime.now().isoformat()) a milisegundos; 0 si falta"""
+    if not value:
+        return 0
+    try:
+        return int(round(datetime.fromisoformat(value).timestamp() * 1000))
+    except (TypeError, ValueError):
+        return 0
+
+
+# segundo epoch -> ISO local: convertir a hora local es lo caro y las
+# respuestas de una clase caen en pocos segundos distintos
+_iso_seconds: Dict[int, str] = {}
+ISO_CACHE_SIZE = 4096
+
+
+def iso_from_ms(ms: int) -> Optional[str]:
+    if not ms:
+        return None
+    seconds, millis = divmod(ms, 1000)
+    prefix = _iso_seconds.get(seconds)
+    if prefix is None:
+        if len(_iso_seconds) >= ISO_CACHE_SIZE:
+            _iso_seconds.clear()
+        prefix = _iso_seconds[seconds] = datetime.fromtimestamp(seconds).isoformat()
+    return f"{prefix}.{millis:03d}000" if millis else prefix
+
+
+def now_ms() -> int:
+    return int(round(datetime.now().timestamp() * 1000))
+
+
+# ============================================================
+# RESPUESTAS DE UN ESTUDIANTE
+# ============================================================
+
+NO_RESPONSE_TIME = -1  # response_time_ms ausente
+MAX_RESPONSE_TIME_MS = 2 ** 31 - 1  # Límite de array('i')
+
+
+def coerce_response_time(value: Any) -> Optional[int]:
+    """response_time_ms válido (número en [0, 2**31-1)) o None.
+
+    Lo que manda el cliente o trae el progreso guardado puede ser texto,
+    negativo o enorme: nada de eso llega a los arreglos.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if not 0 <= value < MAX_RESPONSE_TIME_MS:  # también descarta NaN
+        return None
+    return int(value)
+
+
+SLOT_INDEX_MIN = 8  # Desde cuántas respuestas se indexan las posiciones en un dict
+
+
+def stored_response_time(value: Any) -> int:
+    """Valor para una columna array('i') de tiempos (NO_RESPONSE_TIME si es inválido)"""
+    time_ms = coerce_response_time(value)
+    return NO_RESPONSE_TIME if time_ms is None else time_ms
+
+
+class StudentResponses(Mapping):
+    """Respuestas de un estudiante en arreglos paralelos (una posición por actividad)
+
+    Con pocas respuestas la posición se busca en _activities (array.index);
+    desde SLOT_INDEX_MIN se mantiene un dict índice -> posición para que cada
+    respuesta nueva no cueste más a medida que crece el historial.
+    """
+    __slots__ = ("_activities", "_answers", "_values", "_answered_at", "_times", "_correct", "_slots")
+
+    def __init__(self):
+        self._activities = array('I')  # índice internado de la actividad
+        self._answers: List[Any] = []  # respuesta tal como llegó (índice, texto...)
+        self._values = array('d')  # percentage_value
+        self._answered_at = array('q')  # milisegundos epoch
+        self._times = array('i')  # response_time_ms (NO_RESPONSE_TIME si falta)
+        self._correct = bytearray()  # bitset de aciertos por posición
+        self._slots: Optional[Dict[int, int]] = None  # índice de actividad -> posición
+
+    @classmethod
+    def from_saved(cls, responses: Dict[str, Dict]) -> "StudentResponses":
+        """Desde el formato guardado {activity_id: {...}}"""
+        compact = cls()
+        for activity_id, response in responses.items():
+            compact.record_saved(response, activity_id)
+        return compact
+
+    def record_saved(self, response: Dict, activity_id: Optional[str] = None):
+        """Guarda (o reemplaza) una respuesta en el formato guardado"""
+        self.record(
+            activity_id or response["activity_id"],
+            response.get("answer"),
+            bool(response.get("is_correct")),
+            response.get("percentage_value") or 0.0,
+            response.get("response_time_ms"),  # record descarta valores inválidos
+            epoch_ms(response.get("answered_at")),
+        )
+
+    def _slot(self, activity_id: str) -> Optional[int]:
+        index = _activity_index.get(activity_id)
+        if index is None:
+            return None
+        if self._slots is not None:
+            return self._slots.get(index)
+        try:
+            return self._activities.index(index)
+        except ValueError:
+            return None
+
+    def _set_correct(self, slot: int, is_correct: bool):
+        byte, bit = divmod(slot, 8)
+        if byte >= len(self._correct):
+            self._correct.extend(bytes(byte - len(self._correct) + 1))
+        if is_correct:
+            self._correct[byte] |= 1 << bit
+        else:
+            self._correct[byte] &= ~(1 << bit) & 0xFF
+
+    def _is_correct(self, slot: int) -> bool:
+        return bool(self._correct[slot >> 3] & (1 << (slot & 7)))
+
+    def record(self, activity_id: str, answer: Any, is_correct: bool, percentage_value: float,
+               response_time_ms: Optional[int] = None, answered_at_ms: Optional[int] = None):
+        """Guarda (o reemplaza) la respuesta a una actividad"""
+        answered_at_ms = now_ms() if answered_at_ms is None else answered_at_ms
+        time_ms = stored_response_time(response_time_ms)
+        slot = self._slot(activity_id)
+        if slot is None:
+            slot = len(self._activities)
+            index = activity_index(activity_id)
+            self._activities.append(index)
+            if self._slots is not None:
+                self._slots[index] = slot
+            elif slot + 1 >= SLOT_INDEX_MIN:
+                self._slots = {index: slot for slot, index in enumerate(self._activities)}
+            self._answers.append(answer)
+            self._values.append(percentage_value)
+            self._answered_at.append(answered_at_ms)
+            self._times.append(time_ms)
+        else:
+            self._answers[slot] = answer
+            self._values[slot] = percentage_value
+            self._answered_at[slot] = answered_at_ms
+            self._times[slot] = time_ms
+        self._set_correct(slot, is_correct)
+
+    def _record(self, slot: int) -> Dict:
+        return _build_record(
+            _activity_ids[self._activities[slot]], self._answers[slot], self._is_correct(slot),
+            self._values[slot], self._answered_at[slot], self._times[slot],
+        )
+
+    # ---------- Mapping ----------
+
+    def __getitem__(self, activity_id: str) -> Dict:
+        slot = self._slot(activity_id)
+        if slot is None:
+            raise KeyError(activity_id)
+        return self._record(slot)
+
+    def __contains__(self, activity_id) -> bool:
+        return isinstance(activity_id, str) and self._slot(activity_id) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for index in self._activities:
+            yield _activity_ids[index]
+
+    def __len__(self) -> int:
+        return len(self._activities)
+
+    # ---------- acceso sin armar registros ----------
+
+    def answer(self, activity_id: str) -> Any:
+        """Respuesta dada a una actividad (None si no respondió)"""
+        slot = self._slot(activity_id)
+        return self._answers[slot] if slot is not None else None
+
+    def iter_items(self) -> Iterator[Tuple[str, Any, bool, Optional[int]]]:
+        """(activity_id, respuesta, acierto, response_time_ms) en orden de respuesta"""
+        for slot, (index, answer, time_ms) in enumerate(zip(self._activities, self._answers, self._times)):
+            yield (_activity_ids[index], answer, self._is_correct(slot),
+                   None if time_ms == NO_RESPONSE_TIME else time_ms)
+
+    def iter_answers(self) -> Iterator[Tuple[str, Any]]:
+        """(activity_id, respuesta) en orden de respuesta"""
+        for index, answer in zip(self._activities, self._answers):
+            yield _activity_ids[index], answer
+
+    def to_saveable(self) -> Dict[str, Dict]:
+        """Formato guardado {activity_id: {...}} (registros nuevos)"""
+        saveable = {}
+        correct = self._correct
+        for slot, (index, answer, value, answered_at, time_ms) in enumerate(zip(
+                self._activities, self._answers, self._values, self._answered_at, self._times)):
+            activity_id = _activity_ids[index]
+            is_correct = bool(correct[slot >> 3] & (1 << (slot & 7)))
+            saveable[activity_id] = _build_record(activity_id, answer, is_correct, value, answered_at, time_ms)
+        return saveable
+
+
+def _build_record(activity_id: str, answer: Any, is_correct: bool, percentage_value: float,
+                  answered_at_ms: int, response_time_ms: int) -> Dict:
+    return {
+        "activity_id": activity_id,
+        "answer": answer,
+        "is_correct": is_correct,
+        "percentage_value": percentage_value,
+        "answered_at": iso_from_ms(answered_at_ms),
+        "response_time_ms": None if response_time_ms == NO_RESPONSE_TIME else response_time_ms,
+    }
+
+
+
+# ============================================================
+# RESPUESTAS POR ACTIVIDAD (COLUMNAS)
+# ============================================================
+
+NO_ANSWER = -1  # Código de respuesta None (no cuenta en la distribución)
+DISCRIMINATION_GROUP = 0.27  # Grupos superior/inferior del índice de discriminación
+RESPONSE_TIME_PERCENTILES = (50, 90, 95)
+
+
+class ActivityColumns:
+    """Respuestas a una actividad en columnas paralelas (una fila por estudiante)"""
+    __slots__ = ("students", "answers", "correct", "times", "labels", "_label_codes", "_rows")
+
+    def __init__(self):
+        self.students = array('i')  # ordinal del estudiante (ver ItemResponseStore)
+        self.answers = array('i')  # posición de str(respuesta) en labels
+        self.correct = array('b')  # 1 acierto, 0 error
+        self.times = array('i')  # response_time_ms (NO_RESPONSE_TIME si falta)
+        self.labels: List[str] = []  # Mismas claves que los votos del dashboard
+        self._label_codes: Dict[str, int] = {}
+        self._rows: Dict[int, int] = {}  # ordinal -> fila
+
+    def __len__(self) -> int:
+        return len(self.students)
+
+    def _code(self, answer: Any) -> int:
+        if answer is None:
+            return NO_ANSWER
+        label = str(answer)
+        code = self._label_codes.get(label)
+        if code is None:
+            code = self._label_codes[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+    def put(self, ordinal: int, answer: Any, is_correct: bool, response_time_ms: Optional[int]) -> int:
+        """Agrega o reemplaza la fila del estudiante. Retorna el acierto anterior (0 si no había)"""
+        code = self._code(answer)
+        time_ms = stored_response_time(response_time_ms)
+        row = self._rows.get(ordinal)
+        if row is None:
+            self._rows[ordinal] = len(self.students)
+            self.students.append(ordinal)
+            self.answers.append(code)
+            self.correct.append(1 if is_correct else 0)
+            self.times.append(time_ms)
+            return 0
+        previous = self.correct[row]
+        self.answers[row] = code
+        self.correct[row] = 1 if is_correct else 0
+        self.times[row] = time_ms
+        return previous
+
+    def remove(self, ordinal: int) -> int:
+        """Quita la fila del estudiante (la última ocupa su lugar). Retorna su acierto"""
+        row = self._rows.pop(ordinal, None)
+        if row is None:
+            return 0
+        removed = self.correct[row]
+        last = len(self.students) - 1
+        if row != last:
+            moved = self.students[last]
+            self.students[row] = moved
+            self.answers[row] = self.answers[last]
+            self.correct[row] = self.correct[last]
+            self.times[row] = self.times[last]
+            self._rows[moved] = row
+        for column in (self.students, self.answers, self.correct, self.times):
+            column.pop()
+        return removed
+
+
+class ItemResponseStore:
+    """Columnas por actividad de un aula con estadísticas cacheadas.
+
+    Cuenta a todo el roster (conectados o no). Lleva los aciertos de cada
+    estudiante para el índice de discriminación; como cualquier respuesta los
+    cambia, las estadísticas cacheadas valen hasta la próxima respuesta.
+    """
+    def __init__(self):
+        self.columns: Dict[str, ActivityColumns] = {}
+        self._ordinals: Dict[str, int] = {}  # session_id -> ordinal
+        self.correct_totals = array('i')  # aciertos por ordinal
+        self.version = 0
+        self._stats_cache: Dict[str, Tuple[int, Dict]] = {}
+
+    def _ordinal(self, session_id: str) -> int:
+        ordinal = self._ordinals.get(session_id)
+        if ordinal is None:
+            ordinal = self._ordinals[session_id] = len(self.correct_totals)
+            self.correct_totals.append(0)
+        return ordinal
+
+    def record(self, session_id: str, activity_id: str, answer: Any, is_correct: bool,
+               response_time_ms: Optional[int] = None):
+        column = self.columns.get(activity_id)
+        if column is None:
+            column = self.columns[activity_id] = ActivityColumns()
+        ordinal = self._ordinal(session_id)
+        previous = column.put(ordinal, answer, is_correct, response_time_ms)
+        self.correct_totals[ordinal] += (1 if is_correct else 0) - previous
+        self.version += 1
+
+    def add_student(self, session_id: str, responses: StudentResponses):
+        for activity_id, answer, is_correct, time_ms in responses.iter_items():
+            self.record(session_id, activity_id, answer, is_correct, time_ms)
+
+    def remove_student(self, session_id: str, responses: StudentResponses):
+        ordinal = self._ordinals.get(session_id)
+        if ordinal is None:
+            return
+        for activity_id in responses:
+            column = self.columns.get(activity_id)
+            if column is not None:
+                self.correct_totals[ordinal] -= column.remove(ordinal)
+                if not len(column):
+                    del self.columns[activity_id]
+                    self._stats_cache.pop(activity_id, None)
+        self.version += 1
+
+    def stats(self, activity_id: str) -> Optional[Dict]:
+        """Estadísticas de la actividad (None si nadie respondió)"""
+        column = self.columns.get(activity_id)
+        if column is None:
+            return None
+        cached = self._stats_cache.get(activity_id)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        stats = compute_item_stats(column, self.correct_totals)
+        self._stats_cache[activity_id] = (self.version, stats)
+        return stats
+
+
+# ============================================================
+# ESTADÍSTICAS POR PREGUNTA
+# ============================================================
+
+def _stats_dict(labels: List[str], counts: List[int], total: int, correct: int,
+                times: Dict, discrimination: Optional[float], point_biserial: Optional[float]) -> Dict:
+    difficulty = correct / total if total else None
+    return {
+        "responses": total,
+        "correct": correct,
+        "accuracy": round(difficulty * 100, 2) if total else 0.0,
+        "distribution": {label: count for label, count in zip(labels, counts) if count},
+        "responseTimeMs": times,
+        "difficulty": round(difficulty, 4) if total else None,
+        "discrimination": None if discrimination is None else round(discrimination, 4),
+        "pointBiserial": None if point_biserial is None else round(point_biserial, 4),
+    }
+
+
+def empty_item_stats() -> Dict:
+    """Estadísticas de una actividad sin respuestas"""
+    return _stats_dict([], [], 0, 0, {"count": 0}, None, None)
+
+
+def _group_size(total: int) -> int:
+    return max(1, int(round(total * DISCRIMINATION_GROUP)))
+
+
+def compute_item_stats(column: ActivityColumns, correct_totals: array) -> Dict:
+    """Acierto, distribución de respuestas, percentiles de tiempo, dificultad
+    (proporción de aciertos) y discriminación (grupo superior menos inferior
+    del 27% según los aciertos en las demás preguntas, y correlación
+    punto-biserial corregida)"""
+    total = len(column)
+    # Vistas sin copia sobre las columnas (se sueltan al salir de la función)
+    students = np.frombuffer(column.students, dtype=np.intc)
+    answers = np.frombuffer(column.answers, dtype=np.intc)
+    correct = np.frombuffer(column.correct, dtype=np.int8).astype(np.int64)
+    times = np.frombuffer(column.times, dtype=np.intc)
+    totals = np.frombuffer(correct_totals, dtype=np.intc)
+
+    given = answers[answers != NO_ANSWER]
+    counts = np.bincount(given, minlength=len(column.labels)).tolist() if given.size else []
+    correct_count = int(correct.sum())
+
+    valid_times = times[times != NO_RESPONSE_TIME]
+    if valid_times.size:
+        percentiles = np.percentile(valid_times, RESPONSE_TIME_PERCENTILES)
+        time_stats = {
+            "count": int(valid_times.size),
+            "mean": round(float(valid_times.mean()), 1),
+            "min": int(valid_times.min()),
+            "max": int(valid_times.max()),
+            **{f"p{q}": round(float(v), 1) for q, v in zip(RESPONSE_TIME_PERCENTILES, percentiles)},
+        }
+    else:
+        time_stats = {"count": 0}
+
+    discrimination = point_biserial = None
+    rest = totals[students].astype(np.int64) - correct  # Aciertos en las demás preguntas
+    if total >= 2 and rest.min() != rest.max():  # Sin diferencias no hay grupos que comparar
+        order = np.argsort(-rest, kind="stable")
+        group = _group_size(total)
+        discrimination = float(correct[order[:group]].mean() - correct[order[-group:]].mean())
+        if correct.min() != correct.max():
+            point_biserial = float(np.corrcoef(correct, rest)[0, 1])
+    return _stats_dict(column.labels, counts, total, correct_count, time_stats,
+                       discrimination, point_biserial)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks de los caminos calientes de StudentManager
+Arma clases sintéticas (50 / 500 / 5000 estudiantes con respuestas) sobre
+websockets falsos que no cuestan nada al enviar, mide cada operación en
+proceso y compara contra benchmark_baseline.json.
+
+    python benchmark.py                    # compara; sale con 1 si algo empeoró
+    python benchmark.py --save-baseline    # guarda los resultados como nueva base
+    python benchmark.py --sizes 50,500 --threshold 0.5 --report bench.json
+
+Los tiempos dependen de la máquina: regenerar la base en el host donde se
+compara (y en reposo) antes de usar el umbral como criterio.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from main import ActivityState, ActivityData, StudentManager, connection_registry
+from storage import create_progress_store
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_SIZES = (50, 500, 5000)
+DEFAULT_THRESHOLD = 0.30  # Más de 30% más lento que la base = regresión
+ACTIVITIES_PER_STUDENT = 20
+MIN_ROUND_SECONDS = 0.05  # Cada ronda repite la operación hasta durar al menos esto
+ROUNDS = 5
+SLOW_OP_SECONDS = 0.5  # Operaciones más lentas que esto se miden en menos rondas
+SLOW_OP_ROUNDS = 2
+
+
+class FakeWebSocket:
+    """Websocket que descarta todo lo que se le envía"""
+    async def send_text(self, text: str):
+        pass
+
+    async def send_bytes(self, data: bytes):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+# ============================================================
+# CLASE SINTÉTICA
+# ============================================================
+
+def build_class(size: int, store_dir: str, seed: int = 2026) -> tuple:
+    """StudentManager con `size` estudiantes conectados y sus respuestas"""
+    rng = random.Random(seed)
+    store = create_progress_store(
+        "json",
+        json_path=os.path.join(store_dir, "progress.json"),
+        journal_path=os.path.join(store_dir, "progress.journal"),
+        sqlite_path=os.path.join(store_dir, "progress.db"),
+    )
+    manager = StudentManager(store)
+    activities = [
+        ActivityData(f"act-{i}", f"Pregunta {i}", ["A", "B", "C", "D"], i % 4, 5.0)
+        for i in range(ACTIVITIES_PER_STUDENT)
+    ]
+    names: List[str] = []
+    with contextlib.redirect_stdout(io.StringIO()):  # register_student imprime por estudiante
+        for i in range(size):
+            websocket = FakeWebSocket()
+            connection_registry.open(websocket)
+            student, _ = manager.register_student(f"Estudiante {i:05d}", websocket)
+            names.append(student.name)
+            for activity in activities:
+                answer = rng.randrange(4)
+                student.add_response(activity.id, answer, answer == activity.correct_index,
+                                     activity.percentage_value, rng.randint(800, 20000))
+    current = activities[-1]
+    current.state = ActivityState.ACTIVE
+    return manager, current, names
+
+
+async def close_class(manager: StudentManager):
+    writers = []
+    for websocket in list(manager.websocket_to_student):
+        connection = connection_registry.get(websocket)
+        if connection is not None:
+            writers.append(connection._task)
+        connection_registry.close(websocket)
+    await asyncio.gather(*writers, return_exceptions=True)
+
+
+async def drain_queues():
+    """Deja que las colas de salida se vacíen (fuera de la medición)"""
+    while any(c._queue for c in connection_registry.connections.values()):
+        await asyncio.sleep(0)
+
+
+# ============================================================
+# MEDICIÓN
+# ============================================================
+
+async def measure(fn: Callable, is_async: bool = False, after: Callable = None) -> float:
+    """Segundos por operación: el mínimo entre ROUNDS rondas calibradas"""
+    async def run_once():
+        if is_async:
+            await fn()
+        else:
+            fn()
+
+    # Calibrar repeticiones por ronda con una corrida
+    start = time.perf_counter()
+    await run_once()
+    single = max(time.perf_counter() - start, 1e-7)
+    if after is not None:
+        await after()
+    number = max(1, int(MIN_ROUND_SECONDS / single))
+    best = float("inf")
+    for _ in range(ROUNDS if single < SLOW_OP_SECONDS else SLOW_OP_ROUNDS):
+        start = time.perf_counter()
+        for _ in range(number):
+            await run_once()
+        best = min(best, (time.perf_counter() - start) / number)
+        if after is not None:
+            await after()
+    return best
+
+
+async def bench_size(size: int) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as store_dir:
+        manager, current, names = build_class(size, store_dir)
+        rng = random.Random(size)
+        # RANKING_UPDATE se reemplaza en cola: repetirlo no llena las colas falsas
+        ranking = {"type": "RANKING_UPDATE", "data": {"ranking": manager.get_ranking(5)}}
+        benches = [
+            ("get_dashboard_summary", lambda: manager.get_dashboard_summary(current.id), False, None),
+            ("get_ranking", lambda: manager.get_ranking(5), False, None),
+            ("_find_student_by_name", lambda: manager._find_student_by_name(rng.choice(names).upper()), False, None),
+            ("_save_all_progress", manager._save_all_progress, False, None),
+            ("broadcast_to_students", lambda: manager.broadcast_to_students(ranking), True, drain_queues),
+        ]
+        # Sin los print de persistencia dentro de la medición
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, fn, is_async, after in benches:
+                results[f"{name}[{size}]"] = await measure(fn, is_async, after)
+            await manager.persistence.stop()
+        await close_class(manager)
+    return results
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} µs"
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+    """Imprime la tabla y devuelve los benchmarks que empeoraron más que el umbral"""
+    regressions = []
+    print(f"{'benchmark':<36}{'actual':>12}{'base':>12}{'cambio':>10}")
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base:
+            change = seconds / base - 1
+            flag = "  REGRESIÓN" if change > threshold else ""
+            print(f"{name:<36}{format_seconds(seconds):>12}{format_seconds(base):>12}{change:>+10.1%}{flag}")
+            if flag:
+                regressions.append(name)
+        else:
+            print(f"{name:<36}{format_seconds(seconds):>12}{'(sin base)':>12}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de StudentManager")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="Tamaños de clase separados por coma (default: 50,500,5000)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Empeoramiento relativo tolerado (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Archivo de base")
+    parser.add_argument("--save-baseline", action="store_true", help="Guardar resultados como nueva base")
+    parser.add_argument("--report", default="", help="Ruta del reporte JSON")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    async def run_all() -> Dict[str, float]:
+        results: Dict[str, float] = {}
+        for size in sizes:
+            results.update(await bench_size(size))
+        return results
+
+    results = asyncio.run(run_all())
+
+    baseline: Dict[str, float] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+
+    regressions = compare(results, baseline, args.threshold)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "threshold": args.threshold, "regressions": regressions},
+                      f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"results": {**baseline, **results}}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Base guardada en {args.baseline}")
+        return 0
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) empeoraron más de {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""
+Bus de eventos y almacén compartido entre workers
+Interfaz Broker con dos implementaciones:
+  - InProcessBroker: un solo proceso (por defecto, no publica nada afuera)
+  - RedisBroker: protocolo de Redis (RESP2) sobre TCP, sin dependencias
+
+LocalBrokerServer sirve el subconjunto de comandos que usa RedisBroker, para
+desarrollo y pruebas sin instalar Redis:
+
+    python broker.py --port 6390
+    BROKER_URL=redis://127.0.0.1:6390 uvicorn main:app --workers 4
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from codec import DecodeError, decode, encode
+
+Handler = Callable[[Dict], Awaitable[None]]
+
+
+class BrokerError(Exception):
+    """Error devuelto por el broker o respuesta de protocolo inválida"""
+
+
+class Broker:
+    """Publicación/suscripción por canal + hashes clave/campo -> dict.
+
+    shared indica si otros procesos ven lo publicado; con False los
+    llamadores pueden omitir la replicación.
+    """
+    shared = False
+
+    def subscribe(self, channel: str, handler: Handler):
+        """Registra un handler async para los mensajes del canal"""
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def publish(self, channel: str, message: Dict):
+        raise NotImplementedError
+
+    async def hset(self, key: str, field: str, value: Dict):
+        raise NotImplementedError
+
+    async def hset_many(self, key: str, values: Dict[str, Dict]):
+        """Varios campos del mismo hash en una sola escritura"""
+        for field, value in values.items():
+            await self.hset(key, field, value)
+
+    async def hdel(self, key: str, field: str):
+        raise NotImplementedError
+
+    async def hgetall(self, key: str) -> Dict[str, Dict]:
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+# ============================================================
+# EN PROCESO
+# ============================================================
+
+class InProcessBroker(Broker):
+    """Broker de un solo proceso: entrega a los handlers locales en orden"""
+    shared = False
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._hashes: Dict[str, Dict[str, Dict]] = {}
+
+    def subscribe(self, channel: str, handler: Handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def publish(self, channel: str, message: Dict):
+        for handler in list(self._handlers.get(channel, [])):
+            await handler(message)
+
+    async def hset(self, key: str, field: str, value: Dict):
+        self._hashes.setdefault(key, {})[field] = value
+
+    async def hset_many(self, key: str, values: Dict[str, Dict]):
+        self._hashes.setdefault(key, {}).update(values)
+
+    async def hdel(self, key: str, field: str):
+        self._hashes.get(key, {}).pop(field, None)
+
+    async def hgetall(self, key: str) -> Dict[str, Dict]:
+        return dict(self._hashes.get(key, {}))
+
+    async def delete(self, key: str):
+        self._hashes.pop(key, None)
+
+
+# ============================================================
+# PROTOCOLO RESP2
+# ============================================================
+
+def _encode_command(args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode("utf-8")
+        elif isinstance(arg, int):
+            arg = str(arg).encode("ascii")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def _read_reply(reader: asyncio.StreamReader) -> Any:
+    """Lee una respuesta RESP2. Los errores se devuelven (no se lanzan) como BrokerError"""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("el broker cerró la conexión")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode("utf-8")
+    if kind == b"-":
+        return BrokerError(rest.decode("utf-8"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(length)]
+    raise BrokerError(f"respuesta RESP inválida: {line[:40]!r}")
+
+
+def _decode_value(data: Optional[bytes]) -> Optional[Dict]:
+    if data is None:
+        return None
+    try:
+        return decode(data)
+    except DecodeError as e:
+        print(f"[WARN] Valor inválido en el broker: {e}")
+        return None
+
+
+# ============================================================
+# REDIS
+# ============================================================
+
+class RedisBroker(Broker):
+    """Broker compatible con Redis (o con LocalBrokerServer).
+
+    Usa una conexión para comandos y otra dedicada a SUBSCRIBE; la de
+    suscripción se reconecta sola con espera creciente. start() espera la
+    primera conexión y la suscripción a lo sumo connect_timeout segundos.
+    """
+    shared = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, connect_timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.connect_timeout = connect_timeout
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+        self._sub_writer: Optional[asyncio.StreamWriter] = None
+        self._sub_task: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        for command in self._setup_commands():
+            writer.write(_encode_command(command))
+            await writer.drain()
+            reply = await _read_reply(reader)
+            if isinstance(reply, BrokerError):
+                writer.close()
+                raise reply
+        return reader, writer
+
+    def _setup_commands(self) -> List[tuple]:
+        commands = []
+        if self.password:
+            commands.append(("AUTH", self.password))
+        if self.db:
+            commands.append(("SELECT", self.db))
+        return commands
+
+    async def _execute(self, *args) -> Any:
+        async with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._writer is None:
+                        self._reader, self._writer = await self._connect()
+                    self._writer.write(_encode_command(args))
+                    await self._writer.drain()
+                    reply = await _read_reply(self._reader)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                    # Reintentar una vez con una conexión nueva
+                    self._drop_command_connection()
+                    if attempt == 2:
+                        raise
+        if isinstance(reply, BrokerError):
+            raise reply
+        return reply
+
+    def _drop_command_connection(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    def subscribe(self, channel: str, handler: Handler):
+        new_channel = channel not in self._handlers
+        self._handlers.setdefault(channel, []).append(handler)
+        if new_channel and self._sub_writer is not None:
+            self._sub_writer.write(_encode_command(("SUBSCRIBE", channel)))
+
+    async def start(self):
+        """Conecta y suscribe; BrokerError si el broker no responde a tiempo"""
+        try:
+            self._reader, self._writer = await asyncio.wait_for(self._connect(), self.connect_timeout)
+            self._sub_task = asyncio.create_task(self._listen())
+            await asyncio.wait_for(self._subscribed.wait(), self.connect_timeout)
+        except (asyncio.TimeoutError, OSError) as e:
+            await self.close()
+            reason = str(e) or f"sin respuesta en {self.connect_timeout:g}s"
+            raise BrokerError(f"No se pudo conectar al broker {self.host}:{self.port} ({reason})") from e
+
+    async def _listen(self):
+        delay = 0.5
+        while True:
+            try:
+                reader, writer = await self._connect()
+                self._sub_writer = writer
+                pending = len(self._handlers)
+                if pending:
+                    writer.write(_encode_command(("SUBSCRIBE", *self._handlers)))
+                    await writer.drain()
+                while pending:
+                    reply = await _read_reply(reader)
+                    if isinstance(reply, list) and reply and reply[0] == b"subscribe":
+                        pending -= 1
+                self._subscribed.set()
+                delay = 0.5
+                while True:
+                    reply = await _read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        await self._dispatch(reply[1].decode("utf-8"), reply[2])
+            except asyncio.CancelledError:
+                raise
+            except (BrokerError, asyncio.IncompleteReadError, OSError) as e:
+                print(f"[WARN] Suscripción al broker perdida ({e}); reintentando en {delay:.1f}s")
+            finally:
+                if self._sub_writer is not None:
+                    self._sub_writer.close()
+                    self._sub_writer = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10.0)
+
+    async def _dispatch(self, channel: str, data: bytes):
+        message = _decode_value(data)
+        if message is None:
+            return
+        for handler in list(self._handlers.get(channel, [])):
+            try:
+                await handler(message)
+            except Exception as e:  # un handler roto no corta la suscripción
+                print(f"[ERROR] Procesando mensaje del broker ({channel}): {e}")
+
+    async def publish(self, channel: str, message: Dict):
+        await self._execute("PUBLISH", channel, encode(message))
+
+    async def hset(self, key: str, field: str, value: Dict):
+        await self._execute("HSET", key, field, encode(value))
+
+    async def hset_many(self, key: str, values: Dict[str, Dict]):
+        if not values:
+            return
+        args = []
+        for field, value in values.items():
+            args.extend((field, encode(value)))
+        await self._execute("HSET", key, *args)
+
+    async def hdel(self, key: str, field: str):
+        await self._execute("HDEL", key, field)
+
+    async def hgetall(self, key: str) -> Dict[str, Dict]:
+        reply = await self._execute("HGETALL", key) or []
+        result = {}
+        for i in range(0, len(reply) - 1, 2):
+            value = _decode_value(reply[i + 1])
+            if value is not None:
+                result[reply[i].decode("utf-8")] = value
+        return result
+
+    async def delete(self, key: str):
+        await self._execute("DEL", key)
+
+    async def close(self):
+        if self._sub_task is not None:
+            self._sub_task.cancel()
+            try:
+                await self._sub_task
+            except asyncio.CancelledError:
+                pass
+            self._sub_task = None
+        async with self._lock:
+            self._drop_command_connection()
+
+
+def create_broker(url: str, connect_timeout: float = 10.0) -> Broker:
+    """Broker según BROKER_URL: vacío o memory:// -> en proceso; redis://host:puerto/db"""
+    if not url or url.startswith("memory:"):
+        return InProcessBroker()
+    parsed = urlparse(url)
+    if parsed.scheme not in ("redis", "tcp"):
+        raise ValueError(f"BROKER_URL no soportada: {url}")
+    db = int(parsed.path.lstrip("/") or 0)
+    return RedisBroker(parsed.hostname or "127.0.0.1", parsed.port or 6379, db, parsed.password,
+                       connect_timeout)
+
+
+# ============================================================
+# SERVIDOR LOCAL (sustituto de Redis)
+# ============================================================
+
+class LocalBrokerServer:
+    """Servidor RESP2 mínimo: PING, PUBLISH, SUBSCRIBE, HSET, HDEL, HGETALL y DEL.
+
+    Pensado para probar varios workers en una sola máquina; no persiste nada.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 6390):
+        self.host = host
+        self.port = port
+        self._hashes: Dict[bytes, Dict[bytes, bytes]] = {}
+        self._subscribers: Dict[bytes, set] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    @staticmethod
+    def _bulk(value: Optional[bytes]) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _array(self, items: List[bytes]) -> bytes:
+        return b"*%d\r\n" % len(items) + b"".join(items)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channels: set = set()
+        try:
+            while True:
+                try:
+                    args = await _read_reply(reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    break
+                if isinstance(args, list) and args:
+                    writer.write(self._execute(args, writer, channels))
+                else:
+                    writer.write("-ERR comando inválido\r\n".encode("utf-8"))
+                await writer.drain()
+        finally:
+            for channel in channels:
+                self._subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+    def _execute(self, args: List[bytes], writer: asyncio.StreamWriter, channels: set) -> bytes:
+        command = args[0].upper()
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command in (b"AUTH", b"SELECT"):
+            return b"+OK\r\n"
+        if command == b"PUBLISH" and len(args) == 3:
+            frame = self._array([self._bulk(b"message"), self._bulk(args[1]), self._bulk(args[2])])
+            receivers = self._subscribers.get(args[1], set())
+            for subscriber in list(receivers):
+                subscriber.write(frame)
+            return b":%d\r\n" % len(receivers)
+        if command == b"SUBSCRIBE" and len(args) >= 2:
+            replies = []
+            for channel in args[1:]:
+                self._subscribers.setdefault(channel, set()).add(writer)
+                channels.add(channel)
+                replies.append(self._array([
+                    self._bulk(b"subscribe"), self._bulk(channel), b":%d\r\n" % len(channels)
+                ]))
+            return b"".join(replies)
+        if command == b"HSET" and len(args) >= 4 and len(args) % 2 == 0:
+            fields = self._hashes.setdefault(args[1], {})
+            added = 0
+            for i in range(2, len(args), 2):
+                added += args[i] not in fields
+                fields[args[i]] = args[i + 1]
+            return b":%d\r\n" % added
+        if command == b"HDEL" and len(args) >= 3:
+            fields = self._hashes.get(args[1], {})
+            removed = sum(1 for field in args[2:] if fields.pop(field, None) is not None)
+            return b":%d\r\n" % removed
+        if command == b"HGETALL" and len(args) == 2:
+            items = []
+            for field, value in self._hashes.get(args[1], {}).items():
+                items.extend((self._bulk(field), self._bulk(value)))
+            return self._array(items)
+        if command == b"DEL" and len(args) >= 2:
+            removed = sum(1 for key in args[1:] if self._hashes.pop(key, None) is not None)
+            return b":%d\r\n" % removed
+        return b"-ERR comando no soportado: %s\r\n" % command
+
+
+async def _serve(host: str, port: int):
+    server = LocalBrokerServer(host, port)
+    await server.start()
+    print(f"[INFO] Broker local escuchando en redis://{host}:{server.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Broker local compatible con Redis (desarrollo)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
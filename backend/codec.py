@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Codec JSON del tráfico websocket
+Elige automáticamente orjson o msgspec si están instalados y json (stdlib)
+si no. JSON_CODEC=orjson|msgspec|json fuerza una implementación.
+
+Todas las rutas de envío/recepción pasan por aquí, así un mismo mensaje se
+serializa siempre igual (UTF-8 sin escapar, sin espacios).
+
+Los clientes que negocian el subprotocolo MSGPACK_SUBPROTOCOL reciben frames
+binarios MessagePack con claves compactas (ver COMPACT_KEYS).
+"""
+import os
+import json
+from typing import Any, Dict, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # opcional
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # opcional
+    msgspec = None
+
+try:
+    import msgpack
+except ImportError:  # opcional
+    msgpack = None
+
+
+class DecodeError(ValueError):
+    """El mensaje entrante no es JSON válido o no tiene la forma {action, payload}"""
+
+
+# ============================================================
+# MENSAJE ENTRANTE
+# ============================================================
+
+if msgspec is not None:
+    class ClientMessage(msgspec.Struct):
+        """Acción enviada por un cliente: {"action": ..., "payload": {...}}"""
+        action: Optional[str] = None
+        payload: Dict[str, Any] = {}
+else:
+    class ClientMessage:
+        """Acción enviada por un cliente: {"action": ..., "payload": {...}}"""
+        __slots__ = ("action", "payload")
+
+        def __init__(self, action: Optional[str] = None, payload: Optional[Dict[str, Any]] = None):
+            self.action = action
+            self.payload = payload if payload is not None else {}
+
+
+def _message_from_dict(data: Any) -> ClientMessage:
+    if not isinstance(data, dict):
+        raise DecodeError("se esperaba un objeto JSON")
+    action = data.get("action")
+    payload = data.get("payload", {})
+    if action is not None and not isinstance(action, str):
+        raise DecodeError("'action' debe ser texto")
+    if not isinstance(payload, dict):
+        raise DecodeError("'payload' debe ser un objeto")
+    return ClientMessage(action=action, payload=payload)
+
+
+# ============================================================
+# IMPLEMENTACIONES
+# ============================================================
+
+def _select_codec() -> str:
+    requested = os.environ.get("JSON_CODEC", "").strip().lower()
+    available = {
+        "orjson": orjson is not None,
+        "msgspec": msgspec is not None,
+        "json": True,
+    }
+    if requested:
+        if available.get(requested):
+            return requested
+        print(f"[WARN] JSON_CODEC={requested} no disponible, se elige automáticamente")
+    for name in ("orjson", "msgspec", "json"):
+        if available[name]:
+            return name
+    return "json"
+
+
+CODEC_NAME = _select_codec()
+
+if CODEC_NAME == "orjson":
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS  # votos por índice de opción
+
+    def encode(obj: Any) -> str:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS).decode("utf-8")
+
+    def decode(data: Union[str, bytes]) -> Any:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise DecodeError(str(e)) from e
+
+    def decode_message(data: Union[str, bytes]) -> ClientMessage:
+        return _message_from_dict(decode(data))
+
+elif CODEC_NAME == "msgspec":
+    _encoder = msgspec.json.Encoder()
+    _message_decoder = msgspec.json.Decoder(ClientMessage)
+
+    def encode(obj: Any) -> str:
+        return _encoder.encode(obj).decode("utf-8")
+
+    def decode(data: Union[str, bytes]) -> Any:
+        try:
+            return msgspec.json.decode(data)
+        except msgspec.DecodeError as e:
+            raise DecodeError(str(e)) from e
+
+    def decode_message(data: Union[str, bytes]) -> ClientMessage:
+        try:
+            return _message_decoder.decode(data)
+        except msgspec.DecodeError as e:  # incluye ValidationError
+            raise DecodeError(str(e)) from e
+
+else:
+    def encode(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def decode(data: Union[str, bytes]) -> Any:
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError as e:
+            raise DecodeError(str(e)) from e
+
+    def decode_message(data: Union[str, bytes]) -> ClientMessage:
+        return _message_from_dict(decode(data))
+
+
+# ============================================================
+# SUBPROTOCOLO BINARIO (MessagePack)
+# ============================================================
+
+MSGPACK_SUBPROTOCOL = "sapiencial.msgpack.v1"
+
+# Claves compactas de la v1. Cambiar la tabla exige subir la versión del
+# subprotocolo. El sobre {"type", "data"} no se compacta para que el cliente
+# pueda despachar antes de expandir.
+COMPACT_KEYS: Dict[str, str] = {
+    "accumulatedPercentage": "ap",
+    "activityId": "ai",
+    "baseVersion": "bv",
+    "biblicalReference": "br",
+    "changed": "ch",
+    "classification": "cl",
+    "classificationIcon": "ci",
+    "connectedAt": "co",
+    "connectedStudents": "cs",
+    "connectedTeachers": "ct",
+    "correctIndex": "cx",
+    "currentActivity": "cu",
+    "currentActivityId": "ca",
+    "isCorrect": "ic",
+    "lastActivityAt": "la",
+    "motivationalMessage": "mm",
+    "notRespondedCount": "nr",
+    "percentage": "pc",
+    "percentageValue": "pv",
+    "pointsEarned": "pe",
+    "rankedStudents": "rs",
+    "ranking": "rk",
+    "reflections": "rf",
+    "removed": "rm",
+    "respondedCount": "rc",
+    "responseRate": "rr",
+    "responses": "rp",
+    "sessionId": "si",
+    "slideContent": "sc",
+    "status": "st",
+    "studentName": "sn",
+    "studentSessionId": "ss",
+    "timeLimitSeconds": "tl",
+    "totalStudents": "ts",
+    "version": "vr",
+    "voteCounts": "vc",
+}
+_EXPANDED_KEYS: Dict[str, str] = {short: key for key, short in COMPACT_KEYS.items()}
+
+
+def _rename_keys(obj: Any, table: Dict[str, str]) -> Any:
+    if isinstance(obj, dict):
+        # Claves no textuales (votos por índice) como texto, igual que en JSON
+        return {
+            table.get(k, k) if isinstance(k, str) else str(k): _rename_keys(v, table)
+            for k, v in obj.items()
+        }
+    if isinstance(obj, (list, tuple)):
+        return [_rename_keys(v, table) for v in obj]
+    return obj
+
+
+def compact_keys(obj: Any) -> Any:
+    return _rename_keys(obj, COMPACT_KEYS)
+
+
+def expand_keys(obj: Any) -> Any:
+    return _rename_keys(obj, _EXPANDED_KEYS)
+
+
+if msgspec is not None:
+    _msgpack_encode = msgspec.msgpack.encode
+    _msgpack_decode = msgspec.msgpack.decode
+    _MSGPACK_ERRORS: tuple = (msgspec.DecodeError,)
+elif msgpack is not None:
+    def _msgpack_encode(obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def _msgpack_decode(data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+    _MSGPACK_ERRORS = (ValueError, TypeError, msgpack.exceptions.UnpackException)
+else:
+    _msgpack_encode = None
+    _msgpack_decode = None
+    _MSGPACK_ERRORS = ()
+
+# Sin msgspec ni msgpack el servidor no acepta el subprotocolo (todo sigue en JSON)
+MSGPACK_AVAILABLE = _msgpack_encode is not None
+
+
+def encode_binary(obj: Any) -> bytes:
+    """Serializa un mensaje saliente como MessagePack con claves compactas"""
+    return _msgpack_encode(compact_keys(obj))
+
+
+def decode_binary_message(data: bytes) -> ClientMessage:
+    """Decodifica una acción MessagePack (acepta claves compactas o completas)"""
+    try:
+        obj = _msgpack_decode(data)
+    except _MSGPACK_ERRORS as e:
+        raise DecodeError(str(e)) from e
+    return _message_from_dict(expand_keys(obj))
+
+
+# ============================================================
+# NÚMEROS DE SECUENCIA
+# ============================================================
+
+# Un broadcast se serializa una sola vez; el "seq" de cada sesión se agrega
+# al frame ya serializado en lugar de volver a serializar por destinatario.
+
+def with_sequence(text: str, seq: int) -> str:
+    """Agrega "seq" como primera clave de un objeto JSON ya serializado"""
+    if text == "{}":
+        return '{"seq":%d}' % seq
+    return '{"seq":%d,%s' % (seq, text[1:])
+
+
+def with_sequence_binary(data: bytes, seq: int) -> bytes:
+    """Agrega "seq" como primera clave de un mapa MessagePack ya serializado"""
+    head = data[0]
+    if 0x80 <= head <= 0x8e:  # fixmap
+        header, body = bytes((head + 1,)), data[1:]
+    elif head == 0x8f:
+        header, body = b"\xde\x00\x10", data[1:]
+    elif head == 0xde:  # map 16
+        size = int.from_bytes(data[1:3], "big") + 1
+        header = (b"\xde" + size.to_bytes(2, "big")) if size <= 0xffff else (b"\xdf" + size.to_bytes(4, "big"))
+        body = data[3:]
+    elif head == 0xdf:  # map 32
+        header, body = b"\xdf" + (int.from_bytes(data[1:5], "big") + 1).to_bytes(4, "big"), data[5:]
+    else:
+        raise ValueError("El frame MessagePack no es un mapa")
+    return header + _msgpack_encode("seq") + _msgpack_encode(seq) + body
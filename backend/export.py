@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Exportación del progreso guardado (CSV / NDJSON)
+Generadores que recorren el ProgressStore de a un estudiante y producen el
+archivo en trozos de EXPORT_CHUNK_BYTES, así la memoria no crece con la
+cantidad de estudiantes archivados.
+
+Son generadores síncronos a propósito: StreamingResponse los recorre en el
+threadpool de Starlette, de modo que leer el disco y armar las filas no
+bloquea el event loop de la clase en vivo.
+
+Tablas:
+  - students:    una fila por estudiante (en NDJSON, el registro completo)
+  - responses:   una fila por respuesta
+  - reflections: una fila por reflexión
+"""
+import csv
+import io
+import json
+from typing import Any, Callable, Dict, Iterator, List
+
+from storage import ProgressStore
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+STUDENT_COLUMNS = ["name", "accumulated_percentage", "classification", "responses", "correct", "reflections"]
+RESPONSE_COLUMNS = ["student_name", "activity_id", "answer", "is_correct", "percentage_value",
+                    "answered_at", "response_time_ms"]
+REFLECTION_COLUMNS = ["student_name", "id", "topic", "content", "created_at"]
+
+# Celdas que una planilla interpretaría como fórmula
+FORMULA_PREFIXES = ("=", "+", "-", "@")
+
+
+def _cell(value: Any) -> Any:
+    """Valor de una celda CSV (listas/objetos como JSON; texto sin fórmulas)"""
+    if isinstance(value, str):
+        return "'" + value if value.startswith(FORMULA_PREFIXES) else value
+    if isinstance(value, (list, dict)):
+        return _cell(json.dumps(value, ensure_ascii=False))
+    return value
+
+
+# ============================================================
+# FILAS POR TABLA
+# ============================================================
+
+def student_rows(record: Dict, classify: Callable[[float], str]) -> Iterator[tuple]:
+    responses = record.get("responses", {})
+    percentage = record.get("accumulated_percentage", 0.0)
+    yield (
+        record.get("name"),
+        percentage,
+        classify(percentage),
+        len(responses),
+        sum(1 for r in responses.values() if r.get("is_correct")),
+        len(record.get("reflections", [])),
+    )
+
+
+def response_rows(record: Dict, classify: Callable[[float], str]) -> Iterator[tuple]:
+    name = record.get("name")
+    for activity_id, response in record.get("responses", {}).items():
+        yield (
+            name,
+            response.get("activity_id", activity_id),
+            response.get("answer"),
+            bool(response.get("is_correct")),
+            response.get("percentage_value"),
+            response.get("answered_at"),
+            response.get("response_time_ms"),
+        )
+
+
+def reflection_rows(record: Dict, classify: Callable[[float], str]) -> Iterator[tuple]:
+    name = record.get("name")
+    for reflection in record.get("reflections", []):
+        yield (
+            name,
+            reflection.get("id"),
+            reflection.get("topic"),
+            reflection.get("content"),
+            reflection.get("created_at"),
+        )
+
+
+# tabla -> (columnas, filas en el orden de las columnas)
+EXPORT_TABLES: Dict[str, tuple] = {
+    "students": (STUDENT_COLUMNS, student_rows),
+    "responses": (RESPONSE_COLUMNS, response_rows),
+    "reflections": (REFLECTION_COLUMNS, reflection_rows),
+}
+
+
+# ============================================================
+# GENERADORES
+# ============================================================
+
+def _chunked(lines: Iterator[str], chunk_bytes: int) -> Iterator[bytes]:
+    """Agrupa líneas en trozos de ~chunk_bytes (menos saltos al threadpool)"""
+    buffer: List[str] = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def _csv_lines(store: ProgressStore, table: str, classify: Callable[[float], str]) -> Iterator[str]:
+    columns, rows = EXPORT_TABLES[table]
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\r\n")
+    out.write("\ufeff")  # BOM: las planillas abren el UTF-8 con acentos
+    writer.writerow(columns)
+    for record in store.iter_students():
+        writer.writerows([_cell(value) for value in row] for row in rows(record, classify))
+        if out.tell():
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    if out.tell():
+        yield out.getvalue()
+
+
+def _ndjson_lines(store: ProgressStore, table: str, classify: Callable[[float], str]) -> Iterator[str]:
+    columns, rows = EXPORT_TABLES[table]
+    for record in store.iter_students():
+        if table == "students":
+            # Registro completo: respuestas y reflexiones anidadas
+            percentage = record.get("accumulated_percentage", 0.0)
+            items = [{**record, "classification": classify(percentage)}]
+        else:
+            items = (dict(zip(columns, row)) for row in rows(record, classify))
+        for item in items:
+            yield json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def iter_export(store: ProgressStore, table: str, export_format: str,
+                classify: Callable[[float], str], chunk_bytes: int = EXPORT_CHUNK_BYTES) -> Iterator[bytes]:
+    """Contenido del archivo de exportación, en trozos (bloqueante: recorrer fuera del loop)"""
+    lines = _csv_lines if export_format == "csv" else _ndjson_lines
+    return _chunked(lines(store, table, classify), chunk_bytes)
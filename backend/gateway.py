@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Gateway de enrutamiento por aula
+Reparte las aulas entre varios nodos backend (cada uno un `uvicorn main:app`)
+con hashing consistente sobre el código de clase: todas las conexiones de un
+aula van al mismo nodo y, al agregar o quitar un nodo, solo cambian de dueño
+las aulas del tramo del anillo afectado.
+
+Reenvía /ws/student y /ws/teacher (texto y binario, con el subprotocolo que
+negocie el cliente). Cuando un aula cambia de nodo se cierran sus conexiones
+con 1012 para que los clientes reconecten al nodo nuevo.
+
+El resto de las rutas HTTP (/students, /validate-name, /export/..., /reports...)
+se reenvían al nodo del `classCode` de la query (GENERAL si falta), con la
+respuesta en streaming.
+
+    uvicorn main:app --port 8101 &
+    uvicorn main:app --port 8102 &
+    GATEWAY_NODES=http://127.0.0.1:8101,http://127.0.0.1:8102 uvicorn gateway:app --port 8000
+
+Los nodos no comparten memoria: para que un aula conserve el progreso al
+moverse, los nodos deben usar el mismo BROKER_URL y PROGRESS_STORE=sqlite
+sobre un archivo compartido (ver DEPLOY_GUIDE.md).
+"""
+import os
+import asyncio
+import bisect
+import hashlib
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+import httpx
+import websockets
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+# Nodos backend separados por coma (http://host:puerto)
+GATEWAY_NODES = os.environ.get("GATEWAY_NODES", "http://127.0.0.1:8101")
+# Puntos virtuales por nodo en el anillo (más puntos = reparto más parejo)
+GATEWAY_VIRTUAL_NODES = int(os.environ.get("GATEWAY_VIRTUAL_NODES", "160"))
+# Token para agregar/quitar nodos en caliente (vacío = deshabilitado)
+GATEWAY_ADMIN_TOKEN = os.environ.get("GATEWAY_ADMIN_TOKEN", "")
+# Máximo para conectar con el nodo antes de rechazar al cliente
+UPSTREAM_CONNECT_TIMEOUT_SECONDS = 5.0
+# Máximo de espera entre bytes de una respuesta HTTP del nodo
+UPSTREAM_READ_TIMEOUT_SECONDS = 60.0
+# Cabeceras propias de cada tramo de la conexión (no se reenvían)
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+# Debe coincidir con main.py (clientes sin classCode)
+DEFAULT_CLASS_CODE = "GENERAL"
+
+
+def normalize_class_code(class_code: Optional[str]) -> str:
+    """Mismo código que usa el backend para elegir el aula"""
+    return (class_code or DEFAULT_CLASS_CODE).strip().upper()
+
+
+def normalize_node(url: str) -> str:
+    return url.strip().rstrip("/")
+
+
+# ============================================================
+# ANILLO DE HASHING CONSISTENTE
+# ============================================================
+
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Anillo de hashing consistente con nodos virtuales.
+
+    node_for() es O(log n) (búsqueda binaria sobre los puntos ordenados).
+    Agregar un nodo solo mueve a él las claves de sus propios tramos; quitarlo
+    solo reparte las claves que tenía.
+    """
+    def __init__(self, nodes: List[str] = (), virtual_nodes: int = GATEWAY_VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self.nodes: Set[str] = set()
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes:
+            self.add_node(node)
+
+    def _rebuild(self, entries: List[Tuple[int, str]]):
+        entries.sort()
+        self._points = [point for point, _ in entries]
+        self._owners = [node for _, node in entries]
+
+    def add_node(self, node: str) -> bool:
+        if node in self.nodes:
+            return False
+        self.nodes.add(node)
+        entries = list(zip(self._points, self._owners))
+        entries.extend((_ring_hash(f"{node}#{i}"), node) for i in range(self.virtual_nodes))
+        self._rebuild(entries)
+        return True
+
+    def remove_node(self, node: str) -> bool:
+        if node not in self.nodes:
+            return False
+        self.nodes.discard(node)
+        self._rebuild([(p, n) for p, n in zip(self._points, self._owners) if n != node])
+        return True
+
+    def node_for(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _ring_hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+# ============================================================
+# PROXY WEBSOCKET
+# ============================================================
+
+class ProxySession:
+    """Conexión cliente <-> nodo de un aula"""
+    def __init__(self, websocket: WebSocket, class_code: str, node: str):
+        self.websocket = websocket
+        self.class_code = class_code
+        self.node = node
+        self.upstream: Optional[websockets.WebSocketClientProtocol] = None
+        self.moved = False
+
+    async def _client_to_upstream(self):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                await self.upstream.send(message["bytes"])
+            elif message.get("text") is not None:
+                await self.upstream.send(message["text"])
+
+    async def _upstream_to_client(self):
+        async for data in self.upstream:
+            if isinstance(data, bytes):
+                await self.websocket.send_bytes(data)
+            else:
+                await self.websocket.send_text(data)
+
+    async def run(self, upstream_url: str, subprotocols: List[str]):
+        try:
+            self.upstream = await asyncio.wait_for(
+                websockets.connect(upstream_url, subprotocols=subprotocols or None, max_size=None),
+                UPSTREAM_CONNECT_TIMEOUT_SECONDS,
+            )
+        except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake) as e:
+            print(f"[ERROR] Nodo {self.node} no disponible para el aula {self.class_code}: {e}")
+            await self.websocket.accept()
+            await self.websocket.send_json({
+                "type": "ERROR",
+                "data": {"message": "Servidor del aula no disponible", "code": "NODE_UNAVAILABLE"}
+            })
+            await self.websocket.close(code=1013)
+            return
+        # Se acepta con el subprotocolo que eligió el nodo
+        await self.websocket.accept(subprotocol=self.upstream.subprotocol)
+        tasks = [
+            asyncio.create_task(self._client_to_upstream()),
+            asyncio.create_task(self._upstream_to_client()),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.upstream.close()
+            await self.close(self._client_close_code())
+
+    def _client_close_code(self) -> int:
+        """Propaga el código de cierre del nodo (1005/1006 no se pueden enviar)"""
+        code = self.upstream.close_code
+        if code is None or code == 1005:
+            return 1000
+        if code == 1006:
+            return 1011
+        return code
+
+    async def close(self, code: int = 1000):
+        try:
+            await self.websocket.close(code=code)
+        except (RuntimeError, WebSocketDisconnect):
+            pass  # Ya cerrado
+
+
+class Gateway:
+    """Enruta cada aula a un nodo y lleva la cuenta de las conexiones activas"""
+    def __init__(self, nodes: List[str]):
+        self.ring = HashRing(nodes)
+        self.sessions: Dict[str, Set[ProxySession]] = {}  # class_code -> sesiones
+        self.http: Optional[httpx.AsyncClient] = None
+
+    def node_for(self, class_code: str) -> Optional[str]:
+        return self.ring.node_for(class_code)
+
+    def upstream_url(self, node: str, path: str, query: Dict[str, str]) -> str:
+        base = "ws" + node[len("http"):] if node.startswith("http") else node
+        return f"{base}{path}?{urlencode(query)}" if query else f"{base}{path}"
+
+    async def proxy(self, websocket: WebSocket, path: str):
+        class_code = normalize_class_code(websocket.query_params.get("classCode"))
+        node = self.node_for(class_code)
+        if node is None:
+            await websocket.accept()
+            await websocket.send_json({
+                "type": "ERROR",
+                "data": {"message": "No hay nodos disponibles", "code": "NODE_UNAVAILABLE"}
+            })
+            await websocket.close(code=1013)
+            return
+        query = dict(websocket.query_params)
+        query["classCode"] = class_code
+        session = ProxySession(websocket, class_code, node)
+        self.sessions.setdefault(class_code, set()).add(session)
+        try:
+            await session.run(self.upstream_url(node, path, query), websocket.scope.get("subprotocols", []))
+        finally:
+            sessions = self.sessions.get(class_code)
+            if sessions is not None:
+                sessions.discard(session)
+                if not sessions:
+                    del self.sessions[class_code]
+
+    async def forward(self, request: Request, path: str) -> StreamingResponse:
+        """Reenvía una petición HTTP al nodo del aula (respuesta en streaming)"""
+        class_code = normalize_class_code(request.query_params.get("classCode"))
+        node = self.node_for(class_code)
+        if node is None:
+            raise HTTPException(status_code=503, detail="No hay nodos disponibles")
+        if self.http is None:
+            self.http = httpx.AsyncClient(timeout=httpx.Timeout(
+                UPSTREAM_READ_TIMEOUT_SECONDS, connect=UPSTREAM_CONNECT_TIMEOUT_SECONDS))
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        url = f"{node}/{path}?{request.url.query}" if request.url.query else f"{node}/{path}"
+        upstream_request = self.http.build_request(
+            request.method, url, headers=headers, content=await request.body(),
+        )
+        try:
+            upstream = await self.http.send(upstream_request, stream=True)
+        except httpx.HTTPError as e:
+            print(f"[ERROR] Nodo {node} no disponible para el aula {class_code}: {e}")
+            raise HTTPException(status_code=502, detail="Servidor del aula no disponible")
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers={k: v for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS},
+            background=BackgroundTask(upstream.aclose),
+        )
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+
+    async def _rebalance(self):
+        """Cierra las conexiones de las aulas que cambiaron de nodo"""
+        moved = 0
+        for class_code, sessions in list(self.sessions.items()):
+            owner = self.ring.node_for(class_code)
+            for session in list(sessions):
+                if session.node != owner and not session.moved:
+                    session.moved = True
+                    moved += 1
+                    await session.close(code=1012)  # Service Restart: reconectar
+        if moved:
+            print(f"[INFO] {moved} conexiones reasignadas a otro nodo")
+        return moved
+
+    async def add_node(self, node: str) -> int:
+        if not self.ring.add_node(node):
+            return 0
+        print(f"[INFO] Nodo agregado: {node} (Total: {len(self.ring.nodes)})")
+        return await self._rebalance()
+
+    async def remove_node(self, node: str) -> int:
+        if not self.ring.remove_node(node):
+            return 0
+        print(f"[INFO] Nodo quitado: {node} (Total: {len(self.ring.nodes)})")
+        return await self._rebalance()
+
+
+gateway = Gateway([normalize_node(url) for url in GATEWAY_NODES.split(",") if url.strip()])
+
+# ============================================================
+# APP
+# ============================================================
+
+app = FastAPI(title="Sapiencial Gateway")
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await gateway.close()
+
+
+@app.get("/health")
+def health():
+    return {"status": "healthy", "nodes": sorted(gateway.ring.nodes)}
+
+
+@app.get("/route")
+async def get_route(class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")):
+    """Nodo que atiende un aula"""
+    code = normalize_class_code(class_code)
+    return {"classCode": code, "node": gateway.node_for(code)}
+
+
+@app.get("/nodes")
+async def get_nodes():
+    """Nodos del anillo y conexiones activas por aula"""
+    return {
+        "nodes": sorted(gateway.ring.nodes),
+        "rooms": {
+            code: {"node": gateway.node_for(code), "connections": len(sessions)}
+            for code, sessions in gateway.sessions.items()
+        },
+    }
+
+
+def _check_admin(token: str):
+    if not GATEWAY_ADMIN_TOKEN or token != GATEWAY_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Token inválido")
+
+
+@app.post("/nodes")
+async def add_node(url: str = Query(...), token: str = Query(default="")):
+    """Agrega un nodo; las aulas que pasan a él reconectan"""
+    _check_admin(token)
+    moved = await gateway.add_node(normalize_node(url))
+    return {"nodes": sorted(gateway.ring.nodes), "movedConnections": moved}
+
+
+@app.delete("/nodes")
+async def remove_node(url: str = Query(...), token: str = Query(default="")):
+    """Quita un nodo; sus aulas reconectan a los que quedan"""
+    _check_admin(token)
+    moved = await gateway.remove_node(normalize_node(url))
+    return {"nodes": sorted(gateway.ring.nodes), "movedConnections": moved}
+
+
+@app.websocket("/ws/student")
+async def student_proxy(websocket: WebSocket):
+    await gateway.proxy(websocket, "/ws/student")
+
+
+@app.websocket("/ws/teacher")
+async def teacher_proxy(websocket: WebSocket):
+    await gateway.proxy(websocket, "/ws/teacher")
+
+
+# Al final: las rutas propias del gateway tienen prioridad
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def http_proxy(request: Request, path: str):
+    """Rutas HTTP del backend, en el nodo del classCode"""
+    return await gateway.forward(request, path)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", "8000")))
@@ -1,320 +1,414 @@
 # -*- coding: utf-8 -*-
 """
-Script de Prueba de Carga - 50 Usuarios Simult?neos
-==================================================
-Simula 50 estudiantes conect?ndose simult?neamente al servidor WebSocket
-para verificar la estabilidad del sistema.
+Prueba de carga - docente simulado + miles de estudiantes
+=========================================================
+Un docente simulado repite ciclos REGISTER_ACTIVITY -> UNLOCK_ACTIVITY ->
+LOCK_ACTIVITY -> REVEAL_ANSWER mientras los estudiantes, repartidos en varios
+procesos, se conectan según un perfil de llegada y responden cada actividad.
 
-Uso: python load_test.py [URL_DEL_SERVIDOR]
-Por defecto usa localhost:8000
+Mide latencias por tipo de mensaje (p50/p95/p99), en particular el fan-out
+desbloqueo -> entrega (ACTIVITY_UNLOCKED) a toda la clase, y escribe un
+reporte JSON para comparar corridas.
 
-Autor: Sistema de Pruebas Sapiencial App
+Uso:
+    python load_test.py ws://localhost:8000 -n 2000 -p 4 --profile ramp -d 60 --report run.json
+
+Perfiles de llegada (--profile):
+    ramp   llegada lineal durante --ramp-seconds
+    step   --steps tandas iguales repartidas en --ramp-seconds
+    spike  todos a la vez (--ramp-seconds ignorado)
+
+Los relojes de docente y estudiantes son el mismo (time.time() de la
+máquina): correr el script en un solo host.
 """
 
+import argparse
 import asyncio
-import websockets
 import json
-import time
+import math
+import os
 import random
-import statistics
-from datetime import datetime
-from typing import List, Dict, Tuple
-import argparse
 import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List
 
-# Configuraci?n de la prueba
+import websockets
+
+# Configuración por defecto
 NUM_STUDENTS = 50
-CONNECTION_DELAY_MS = 50  # Delay entre conexiones para simular llegada gradual
-TEST_DURATION_SECONDS = 30  # Duraci?n total de la prueba
-ACTIVITY_RESPONSE_DELAY_MS = (500, 3000)  # Rango de tiempo de respuesta simulado
-
-# Nombres de prueba
-NOMBRES_PRUEBA = [
-    "Mar?a Garc?a", "Juan Prez", "Ana Mart?nez", "Carlos L?pez", "Laura S?nchez",
-    "Pedro Rodr?guez", "Sof?a Hern?ndez", "Miguel Gonz?lez", "Carmen D?az", "Jos Ruiz",
-    "Isabel Moreno", "David Mu?oz", "Elena ?lvarez", "Francisco Romero", "Luc?a Torres",
-    "Antonio Navarro", "Paula Dom?nguez", "Manuel V?zquez", "Sara Ramos", "Javier Gil",
-    "Raquel Serrano", "Alberto Blanco", "Marta Molina", "Fernando Castro", "Beatriz Ortega",
-    "Sergio Delgado", "Cristina Rubio", "Diego Mar?n", "Andrea Sanz", "Pablo Iglesias",
-    "M?nica Medina", "Alejandro Reyes", "Clara Jimnez", "Rubn Garrido", "Patricia Vargas",
-    "Daniel Flores", "Nuria Pascual", "Adri?n Herrero", "Eva Montero", "?scar Cano",
-    "Silvia Le?n", "Iv?n Prieto", "Teresa Cabrera", "Roberto Campos", "Ins Vega",
-    "V?ctor Nieto", "Rosa Carrasco", "Guillermo Santos", "Julia Fuentes", "Emilio Guerrero"
-]
-
-# Estad?sticas globales
-stats = {
-    "connections_attempted": 0,
-    "connections_successful": 0,
-    "connections_failed": 0,
-    "registrations_successful": 0,
-    "registrations_failed": 0,
-    "responses_sent": 0,
-    "responses_confirmed": 0,
-    "errors": [],
-    "connection_times": [],
-    "registration_times": [],
-    "response_times": [],
-    "start_time": None,
-    "end_time": None,
+NUM_PROCESSES = max(1, min(4, os.cpu_count() or 1))
+TEST_DURATION_SECONDS = 30  # Desde el primer estudiante hasta el cierre
+RAMP_SECONDS = 10.0  # Ventana de llegada de los perfiles ramp/step
+STEP_COUNT = 4
+ANSWER_WINDOW_SECONDS = 4.0  # Actividad desbloqueada antes de bloquearla
+THINK_TIME_MS = (300, 2500)  # Rango de "tiempo de pensar" de un estudiante
+CYCLE_PAUSE_SECONDS = 1.0  # Pausa entre revelar la respuesta y la siguiente actividad
+RECV_TIMEOUT_SECONDS = 15.0
+TEACHER_TOKEN = "profesor2026"
+
+# Tipos medidos contra el mensaje del docente que los provoca
+TEACHER_TRIGGERED = {
+    "ACTIVITY_UNLOCKED": "unlock",
+    "ACTIVITY_LOCKED": "lock",
+    "ANSWER_REVEALED": "reveal",
 }
 
 
-async def simulate_student(student_id: int, ws_url: str, activity_id: str = None):
-    """Simula un estudiante individual"""
-    name = NOMBRES_PRUEBA[student_id] if student_id < len(NOMBRES_PRUEBA) else f"Estudiante_{student_id}"
-    session_id = None
-    
+# ============================================================
+# PERFILES DE LLEGADA
+# ============================================================
+
+def arrival_offsets(profile: str, count: int, ramp_seconds: float, steps: int = STEP_COUNT) -> List[float]:
+    """Segundos desde el inicio en que se conecta cada estudiante"""
+    if count <= 0:
+        return []
+    if profile == "spike":
+        return [0.0] * count
+    if profile == "step":
+        steps = max(1, steps)
+        step_gap = ramp_seconds / steps
+        return [(i * steps // count) * step_gap for i in range(count)]
+    if profile == "ramp":
+        return [ramp_seconds * i / count for i in range(count)]
+    raise ValueError(f"Perfil desconocido: {profile}")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(values_ms: List[float]) -> Dict:
+    ordered = sorted(values_ms)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        "p50": round(percentile(ordered, 50), 2),
+        "p95": round(percentile(ordered, 95), 2),
+        "p99": round(percentile(ordered, 99), 2),
+        "max": round(ordered[-1], 2),
+        "mean": round(sum(ordered) / len(ordered), 2),
+    }
+
+
+def ws_endpoint(base_url: str, path: str, **query: str) -> str:
+    params = "&".join(f"{key}={value}" for key, value in query.items() if value)
+    return f"{base_url}{path}?{params}" if params else f"{base_url}{path}"
+
+
+# ============================================================
+# ESTUDIANTES (un proceso por shard)
+# ============================================================
+
+class ShardStats:
+    """Resultados de un proceso de estudiantes (se devuelven como dict al padre)"""
+    def __init__(self):
+        self.connections_attempted = 0
+        self.connections_successful = 0
+        self.registrations_successful = 0
+        self.answers_sent = 0
+        self.answers_confirmed = 0
+        self.answers_rejected = 0
+        self.errors: Counter = Counter()
+        self.received: Counter = Counter()  # tipo -> mensajes recibidos
+        self.latencies: Dict[str, List[float]] = defaultdict(list)  # tipo -> ms (petición propia)
+        self.deliveries: List[tuple] = []  # (tipo, activityId, time.time() de recepción)
+
+    def to_dict(self) -> Dict:
+        return {
+            "connections_attempted": self.connections_attempted,
+            "connections_successful": self.connections_successful,
+            "registrations_successful": self.registrations_successful,
+            "answers_sent": self.answers_sent,
+            "answers_confirmed": self.answers_confirmed,
+            "answers_rejected": self.answers_rejected,
+            "errors": dict(self.errors),
+            "received": dict(self.received),
+            "latencies": dict(self.latencies),
+            "deliveries": self.deliveries,
+        }
+
+
+async def simulate_student(name: str, url: str, start_at: float, end_at: float, stats: ShardStats):
+    """Un estudiante: conecta, se registra y responde cada actividad desbloqueada"""
+    delay = start_at - time.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    stats.connections_attempted += 1
+    sent_at: Dict[str, float] = {}  # tipo de respuesta esperada -> perf_counter del envío
+    started = time.perf_counter()
     try:
-        # Conexi?n
-        stats["connections_attempted"] += 1
-        connect_start = time.perf_counter()
-        
-        async with websockets.connect(ws_url, ping_interval=20, ping_timeout=10) as ws:
-            connect_time = (time.perf_counter() - connect_start) * 1000
-            stats["connection_times"].append(connect_time)
-            stats["connections_successful"] += 1
-            print(f"? [{student_id:02d}] {name} conectado ({connect_time:.1f}ms)")
-            
-            # Registro
-            reg_start = time.perf_counter()
-            await ws.send(json.dumps({
-                "action": "REGISTER",
-                "payload": {"name": name, "reconnect": False}
-            }))
-            
-            # Esperar respuesta de registro
-            try:
-                response = await asyncio.wait_for(ws.recv(), timeout=10.0)
-                response_data = json.loads(response)
-                reg_time = (time.perf_counter() - reg_start) * 1000
-                stats["registration_times"].append(reg_time)
-                
-                if response_data.get("type") == "REGISTRATION_SUCCESS":
-                    session_id = response_data.get("data", {}).get("sessionId")
-                    stats["registrations_successful"] += 1
-                    print(f"  ? [{student_id:02d}] Registrado: {session_id} ({reg_time:.1f}ms)")
-                elif response_data.get("type") == "REGISTRATION_ERROR":
-                    stats["registrations_failed"] += 1
-                    error_msg = response_data.get("data", {}).get("message", "Unknown")
-                    print(f"  ? [{student_id:02d}] Error registro: {error_msg}")
-                    return
-                else:
-                    # Mensaje inesperado, continuar escuchando
-                    pass
-                    
-            except asyncio.TimeoutError:
-                stats["registrations_failed"] += 1
-                print(f"  ? [{student_id:02d}] Timeout en registro")
-                return
-            
-            # Mantener conexi?n activa y responder a actividades
-            remaining_time = TEST_DURATION_SECONDS
-            while remaining_time > 0:
+        async with websockets.connect(url, ping_interval=None, max_size=None, open_timeout=30) as ws:
+            stats.latencies["CONNECT"].append((time.perf_counter() - started) * 1000)
+            stats.connections_successful += 1
+            while time.time() < end_at:
                 try:
-                    message = await asyncio.wait_for(ws.recv(), timeout=5.0)
-                    data = json.loads(message)
-                    msg_type = data.get("type")
-                    
-                    if msg_type == "ACTIVITY_UNLOCKED":
-                        # Simular respuesta con delay aleatorio
-                        activity = data.get("data", {})
-                        act_id = activity.get("id")
-                        options_count = len(activity.get("options", []))
-                        
-                        # Delay aleatorio para simular pensamiento
-                        delay = random.randint(*ACTIVITY_RESPONSE_DELAY_MS) / 1000
-                        await asyncio.sleep(delay)
-                        
-                        # Enviar respuesta
-                        answer = random.randint(0, max(0, options_count - 1))
-                        resp_start = time.perf_counter()
-                        
-                        await ws.send(json.dumps({
-                            "action": "SUBMIT_ANSWER",
-                            "payload": {
-                                "activityId": act_id,
-                                "answer": answer,
-                                "responseTimeMs": int(delay * 1000)
-                            }
-                        }))
-                        stats["responses_sent"] += 1
-                        
-                        # Esperar confirmaci?n
-                        try:
-                            confirm = await asyncio.wait_for(ws.recv(), timeout=5.0)
-                            confirm_data = json.loads(confirm)
-                            if confirm_data.get("type") == "ANSWER_RECEIVED":
-                                resp_time = (time.perf_counter() - resp_start) * 1000
-                                stats["response_times"].append(resp_time)
-                                stats["responses_confirmed"] += 1
-                                print(f"  ?? [{student_id:02d}] Respuesta enviada ({resp_time:.1f}ms)")
-                        except asyncio.TimeoutError:
-                            pass
-                    
-                    elif msg_type == "STATE_UPDATE" or msg_type == "SLIDE_UPDATE":
-                        # Actualizaci?n de estado, ignorar
-                        pass
-                    
+                    raw = await asyncio.wait_for(ws.recv(), min(RECV_TIMEOUT_SECONDS, max(0.1, end_at - time.time())))
                 except asyncio.TimeoutError:
-                    # Sin mensajes, continuar
-                    remaining_time -= 5
                     continue
-                except websockets.ConnectionClosed:
-                    print(f"  ? [{student_id:02d}] Conexi?n cerrada")
-                    break
-                    
-    except websockets.exceptions.InvalidStatusCode as e:
-        stats["connections_failed"] += 1
-        stats["errors"].append(f"[{student_id}] HTTP Error: {e}")
-        print(f"? [{student_id:02d}] {name} - Error HTTP: {e}")
-    except ConnectionRefusedError:
-        stats["connections_failed"] += 1
-        stats["errors"].append(f"[{student_id}] Conexi?n rechazada")
-        print(f"? [{student_id:02d}] {name} - Conexi?n rechazada")
-    except Exception as e:
-        stats["connections_failed"] += 1
-        stats["errors"].append(f"[{student_id}] {type(e).__name__}: {str(e)}")
-        print(f"? [{student_id:02d}] {name} - Error: {e}")
-
-
-async def run_load_test(ws_url: str, num_students: int = NUM_STUDENTS):
-    """Ejecuta la prueba de carga completa"""
-    print("=" * 60)
-    print("?? PRUEBA DE CARGA - Sistema Sapiencial App")
-    print("=" * 60)
-    print(f"?? Configuraci?n:")
-    print(f"    Estudiantes: {num_students}")
-    print(f"    URL: {ws_url}")
-    print(f"    Duraci?n: {TEST_DURATION_SECONDS}s")
-    print(f"    Delay entre conexiones: {CONNECTION_DELAY_MS}ms")
-    print("=" * 60)
-    print()
-    
-    stats["start_time"] = datetime.now()
-    
-    # Crear tareas para todos los estudiantes
-    tasks = []
-    for i in range(num_students):
-        task = asyncio.create_task(simulate_student(i, ws_url))
-        tasks.append(task)
-        # Delay gradual entre conexiones
-        await asyncio.sleep(CONNECTION_DELAY_MS / 1000)
-    
-    # Esperar que todas las tareas terminen
-    await asyncio.gather(*tasks, return_exceptions=True)
-    
-    stats["end_time"] = datetime.now()
-    
-    # Mostrar resultados
-    print_results()
-
-
-def print_results():
-    """Imprime los resultados de la prueba"""
-    duration = (stats["end_time"] - stats["start_time"]).total_seconds()
-    
-    print()
+                received_at = time.time()
+                message = json.loads(raw)
+                msg_type = message.get("type")
+                data = message.get("data") or {}
+                stats.received[msg_type] += 1
+                if msg_type in sent_at:
+                    stats.latencies[msg_type].append((time.perf_counter() - sent_at.pop(msg_type)) * 1000)
+
+                if msg_type == "REGISTRATION_REQUIRED":
+                    sent_at["REGISTRATION_SUCCESS"] = time.perf_counter()
+                    await ws.send(json.dumps({"action": "REGISTER", "payload": {"name": name}}))
+                elif msg_type == "REGISTRATION_SUCCESS":
+                    stats.registrations_successful += 1
+                elif msg_type == "REGISTRATION_ERROR":
+                    stats.errors["registration"] += 1
+                    return
+                elif msg_type in TEACHER_TRIGGERED:
+                    activity_id = data.get("id") or data.get("activityId")
+                    stats.deliveries.append((msg_type, activity_id, received_at))
+                    if msg_type == "ACTIVITY_UNLOCKED":
+                        asyncio.create_task(answer_later(ws, data, sent_at, stats))
+                elif msg_type == "ANSWER_RECEIVED":
+                    stats.answers_confirmed += 1
+                elif msg_type == "ERROR":
+                    if sent_at.pop("ANSWER_RECEIVED", None) is not None:
+                        # Respuesta rechazada (actividad cerrada o fuera de tiempo)
+                        stats.answers_rejected += 1
+                    stats.errors[data.get("code") or data.get("message", "ERROR")] += 1
+    except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake) as e:
+        stats.errors[f"connect:{type(e).__name__}"] += 1
+    except websockets.ConnectionClosed as e:
+        stats.errors[f"closed:{e.code}"] += 1
+
+
+async def answer_later(ws, activity: Dict, sent_at: Dict[str, float], stats: ShardStats):
+    think = random.randint(*THINK_TIME_MS) / 1000
+    await asyncio.sleep(think)
+    options = activity.get("options") or [None]
+    try:
+        sent_at["ANSWER_RECEIVED"] = time.perf_counter()
+        await ws.send(json.dumps({
+            "action": "SUBMIT_ANSWER",
+            "payload": {
+                "activityId": activity.get("id"),
+                "answer": random.randrange(len(options)),
+                "responseTimeMs": int(think * 1000),
+            }
+        }))
+        stats.answers_sent += 1
+    except websockets.ConnectionClosed:
+        pass
+
+
+def run_student_shard(shard: int, url: str, offsets: List[float], start_epoch: float,
+                      end_epoch: float) -> Dict:
+    """Punto de entrada de cada proceso de estudiantes"""
+    stats = ShardStats()
+
+    async def run():
+        await asyncio.gather(*(
+            simulate_student(f"Carga {shard}-{i}", url, start_epoch + offset, end_epoch, stats)
+            for i, offset in enumerate(offsets)
+        ))
+
+    asyncio.run(run())
+    return stats.to_dict()
+
+
+# ============================================================
+# DOCENTE
+# ============================================================
+
+async def simulate_teacher(url: str, first_unlock_at: float, end_at: float) -> Dict:
+    """Ciclos de actividad; devuelve la hora de envío de cada comando por actividad"""
+    sent: Dict[str, Dict[str, float]] = defaultdict(dict)  # activityId -> {unlock|lock|reveal: time.time()}
+    async with websockets.connect(url, ping_interval=None, max_size=None) as ws:
+        async def drain():
+            async for _ in ws:
+                pass  # El docente solo genera carga; sus mensajes no se miden
+        drainer = asyncio.create_task(drain())
+        await asyncio.sleep(max(0.0, first_unlock_at - time.time()))
+        cycle = 0
+        while time.time() + ANSWER_WINDOW_SECONDS + CYCLE_PAUSE_SECONDS < end_at:
+            cycle += 1
+            activity_id = f"carga-{int(first_unlock_at)}-{cycle}"
+            await ws.send(json.dumps({"action": "REGISTER_ACTIVITY", "payload": {
+                "activityId": activity_id,
+                "question": f"Pregunta de carga {cycle}",
+                "options": ["A", "B", "C", "D"],
+                "correctIndex": cycle % 4,
+                "percentageValue": 5,
+            }}))
+            for command, key in (("UNLOCK_ACTIVITY", "unlock"), ("LOCK_ACTIVITY", "lock"),
+                                 ("REVEAL_ANSWER", "reveal")):
+                sent[activity_id][key] = time.time()
+                await ws.send(json.dumps({"action": command, "payload": {"activityId": activity_id}}))
+                await asyncio.sleep(ANSWER_WINDOW_SECONDS if key == "unlock" else 0.2)
+            await asyncio.sleep(CYCLE_PAUSE_SECONDS)
+        drainer.cancel()
+    return sent
+
+
+# ============================================================
+# CORRIDA Y REPORTE
+# ============================================================
+
+async def run_load_test(args) -> Dict:
+    base_url = args.url.rstrip("/")
+    if base_url.endswith("/ws/student"):  # Compatibilidad con la URL de la versión anterior
+        base_url = base_url[:-len("/ws/student")]
+    student_url = ws_endpoint(base_url, "/ws/student", classCode=args.class_code)
+    teacher_url = ws_endpoint(base_url, "/ws/teacher", token=args.token, classCode=args.class_code)
+
+    offsets = arrival_offsets(args.profile, args.num_students, args.ramp_seconds, args.steps)
+    shards = [offsets[i::args.processes] for i in range(args.processes)]
+    start_epoch = time.time() + 2.0  # Margen para arrancar los procesos
+    end_epoch = start_epoch + args.duration
+    # El primer desbloqueo espera a que llegue toda la clase
+    first_unlock_at = start_epoch + (max(offsets) if offsets else 0) + 1.0
+
     print("=" * 60)
-    print("?? RESULTADOS DE LA PRUEBA DE CARGA")
+    print(f"PRUEBA DE CARGA - {args.num_students} estudiantes, {args.processes} procesos, perfil {args.profile}")
+    print(f"Servidor: {base_url}  Duración: {args.duration}s")
     print("=" * 60)
+
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = [
+            loop.run_in_executor(pool, run_student_shard, i, student_url, shard, start_epoch, end_epoch)
+            for i, shard in enumerate(shards) if shard
+        ]
+        teacher_sent = await simulate_teacher(teacher_url, first_unlock_at, end_epoch)
+        shard_results = await asyncio.gather(*futures)
+
+    return build_report(args, shard_results, teacher_sent, start_epoch, end_epoch)
+
+
+def build_report(args, shard_results: List[Dict], teacher_sent: Dict[str, Dict[str, float]],
+                 start_epoch: float, end_epoch: float) -> Dict:
+    totals = Counter()
+    errors = Counter()
+    received = Counter()
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    fanout: Dict[str, List[float]] = defaultdict(list)  # activityId -> ms de cada entrega del unlock
+    for result in shard_results:
+        for key in ("connections_attempted", "connections_successful", "registrations_successful",
+                    "answers_sent", "answers_confirmed", "answers_rejected"):
+            totals[key] += result[key]
+        errors.update(result["errors"])
+        received.update(result["received"])
+        for msg_type, values in result["latencies"].items():
+            latencies[msg_type].extend(values)
+        for msg_type, activity_id, received_at in result["deliveries"]:
+            sent_at = teacher_sent.get(activity_id, {}).get(TEACHER_TRIGGERED[msg_type])
+            if sent_at is None:
+                continue
+            latency_ms = (received_at - sent_at) * 1000
+            latencies[msg_type].append(latency_ms)
+            if msg_type == "ACTIVITY_UNLOCKED":
+                fanout[activity_id].append(latency_ms)
+
+    duration = max(0.001, end_epoch - start_epoch)
+    registered = totals["registrations_successful"]
+    return {
+        "generatedAt": datetime.now().isoformat(),
+        "config": {
+            "url": args.url,
+            "students": args.num_students,
+            "processes": args.processes,
+            "profile": args.profile,
+            "rampSeconds": args.ramp_seconds,
+            "steps": args.steps,
+            "durationSeconds": args.duration,
+            "classCode": args.class_code,
+        },
+        "totals": dict(totals),
+        "errors": dict(errors),
+        "messagesReceived": dict(received),
+        "messagesPerSecond": round(sum(received.values()) / duration, 1),
+        "latencyMs": {msg_type: summarize(values) for msg_type, values in sorted(latencies.items())},
+        "fanout": [
+            {
+                "activityId": activity_id,
+                "delivered": len(values),
+                "expected": registered,
+                # Tiempo hasta que el último estudiante recibió el desbloqueo
+                "completeMs": round(max(values), 2),
+                **{k: v for k, v in summarize(values).items() if k != "count"},
+            }
+            for activity_id, values in fanout.items()
+        ],
+    }
+
+
+def print_report(report: Dict):
+    totals = report["totals"]
     print()
-    
-    # Conexiones
-    print("?? CONEXIONES:")
-    print(f"    Intentadas:  {stats['connections_attempted']}")
-    print(f"    Exitosas:    {stats['connections_successful']} ({100*stats['connections_successful']/max(1,stats['connections_attempted']):.1f}%)")
-    print(f"    Fallidas:    {stats['connections_failed']}")
-    print()
-    
-    # Registros
-    print("?? REGISTROS:")
-    print(f"    Exitosos:    {stats['registrations_successful']} ({100*stats['registrations_successful']/max(1,stats['connections_successful']):.1f}%)")
-    print(f"    Fallidos:    {stats['registrations_failed']}")
-    print()
-    
-    # Respuestas
-    print("?? RESPUESTAS:")
-    print(f"    Enviadas:    {stats['responses_sent']}")
-    print(f"    Confirmadas: {stats['responses_confirmed']}")
-    print()
-    
-    # Tiempos
-    print("??  TIEMPOS DE RESPUESTA:")
-    if stats["connection_times"]:
-        print(f"    Conexi?n promedio:   {statistics.mean(stats['connection_times']):.1f}ms")
-        print(f"    Conexi?n m?xima:     {max(stats['connection_times']):.1f}ms")
-        print(f"    Conexi?n m?nima:     {min(stats['connection_times']):.1f}ms")
-    if stats["registration_times"]:
-        print(f"    Registro promedio:   {statistics.mean(stats['registration_times']):.1f}ms")
-    if stats["response_times"]:
-        print(f"    Respuesta promedio:  {statistics.mean(stats['response_times']):.1f}ms")
-    print()
-    
-    # Rendimiento
-    print("?? RENDIMIENTO:")
-    print(f"    Duraci?n total:      {duration:.1f}s")
-    print(f"    Conexiones/segundo:  {stats['connections_successful']/duration:.1f}")
+    print("RESULTADOS")
+    print("-" * 60)
+    print(f"  Conexiones:  {totals.get('connections_successful', 0)}/{totals.get('connections_attempted', 0)}")
+    print(f"  Registros:   {totals.get('registrations_successful', 0)}")
+    print(f"  Respuestas:  {totals.get('answers_confirmed', 0)} confirmadas, "
+          f"{totals.get('answers_rejected', 0)} rechazadas de {totals.get('answers_sent', 0)}")
+    print(f"  Mensajes/s:  {report['messagesPerSecond']}")
     print()
-    
-    # Veredicto
-    success_rate = stats['connections_successful'] / max(1, stats['connections_attempted']) * 100
-    
-    print("=" * 60)
-    if success_rate >= 95 and stats['connections_failed'] < 3:
-        print("? RESULTADO: EXCELENTE")
-        print("   El sistema soporta 50 usuarios simult?neos sin problemas.")
-    elif success_rate >= 80:
-        print("??  RESULTADO: ACEPTABLE")
-        print("   El sistema funciona pero hay margen de mejora.")
-    else:
-        print("? RESULTADO: NECESITA MEJORAS")
-        print("   El sistema tiene problemas de escalabilidad.")
-    print("=" * 60)
-    
-    # Errores detallados
-    if stats["errors"]:
+    print(f"  {'tipo':<24}{'n':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for msg_type, summary in report["latencyMs"].items():
+        if summary["count"]:
+            print(f"  {msg_type:<24}{summary['count']:>8}{summary['p50']:>10}{summary['p95']:>10}"
+                  f"{summary['p99']:>10}{summary['max']:>10}")
+    if report["fanout"]:
+        print()
+        print("  Fan-out desbloqueo -> entrega:")
+        for item in report["fanout"]:
+            print(f"    {item['activityId']}: {item['delivered']}/{item['expected']} "
+                  f"p50 {item['p50']}ms p99 {item['p99']}ms completo {item['completeMs']}ms")
+    if report["errors"]:
         print()
-        print("?? ERRORES DETECTADOS:")
-        for error in stats["errors"][:10]:  # Mostrar m?ximo 10
-            print(f"    {error}")
-        if len(stats["errors"]) > 10:
-            print(f"   ... y {len(stats['errors'])-10} errores m?s")
+        print("  Errores:")
+        for error, count in sorted(report["errors"].items(), key=lambda kv: -kv[1])[:10]:
+            print(f"    {error}: {count}")
+    print("=" * 60)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Prueba de carga para Sapiencial App")
-    parser.add_argument(
-        "url",
-        nargs="?",
-        default="ws://localhost:8000/ws/student",
-        help="URL del WebSocket (default: ws://localhost:8000/ws/student)"
-    )
-    parser.add_argument(
-        "-n", "--num-students",
-        type=int,
-        default=NUM_STUDENTS,
-        help=f"N?mero de estudiantes a simular (default: {NUM_STUDENTS})"
-    )
-    parser.add_argument(
-        "-d", "--duration",
-        type=int,
-        default=TEST_DURATION_SECONDS,
-        help=f"Duraci?n de la prueba en segundos (default: {TEST_DURATION_SECONDS})"
-    )
-    
+    parser.add_argument("url", nargs="?", default="ws://localhost:8000",
+                        help="URL base del servidor (default: ws://localhost:8000)")
+    parser.add_argument("-n", "--num-students", type=int, default=NUM_STUDENTS,
+                        help=f"Número de estudiantes a simular (default: {NUM_STUDENTS})")
+    parser.add_argument("-p", "--processes", type=int, default=NUM_PROCESSES,
+                        help=f"Procesos de estudiantes (default: {NUM_PROCESSES})")
+    parser.add_argument("-d", "--duration", type=float, default=TEST_DURATION_SECONDS,
+                        help=f"Duración de la prueba en segundos (default: {TEST_DURATION_SECONDS})")
+    parser.add_argument("--profile", choices=("ramp", "step", "spike"), default="ramp",
+                        help="Perfil de llegada de estudiantes (default: ramp)")
+    parser.add_argument("--ramp-seconds", type=float, default=RAMP_SECONDS,
+                        help=f"Ventana de llegada para ramp/step (default: {RAMP_SECONDS})")
+    parser.add_argument("--steps", type=int, default=STEP_COUNT,
+                        help=f"Tandas del perfil step (default: {STEP_COUNT})")
+    parser.add_argument("--class-code", default="", help="classCode del aula (default: aula predeterminada)")
+    parser.add_argument("--token", default=TEACHER_TOKEN, help="Token del docente")
+    parser.add_argument("--report", default="", help="Ruta del reporte JSON")
     args = parser.parse_args()
-    
-    # Actualizar configuraci?n global
-    global TEST_DURATION_SECONDS
-    TEST_DURATION_SECONDS = args.duration
-    
+    args.processes = max(1, min(args.processes, max(1, args.num_students)))
+
     try:
-        asyncio.run(run_load_test(args.url, args.num_students))
+        report = asyncio.run(run_load_test(args))
     except KeyboardInterrupt:
-        print("\n\n??  Prueba interrumpida por el usuario")
-        print_results()
+        print("\nPrueba interrumpida por el usuario")
         sys.exit(1)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Reporte guardado en {args.report}")
 
 
 if __name__ == "__main__":
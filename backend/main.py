@@ -5,18 +5,97 @@ Servidor WebSocket con sistema completo de estudiantes
 Versión 2.1 - Con persistencia de progreso y soporte para 50+ usuarios
 """
 import os
+import re
 import asyncio
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Optional, Any
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from typing import List, Dict, Optional, Any, Callable, Union
 from datetime import datetime
 from enum import Enum
-import json
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import hashlib
+import heapq
+import itertools
+import json
+import multiprocessing
+import random
+import secrets
+import signal
+import threading
+import time
 import uuid
+from collections import deque
+from answers import ItemResponseStore, StudentResponses, coerce_response_time, empty_item_stats
+from storage import ClassStateLog, ProgressStore, PersistenceScheduler, create_progress_store, name_key
+from codec import (
+    CODEC_NAME, COMPACT_KEYS, MSGPACK_AVAILABLE, MSGPACK_SUBPROTOCOL, ClientMessage, DecodeError,
+    decode_binary_message, decode_message, encode, encode_binary, with_sequence, with_sequence_binary,
+)
+from broker import Broker, BrokerError, create_broker
+from export import EXPORT_FORMATS, EXPORT_TABLES, iter_export
+from report import XLSX_MEDIA_TYPE, build_class_report
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY as METRICS
 
 # Archivo para persistencia de progreso
 PROGRESS_FILE = "student_progress.json"
+# Diario de cambios (una línea JSON por respuesta/reflexión/reinicio)
+PROGRESS_JOURNAL_FILE = "student_progress.journal"
+# Registros en el diario antes de compactarlo en el snapshot
+JOURNAL_COMPACT_THRESHOLD = 500
+# Base de datos SQLite (si PROGRESS_STORE=sqlite)
+PROGRESS_DB_FILE = os.environ.get("PROGRESS_DB_FILE", "student_progress.db")
+# Almacenamiento de progreso: "json" (snapshot + diario) o "sqlite"
+PROGRESS_STORE_BACKEND = os.environ.get("PROGRESS_STORE", "json").lower()
+# Segundos que se agrupan cambios antes de escribirlos a disco
+PERSIST_INTERVAL_SECONDS = float(os.environ.get("PERSIST_INTERVAL_SECONDS", "1.0"))
+
+# Estado de la clase: snapshot + eventos del docente (se restaura al reiniciar)
+CLASS_STATE_FILE = "class_state.json"
+CLASS_EVENTS_FILE = "class_state.events"
+# Eventos antes de escribir un snapshot nuevo
+CLASS_SNAPSHOT_EVERY = int(os.environ.get("CLASS_SNAPSHOT_EVERY", "100"))
+# Aviso de reinicio (SIGTERM): espera sugerida al cliente antes de reconectar
+RESTART_RECONNECT_MS = 3000
+
+# Cola de salida por conexión (envíos concurrentes a cada cliente)
+OUTBOUND_QUEUE_SIZE = 64  # Mensajes en cola antes de considerar lento al cliente
+SLOW_CONSUMER_TIMEOUT_SECONDS = 10.0  # Tiempo con la cola llena antes de desconectarlo
+SEND_TIMEOUT_SECONDS = 10.0  # Máximo para un send_text individual
+# Mensajes de estado: una copia nueva reemplaza a la que sigue en cola
+SUPERSEDED_MESSAGE_TYPES = {"RANKING_UPDATE", "DASHBOARD_UPDATE"}
+
+# Intervalo de agrupación de RANKING_UPDATE/DASHBOARD_UPDATE (0 = enviar al instante)
+BROADCAST_TICK_SECONDS = float(os.environ.get("BROADCAST_TICK_SECONDS", "0.2"))
+
+# Margen tras el tiempo límite de una actividad para respuestas en tránsito
+ACTIVITY_TIME_GRACE_SECONDS = float(os.environ.get("ACTIVITY_TIME_GRACE_SECONDS", "1.0"))
+
+# Broker para varios workers (vacío = un solo proceso; redis://host:puerto/db)
+BROKER_URL = os.environ.get("BROKER_URL", "")
+# Espera máxima al conectar con el broker al arrancar (luego el arranque falla)
+BROKER_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("BROKER_CONNECT_TIMEOUT_SECONDS", "10"))
+
+# Aulas: cada código de clase tiene su propio estado, roster y progreso
+DEFAULT_CLASS_CODE = "GENERAL"  # Aula de los clientes que no envían classCode
+CLASS_CODE_PATTERN = re.compile(r"^[A-Z0-9_-]{1,32}$")
+# Directorio del progreso de las aulas distintas de la predeterminada
+ROOMS_DIR = os.environ.get("ROOMS_DIR", "rooms")
+# Segundos sin conexiones antes de descargar un aula de memoria
+ROOM_IDLE_SECONDS = float(os.environ.get("ROOM_IDLE_SECONDS", "1800"))
+
+# Reportes XLSX (POST /reports): se generan en procesos aparte y se cachean
+REPORTS_DIR = os.environ.get("REPORTS_DIR", "reports")
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", "1"))  # Procesos del pool
+REPORT_CACHE_SIZE = int(os.environ.get("REPORT_CACHE_SIZE", "8"))  # Reportes listos guardados
+REPORT_MAX_PENDING = int(os.environ.get("REPORT_MAX_PENDING", "8"))  # En curso antes de responder 429
+REPORT_STUDENT_SHEETS = int(os.environ.get("REPORT_STUDENT_SHEETS", "300"))  # Hojas por estudiante (máximo)
+
+# Sesiones reanudables (RESUME): frames recientes guardados por estudiante
+RESUME_BUFFER_SIZE = int(os.environ.get("RESUME_BUFFER_SIZE", "128"))
+# Segundos que se siguen guardando los frames de un estudiante desconectado
+RESUME_WINDOW_SECONDS = float(os.environ.get("RESUME_WINDOW_SECONDS", "120"))
 
 app = FastAPI(title="Sapiencial App Backend")
 
@@ -135,67 +214,127 @@ def generate_session_id() -> str:
 # PERSISTENCIA DE PROGRESO
 # ============================================================
 
-def load_progress() -> Dict:
-    """Carga el progreso guardado de estudiantes"""
-    try:
-        if os.path.exists(PROGRESS_FILE):
-            with open(PROGRESS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except Exception as e:
-        print(f"[WARN] Error cargando progreso: {e}")
-    return {"students": {}, "last_updated": None}
-
-def save_progress(students_data: Dict):
-    """Guarda el progreso de estudiantes"""
-    try:
-        data = {
-            "students": students_data,
-            "last_updated": datetime.now().isoformat()
-        }
-        with open(PROGRESS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        print(f"[INFO] Progreso guardado: {len(students_data)} estudiantes")
-    except Exception as e:
-        print(f"[ERROR] Error guardando progreso: {e}")
+def normalize_class_code(class_code: Optional[str]) -> Optional[str]:
+    """Normaliza un código de clase (mayúsculas); None si no es válido"""
+    code = (class_code or DEFAULT_CLASS_CODE).strip().upper()
+    return code if CLASS_CODE_PATTERN.match(code) else None
+
+def room_directory(class_code: str) -> str:
+    return os.path.join(ROOMS_DIR, class_code)
+
+def room_exists(class_code: str) -> bool:
+    """True si el aula ya tiene archivos (la predeterminada existe siempre)"""
+    return class_code == DEFAULT_CLASS_CODE or os.path.isdir(room_directory(class_code))
 
-# Variable global para progreso persistente
-_saved_progress = load_progress()
+def create_room_store(class_code: str) -> ProgressStore:
+    """
+    Almacenamiento de progreso de un aula.
+    El aula predeterminada conserva los archivos de siempre; las demás
+    guardan los suyos en ROOMS_DIR/<código>/.
+    """
+    paths = [PROGRESS_FILE, PROGRESS_JOURNAL_FILE, PROGRESS_DB_FILE]
+    if class_code != DEFAULT_CLASS_CODE:
+        room_dir = room_directory(class_code)
+        os.makedirs(room_dir, exist_ok=True)
+        paths = [os.path.join(room_dir, os.path.basename(path)) for path in paths]
+    json_path, journal_path, sqlite_path = paths
+    return create_progress_store(
+        PROGRESS_STORE_BACKEND,
+        json_path=json_path,
+        journal_path=journal_path,
+        sqlite_path=sqlite_path,
+        compact_threshold=JOURNAL_COMPACT_THRESHOLD,
+    )
+
+def create_class_state_log(class_code: str) -> ClassStateLog:
+    """Eventos y snapshot del estado de un aula (mismas carpetas que su progreso)"""
+    paths = [CLASS_STATE_FILE, CLASS_EVENTS_FILE]
+    if class_code != DEFAULT_CLASS_CODE:
+        room_dir = room_directory(class_code)
+        os.makedirs(room_dir, exist_ok=True)
+        paths = [os.path.join(room_dir, path) for path in paths]
+    snapshot_path, events_path = paths
+    return ClassStateLog(snapshot_path, events_path, CLASS_SNAPSHOT_EVERY)
 
 # ============================================================
 # MODELOS DE DATOS - ESTUDIANTE
 # ============================================================
 
 class StudentData:
-    """Datos del estudiante"""
+    """Datos del estudiante
+
+    Con __slots__ y las respuestas en StudentResponses (arreglos compactos)
+    para que los rosters grandes ocupen poco. Clasificación, ícono y mensaje
+    se calculan una vez y se invalidan solo cuando cambia el porcentaje.
+    """
+    __slots__ = (
+        "session_id", "name", "_aggregates", "_status", "connected_at", "last_activity_at",
+        "websocket", "worker", "_accumulated_percentage", "_derived", "responses", "reflections",
+    )
+    
     def __init__(self, session_id: str, name: str, from_saved: Dict = None):
         self.session_id = session_id
         self.name = name
-        self.status = StudentConnectionStatus.CONNECTED
+        self._aggregates: Optional["DashboardAggregates"] = None  # Asignado al registrarse
+        self._status = StudentConnectionStatus.CONNECTED
         self.connected_at = datetime.now()
         self.last_activity_at: Optional[datetime] = None
         self.websocket: Optional[WebSocket] = None
+        self.worker: Optional[str] = None  # Worker con el socket si es otro proceso (copia)
+        self._derived: Optional[tuple] = None  # (clasificación, ícono, mensaje)
         
         # Cargar datos guardados si existen
         if from_saved:
-            self.accumulated_percentage = from_saved.get('accumulated_percentage', 0.0)
-            self.responses = from_saved.get('responses', {})
-            self.reflections = from_saved.get('reflections', [])
+            self._accumulated_percentage = from_saved.get('accumulated_percentage', 0.0)
+            self.responses = StudentResponses.from_saved(from_saved.get('responses', {}))
+            self.reflections = list(from_saved.get('reflections', []))
         else:
-            self.accumulated_percentage = 0.0
-            self.responses: Dict[str, Dict] = {}  # activity_id -> response
+            self._accumulated_percentage = 0.0
+            self.responses = StudentResponses()  # activity_id -> response
             self.reflections: List[Dict] = []
     
+    @property
+    def status(self) -> StudentConnectionStatus:
+        return self._status
+    
+    @status.setter
+    def status(self, value: StudentConnectionStatus):
+        old = self._status
+        self._status = value
+        if self._aggregates is not None and old != value:
+            self._aggregates.on_status_change(self, old, value)
+    
+    @property
+    def accumulated_percentage(self) -> float:
+        return self._accumulated_percentage
+    
+    @accumulated_percentage.setter
+    def accumulated_percentage(self, value: float):
+        if value != self._accumulated_percentage:
+            self._accumulated_percentage = value
+            self._derived = None
+    
+    def _derived_fields(self) -> tuple:
+        if self._derived is None:
+            classification = get_classification(self._accumulated_percentage)
+            self._derived = (
+                classification,
+                get_classification_icon(classification),
+                get_motivational_message(self._accumulated_percentage),
+            )
+        return self._derived
+    
     @property
     def classification(self) -> StudentClassification:
-        return get_classification(self.accumulated_percentage)
+        return self._derived_fields()[0]
     
     @property
     def classification_icon(self) -> str:
-        return get_classification_icon(self.classification)
+        return self._derived_fields()[1]
     
     @property
     def motivational_message(self) -> str:
-        return get_motivational_message(self.accumulated_percentage)
+        return self._derived_fields()[2]
     
     def has_responded(self, activity_id: str) -> bool:
         return activity_id in self.responses
@@ -203,32 +342,44 @@ class StudentData:
     def add_response(self, activity_id: str, answer: Any, is_correct: bool, 
                      percentage_value: float, response_time_ms: Optional[int] = None):
         """Agrega respuesta y recalcula porcentaje"""
-        self.responses[activity_id] = {
-            "activity_id": activity_id,
-            "answer": answer,
-            "is_correct": is_correct,
-            "percentage_value": percentage_value,
-            "answered_at": datetime.now().isoformat(),
-            "response_time_ms": response_time_ms,
-        }
+        if self._aggregates is not None:
+            self._aggregates.on_response(self, activity_id, self.responses.answer(activity_id), answer,
+                                         is_correct, response_time_ms)
+        self.responses.record(activity_id, answer, is_correct, percentage_value, response_time_ms)
         self.last_activity_at = datetime.now()
         
         if is_correct:
             self.accumulated_percentage += percentage_value
             if self.accumulated_percentage > 100:
                 self.accumulated_percentage = 100
+            if self._aggregates is not None:
+                self._aggregates.on_score_change(self)
         
         self.status = StudentConnectionStatus.RESPONDED
     
     def to_saveable(self) -> Dict:
-        """Convierte a diccionario para guardar en archivo"""
+        """Convierte a diccionario para guardar (copia: se serializa en otro hilo)"""
+        return {
+            "name": self.name,
+            "accumulated_percentage": self.accumulated_percentage,
+            "responses": self.responses.to_saveable(),
+            "reflections": list(self.reflections),
+        }
+    
+    def to_header(self, worker_id: str) -> Dict:
+        """Copia sin respuestas ni reflexiones (tamaño fijo) para los demás workers"""
         return {
             "name": self.name,
             "accumulated_percentage": self.accumulated_percentage,
-            "responses": self.responses,
-            "reflections": self.reflections,
+            "session_id": self.session_id,
+            "status": self.status.value,
+            "worker": worker_id,
         }
     
+    def to_snapshot(self, worker_id: str) -> Dict:
+        """Copia completa para los demás workers (ver ClusterSync)"""
+        return {**self.to_saveable(), **self.to_header(worker_id)}
+    
     def add_reflection(self, topic: str, content: str):
         """Agrega reflexión"""
         reflection = {
@@ -249,9 +400,13 @@ class StudentData:
     
     def reset_all_progress(self):
         """Reinicia TODO el progreso del estudiante (usado por admin)"""
+        if self._aggregates is not None:
+            self._aggregates.on_responses_cleared(self)
         self.accumulated_percentage = 0.0
-        self.responses = {}
+        self.responses = StudentResponses()
         self.reflections = []
+        if self._aggregates is not None:
+            self._aggregates.on_score_change(self)
         self.status = StudentConnectionStatus.NOT_RESPONDED
         self.last_activity_at = None
     
@@ -267,6 +422,11 @@ class StudentData:
         """Verifica si completó todas las lecciones"""
         return len(self.responses) >= total_lessons
     
+    @property
+    def rank(self) -> Optional[int]:
+        """Posición en el ranking de conectados (1 = primero)"""
+        return self._aggregates.leaderboard.rank(self.session_id) if self._aggregates else None
+    
     def to_dict(self) -> Dict:
         """Convierte a diccionario para JSON"""
         return {
@@ -279,6 +439,7 @@ class StudentData:
             "classification": self.classification.value,
             "classificationIcon": self.classification_icon,
             "motivationalMessage": self.motivational_message,
+            "rank": self.rank,
         }
     
     def to_summary(self) -> Dict:
@@ -300,12 +461,245 @@ class StudentData:
             "icon": self.classification_icon,
         }
 
+# ============================================================
+# RANKING (LEADERBOARD)
+# ============================================================
+
+class _RankNode:
+    """Nodo de treap con tamaño de subárbol (árbol de estadísticos de orden)"""
+    __slots__ = ("key", "priority", "left", "right", "size")
+    
+    def __init__(self, key: tuple):
+        self.key = key
+        self.priority = random.random()
+        self.left: Optional["_RankNode"] = None
+        self.right: Optional["_RankNode"] = None
+        self.size = 1
+
+def _node_size(node: Optional[_RankNode]) -> int:
+    return node.size if node else 0
+
+def _node_update(node: _RankNode):
+    node.size = 1 + _node_size(node.left) + _node_size(node.right)
+
+def _treap_split(node: Optional[_RankNode], key: tuple):
+    """Divide en (claves < key, claves >= key)"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _treap_split(node.right, key)
+        node.right = left
+        _node_update(node)
+        return node, right
+    left, right = _treap_split(node.left, key)
+    node.left = right
+    _node_update(node)
+    return left, node
+
+def _treap_merge(a: Optional[_RankNode], b: Optional[_RankNode]) -> Optional[_RankNode]:
+    """Une dos treaps (todas las claves de a < claves de b)"""
+    if a is None or b is None:
+        return a or b
+    if a.priority > b.priority:
+        a.right = _treap_merge(a.right, b)
+        _node_update(a)
+        return a
+    b.left = _treap_merge(a, b.left)
+    _node_update(b)
+    return b
+
+def _treap_remove(node: Optional[_RankNode], key: tuple) -> Optional[_RankNode]:
+    if node is None:
+        return None
+    if key == node.key:
+        return _treap_merge(node.left, node.right)
+    if key < node.key:
+        node.left = _treap_remove(node.left, key)
+    else:
+        node.right = _treap_remove(node.right, key)
+    _node_update(node)
+    return node
+
+class Leaderboard:
+    """Ranking ordenado por porcentaje (desc), desempate por orden de entrada.
+
+    Treap con tamaños de subárbol: actualizar y consultar la posición de un
+    estudiante cuesta O(log N) y los primeros k se obtienen en O(k + log N).
+    El orden de entrada viaja en la clave, así quitar a un estudiante no deja
+    nada suyo en memoria (al volver entra detrás de los empatados).
+    """
+    def __init__(self):
+        self._root: Optional[_RankNode] = None
+        self._keys: Dict[str, tuple] = {}  # session_id -> (-porcentaje, orden de entrada, session_id)
+        self._next_seq = 0
+    
+    def __len__(self) -> int:
+        return _node_size(self._root)
+    
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._keys
+    
+    def update(self, session_id: str, percentage: float):
+        """Inserta o reposiciona a un estudiante (reposicionar conserva su desempate)"""
+        key = self._keys.pop(session_id, None)
+        if key is not None:
+            self._root = _treap_remove(self._root, key)
+            seq = key[1]
+        else:
+            seq = self._next_seq
+            self._next_seq += 1
+        key = (-percentage, seq, session_id)
+        left, right = _treap_split(self._root, key)
+        self._root = _treap_merge(_treap_merge(left, _RankNode(key)), right)
+        self._keys[session_id] = key
+    
+    def remove(self, session_id: str):
+        """Quita a un estudiante del ranking (si está)"""
+        key = self._keys.pop(session_id, None)
+        if key is not None:
+            self._root = _treap_remove(self._root, key)
+    
+    def rank(self, session_id: str) -> Optional[int]:
+        """Posición (1 = primero) de un estudiante, o None si no está"""
+        key = self._keys.get(session_id)
+        if key is None:
+            return None
+        position = 0
+        node = self._root
+        while node is not None:
+            if key < node.key:
+                node = node.left
+            elif key > node.key:
+                position += _node_size(node.left) + 1
+                node = node.right
+            else:
+                return position + _node_size(node.left) + 1
+        return None
+    
+    def top(self, limit: int) -> List[str]:
+        """session_ids de los primeros `limit` estudiantes"""
+        result: List[str] = []
+        stack: List[_RankNode] = []
+        node = self._root
+        while (stack or node is not None) and len(result) < limit:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            result.append(node.key[2])
+            node = node.right
+        return result
+
+# ============================================================
+# AGREGADOS DEL DASHBOARD
+# ============================================================
+
+class DashboardAggregates:
+    """Contadores del dashboard mantenidos en cada cambio de estado.
+
+    StudentData notifica sus transiciones (status, respuestas, puntaje,
+    reinicio), así get_dashboard_summary y get_ranking no recorren a los
+    estudiantes. Votos y ranking solo cuentan a los conectados, igual que el
+    cálculo original; las columnas por actividad (items) cuentan a todos.
+    """
+    def __init__(self):
+        self.status_counts: Dict[StudentConnectionStatus, int] = {
+            status: 0 for status in StudentConnectionStatus
+        }
+        self.votes: Dict[str, Dict[str, int]] = {}  # activity_id -> {respuesta: votos}
+        self.leaderboard = Leaderboard()  # Solo estudiantes conectados
+        self.roster_dirty: set = set()  # session_ids cuyo to_summary() cambió
+        self.items = ItemResponseStore()  # Respuestas por actividad (estadísticas)
+    
+    @property
+    def total(self) -> int:
+        return sum(self.status_counts.values())
+    
+    @property
+    def connected(self) -> int:
+        return self.total - self.status_counts[StudentConnectionStatus.DISCONNECTED]
+    
+    def _add_vote(self, activity_id: str, answer: Any, delta: int):
+        if answer is None:
+            return
+        key = str(answer)
+        counts = self.votes.setdefault(activity_id, {})
+        counts[key] = counts.get(key, 0) + delta
+        if counts[key] <= 0:
+            del counts[key]
+            if not counts:
+                del self.votes[activity_id]
+    
+    def _add_all_votes(self, student: "StudentData", delta: int):
+        for activity_id, answer in student.responses.iter_answers():
+            self._add_vote(activity_id, answer, delta)
+    
+    def track(self, student: "StudentData"):
+        """Empieza a contar un estudiante recién registrado"""
+        student._aggregates = self
+        self.roster_dirty.add(student.session_id)
+        self.items.add_student(student.session_id, student.responses)
+        self.status_counts[student.status] += 1
+        if student.status != StudentConnectionStatus.DISCONNECTED:
+            self._add_all_votes(student, 1)
+            self.leaderboard.update(student.session_id, student.accumulated_percentage)
+    
+    def untrack(self, student: "StudentData"):
+        """Deja de contar a un estudiante (antes de reemplazar sus datos)"""
+        self.roster_dirty.add(student.session_id)
+        self.items.remove_student(student.session_id, student.responses)
+        self.status_counts[student.status] -= 1
+        if student.status != StudentConnectionStatus.DISCONNECTED:
+            self._add_all_votes(student, -1)
+            self.leaderboard.remove(student.session_id)
+        student._aggregates = None
+    
+    def on_status_change(self, student: "StudentData", old: StudentConnectionStatus,
+                         new: StudentConnectionStatus):
+        self.roster_dirty.add(student.session_id)
+        self.status_counts[old] -= 1
+        self.status_counts[new] += 1
+        was_connected = old != StudentConnectionStatus.DISCONNECTED
+        is_connected = new != StudentConnectionStatus.DISCONNECTED
+        if was_connected and not is_connected:
+            self._add_all_votes(student, -1)
+            self.leaderboard.remove(student.session_id)
+        elif is_connected and not was_connected:
+            self._add_all_votes(student, 1)
+            self.leaderboard.update(student.session_id, student.accumulated_percentage)
+    
+    def on_response(self, student: "StudentData", activity_id: str, previous_answer: Any,
+                    answer: Any, is_correct: bool, response_time_ms: Optional[int]):
+        self.items.record(student.session_id, activity_id, answer, is_correct, response_time_ms)
+        if student.status == StudentConnectionStatus.DISCONNECTED:
+            return
+        self._add_vote(activity_id, previous_answer, -1)  # None si no había respondido
+        self._add_vote(activity_id, answer, 1)
+    
+    def on_score_change(self, student: "StudentData"):
+        self.roster_dirty.add(student.session_id)
+        if student.session_id in self.leaderboard:
+            self.leaderboard.update(student.session_id, student.accumulated_percentage)
+    
+    def on_responses_cleared(self, student: "StudentData"):
+        self.items.remove_student(student.session_id, student.responses)
+        if student.status != StudentConnectionStatus.DISCONNECTED:
+            self._add_all_votes(student, -1)
+    
+    def vote_counts(self, activity_id: Optional[str]) -> Dict[str, int]:
+        return dict(self.votes.get(activity_id, {})) if activity_id else {}
+
 # ============================================================
 # MODELO: ACTIVIDAD
 # ============================================================
 
 class ActivityData:
-    """Datos de actividad para estudiantes"""
+    """Datos de actividad para estudiantes
+    
+    Guarda el mensaje ya serializado por (tipo, audiencia) para que cada
+    estudiante que entra tarde o reconecta reciba los mismos bytes. La caché
+    se invalida solo al mutar la actividad (cambio de estado).
+    """
     def __init__(self, activity_id: str, question: str, options: List[str],
                  correct_index: int, percentage_value: float,
                  activity_type: StudentActivityType = StudentActivityType.MULTIPLE_CHOICE,
@@ -319,12 +713,50 @@ class ActivityData:
         self.correct_index = correct_index
         self.percentage_value = percentage_value
         self.activity_type = activity_type
-        self.state = ActivityState.LOCKED
+        self._state = ActivityState.LOCKED
+        self.version = 0
+        self._frames: Dict[tuple, "EncodedMessage"] = {}
         self.time_limit_seconds = time_limit_seconds
+        self.closes_at: Optional[float] = None  # time.time() de cierre automático (si hay límite)
         self.title = title  # Título de la diapositiva/actividad
         self.slide_content = slide_content  # Contenido extra (ej: la cita bíblica)
         self.biblical_reference = biblical_reference  # Referencia bíblica (ej: "Eclesiastés 1:2")
     
+    @property
+    def state(self) -> ActivityState:
+        return self._state
+    
+    @state.setter
+    def state(self, value: ActivityState):
+        if value != self._state:
+            self._state = value
+            self.touch()
+    
+    def touch(self):
+        """Marca la actividad como modificada (descarta los mensajes cacheados)"""
+        self.version += 1
+        self._frames.clear()
+    
+    def activate(self, now: float):
+        """Habilita la actividad; con tiempo límite fija la hora de cierre del servidor"""
+        self.closes_at = now + self.time_limit_seconds if self.time_limit_seconds and self.time_limit_seconds > 0 else None
+        self._state = ActivityState.ACTIVE
+        self.touch()
+    
+    def is_expired(self, now: float) -> bool:
+        """True si se pasó el tiempo límite (más el margen de gracia)"""
+        return self.closes_at is not None and now > self.closes_at + ACTIVITY_TIME_GRACE_SECONDS
+    
+    def frame(self, message_type: str, audience: str = "student") -> "EncodedMessage":
+        """Mensaje {type, data} serializado: vista de estudiante o de docente (con correctIndex)"""
+        key = (message_type, audience)
+        cached = self._frames.get(key)
+        if cached is None:
+            data = self.to_dict() if audience == "teacher" else self.to_student_dict()
+            cached = EncodedMessage({"type": message_type, "data": data})
+            self._frames[key] = cached
+        return cached
+    
     def to_student_dict(self) -> Dict:
         """Versión para estudiante (sin respuesta correcta)"""
         return {
@@ -335,6 +767,7 @@ class ActivityData:
             "percentageValue": self.percentage_value,
             "state": self.state.value,
             "timeLimitSeconds": self.time_limit_seconds,
+            "closesAt": datetime.fromtimestamp(self.closes_at).isoformat() if self.closes_at else None,
             "title": self.title,
             "slideContent": self.slide_content,
             "biblicalReference": self.biblical_reference,
@@ -345,6 +778,459 @@ class ActivityData:
         data = self.to_student_dict()
         data["correctIndex"] = self.correct_index
         return data
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ActivityData":
+        """Reconstruye una actividad desde to_dict() (estado compartido entre workers)"""
+        activity = cls(
+            activity_id=data["id"],
+            question=data.get("question", ""),
+            options=data.get("options", []),
+            correct_index=data.get("correctIndex", 0),
+            percentage_value=data.get("percentageValue", 10.0),
+            activity_type=StudentActivityType(data.get("type", "multipleChoice")),
+            time_limit_seconds=data.get("timeLimitSeconds"),
+            title=data.get("title"),
+            slide_content=data.get("slideContent"),
+            biblical_reference=data.get("biblicalReference"),
+        )
+        activity.state = ActivityState(data.get("state", ActivityState.LOCKED.value))
+        if data.get("closesAt"):
+            activity.closes_at = datetime.fromisoformat(data["closesAt"]).timestamp()
+        return activity
+
+# ============================================================
+# MÉTRICAS
+# ============================================================
+
+# Solo las acciones conocidas llevan su nombre como etiqueta; el resto
+# cuenta como "unknown" para no crear series con lo que mande un cliente
+TEACHER_ACTIONS = {
+    "SET_STATE", "SET_SLIDE", "REGISTER_ACTIVITY", "UNLOCK_ACTIVITY", "LOCK_ACTIVITY",
+    "LOCK_ALL_ACTIVITIES", "REVEAL_ANSWER", "GET_REFLECTIONS", "REQUEST_DASHBOARD",
+    "RESET_ALL_STUDENTS_PROGRESS", "GET_ACTIVITY_STATS",
+}
+STUDENT_ACTIONS = {"REGISTER", "RESUME", "SUBMIT_ANSWER", "SUBMIT_REFLECTION", "GET_STATE"}
+
+ACTION_DURATION = METRICS.histogram(
+    "sapiencial_action_duration_seconds", "Tiempo de proceso de cada acción recibida", ("role", "action"))
+MESSAGES_RECEIVED = METRICS.counter(
+    "sapiencial_messages_received", "Mensajes recibidos por acción", ("role", "action"))
+MESSAGES_SENT = METRICS.counter(
+    "sapiencial_messages_sent", "Mensajes encolados por tipo (uno por destinatario)", ("type",))
+BROADCAST_DURATION = METRICS.histogram(
+    "sapiencial_broadcast_duration_seconds", "Tiempo de serializar y encolar un broadcast", ("type",))
+BROADCAST_RECIPIENTS = METRICS.histogram(
+    "sapiencial_broadcast_recipients", "Destinatarios por broadcast", ("type",),
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+SAVE_PROGRESS_DURATION = METRICS.histogram(
+    "sapiencial_save_progress_duration_seconds", "Duración de cada escritura de progreso",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+SAVE_PROGRESS_BYTES = METRICS.counter(
+    "sapiencial_save_progress_bytes", "Bytes escritos al guardar progreso")
+SAVE_PROGRESS_STUDENTS = METRICS.counter(
+    "sapiencial_save_progress_students", "Estudiantes escritos al guardar progreso")
+SESSION_RESUMES = METRICS.counter(
+    "sapiencial_session_resumes", "Reanudaciones por resultado (replay, snapshot, failed)", ("result",))
+RESUME_REPLAYED_FRAMES = METRICS.counter(
+    "sapiencial_resume_replayed_frames", "Frames reenviados al reanudar sesiones")
+REPORTS_REQUESTED = METRICS.counter(
+    "sapiencial_reports", "Reportes pedidos por resultado (generated, cached, failed)", ("result",))
+REPORT_DURATION = METRICS.histogram(
+    "sapiencial_report_duration_seconds", "Tiempo de generar un reporte XLSX (volcado y proceso)",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+# Gauges calculados al momento del scrape
+METRICS.gauge("sapiencial_connected_students", "Estudiantes conectados a este worker",
+              function=lambda: sum(len(r.student_manager.websocket_to_student) for r in classrooms.rooms.values()))
+METRICS.gauge("sapiencial_connected_teachers", "Docentes conectados a este worker",
+              function=lambda: sum(len(r.teacher_manager.teacher_connections) for r in classrooms.rooms.values()))
+METRICS.gauge("sapiencial_rooms", "Aulas cargadas en este worker",
+              function=lambda: len(classrooms.rooms))
+METRICS.gauge("sapiencial_activity_timers", "Temporizadores de actividad pendientes",
+              function=lambda: len(activity_timers))
+
+# store.stats() por aula, leído una vez por scrape (en SQLite es un COUNT bajo
+# el lock que comparte el hilo de persistencia) y compartido por los gauges
+progress_store_stats: Dict[str, Dict] = {}
+
+def collect_progress_store_stats():
+    progress_store_stats.clear()
+    for code, room in classrooms.rooms.items():
+        progress_store_stats[code] = room.student_manager.store.stats()
+
+METRICS.on_render(collect_progress_store_stats)
+
+def progress_store_gauge(field: str):
+    """Valor de store.stats() por aula cargada (ver collect_progress_store_stats)"""
+    return lambda: {(code,): stats[field] for code, stats in progress_store_stats.items()}
+
+METRICS.gauge("sapiencial_progress_indexed_students", "Estudiantes con progreso guardado por aula",
+              ("room",), function=progress_store_gauge("students"))
+METRICS.gauge("sapiencial_progress_load_seconds", "Tiempo de carga del índice de progreso al abrir el aula",
+              ("room",), function=progress_store_gauge("loadSeconds"))
+METRICS.gauge("sapiencial_progress_index_bytes", "Memoria aproximada del índice de progreso",
+              ("room",), function=progress_store_gauge("indexBytes"))
+
+def action_label(action: Optional[str], known: set) -> str:
+    return action if action in known else "unknown"
+
+def observe_action(role: str, action: Optional[str], known: set, started: float):
+    """Cuenta la acción recibida y registra cuánto tardó su proceso"""
+    label = action_label(action, known)
+    MESSAGES_RECEIVED.labels(role, label).inc()
+    ACTION_DURATION.labels(role, label).observe(time.perf_counter() - started)
+
+def observe_save_progress(seconds: float, written_bytes: int, students: int):
+    """Callback de PersistenceScheduler (corre en el hilo de persistencia)"""
+    SAVE_PROGRESS_DURATION.observe(seconds)
+    SAVE_PROGRESS_BYTES.inc(written_bytes)
+    SAVE_PROGRESS_STUDENTS.inc(students)
+
+# ============================================================
+# CONEXIONES (COLAS DE SALIDA)
+# ============================================================
+
+class ClientConnection:
+    """Cola de salida acotada de un websocket, vaciada por su propia tarea.
+    
+    Los broadcasts solo encolan, así un celular con mala señal no retrasa al
+    resto de la clase. Si la cola sigue llena más de
+    SLOW_CONSUMER_TIMEOUT_SECONDS (o duplica su tamaño) se cierra la conexión
+    y el endpoint ejecuta la desconexión normal.
+    
+    binary=True si el cliente negoció MSGPACK_SUBPROTOCOL (frames binarios).
+    
+    Con una sesión reanudable (session) los frames llevan "seq" y el orden de
+    la cola es el orden de seq: un mensaje de estado nuevo descarta la copia en
+    cola y se agrega al final en lugar de ocupar su lugar. Los límites cuentan
+    solo las entradas vivas (_live), no los lugares de las descartadas.
+    """
+    def __init__(self, websocket: WebSocket, max_size: int = OUTBOUND_QUEUE_SIZE,
+                 binary: bool = False):
+        self.websocket = websocket
+        self.max_size = max_size
+        self.binary = binary
+        self.closed = False
+        self._queue: deque = deque()  # [clave de reemplazo, texto o bytes]
+        self._pending_by_key: Dict[str, list] = {}
+        self._full_since: Optional[float] = None
+        self._live = 0  # Entradas en la cola que todavía se van a enviar
+        self.session: Optional["StudentSession"] = None
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+    
+    def enqueue(self, text: Union[str, bytes], supersede_key: Optional[str] = None):
+        """Encola un mensaje ya serializado en el formato de la conexión (no bloquea)"""
+        if self.closed:
+            return
+        if supersede_key is not None:
+            pending = self._pending_by_key.get(supersede_key)
+            if pending is not None:
+                if self.session is None:
+                    # Reemplazar la copia vieja en su lugar (estado más reciente)
+                    pending[1] = text
+                    return
+                # Con seq no se puede adelantar un frame: se descarta el viejo
+                pending[1] = None
+                self._live -= 1
+                if len(self._queue) - self._live >= self.max_size:
+                    self._compact()
+        item = [supersede_key, text]
+        self._queue.append(item)
+        self._live += 1
+        if supersede_key is not None:
+            self._pending_by_key[supersede_key] = item
+        self._check_backlog()
+        self._wakeup.set()
+    
+    def _compact(self):
+        """Quita de la cola los lugares de las entradas descartadas"""
+        self._queue = deque(item for item in self._queue if item[1] is not None)
+    
+    def _check_backlog(self):
+        if self._live < self.max_size:
+            self._full_since = None
+            return
+        now = time.monotonic()
+        if self._full_since is None:
+            self._full_since = now
+        if (now - self._full_since > SLOW_CONSUMER_TIMEOUT_SECONDS
+                or self._live >= 2 * self.max_size):
+            self.evict("cola de salida llena")
+    
+    async def _run(self):
+        try:
+            while True:
+                while not self._queue:
+                    if self.closed:
+                        # wait_for (3.11) puede tragarse el cancel si el envío terminó a la vez
+                        return
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                item = self._queue.popleft()
+                key, text = item
+                if text is None:
+                    continue
+                self._live -= 1
+                if key is not None and self._pending_by_key.get(key) is item:
+                    del self._pending_by_key[key]
+                if self._live < self.max_size:
+                    self._full_since = None
+                if self.binary:
+                    await asyncio.wait_for(self.websocket.send_bytes(text), SEND_TIMEOUT_SECONDS)
+                else:
+                    await asyncio.wait_for(self.websocket.send_text(text), SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.evict("envío demasiado lento")
+        except (ConnectionError, RuntimeError, WebSocketDisconnect) as e:
+            print(f"[ERROR] Error enviando mensaje: {e}")
+            self.closed = True
+    
+    def evict(self, reason: str):
+        """Cierra una conexión lenta; el endpoint hace la limpieza al recibir el cierre"""
+        if self.closed:
+            return
+        print(f"[WARN] Cliente desconectado por lentitud: {reason}")
+        self.shutdown(1013)
+    
+    def shutdown(self, code: int):
+        """Descarta lo pendiente y cierra el socket con `code` (no bloquea)"""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._pending_by_key.clear()
+        self._live = 0
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+        asyncio.create_task(self._close_socket(code))
+    
+    async def _close_socket(self, code: int):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+    
+    def stop(self):
+        """Detiene la tarea de escritura (el socket ya se cerró)"""
+        self.closed = True
+        self._wakeup.set()
+        self._task.cancel()
+
+class ConnectionRegistry:
+    """websocket -> ClientConnection para todos los clientes (docentes y estudiantes)"""
+    def __init__(self):
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+    
+    def open(self, websocket: WebSocket, binary: bool = False) -> ClientConnection:
+        connection = self.connections.get(websocket)
+        if connection is None:
+            connection = self.connections[websocket] = ClientConnection(websocket, binary=binary)
+        return connection
+    
+    def close(self, websocket: WebSocket):
+        connection = self.connections.pop(websocket, None)
+        if connection is not None:
+            connection.stop()
+    
+    def get(self, websocket: WebSocket) -> Optional[ClientConnection]:
+        return self.connections.get(websocket)
+
+connection_registry = ConnectionRegistry()
+
+class EncodedMessage:
+    """Mensaje ya serializado que se reutiliza entre envíos (ver ActivityData.frame)
+    
+    El texto JSON se genera al crearlo; la versión MessagePack solo cuando la
+    pide el primer cliente binario.
+    """
+    __slots__ = ("message", "message_type", "text", "_binary")
+    
+    def __init__(self, message: Dict):
+        self.message = message
+        self.message_type = message.get("type")
+        self.text = encode(message)
+        self._binary: Optional[bytes] = None
+    
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = encode_binary(self.message)
+        return self._binary
+
+def encode_message(message: Union[Dict, EncodedMessage]) -> str:
+    """Serializa un mensaje saliente"""
+    if isinstance(message, EncodedMessage):
+        return message.text
+    return encode(message)
+
+def encode_message_binary(message: Union[Dict, EncodedMessage]) -> bytes:
+    """Serializa un mensaje saliente para MSGPACK_SUBPROTOCOL"""
+    if isinstance(message, EncodedMessage):
+        return message.binary
+    return encode_binary(message)
+
+def supersede_key_for(message: Union[Dict, EncodedMessage]) -> Optional[str]:
+    """Clave de reemplazo en cola (None si el mensaje no puede reemplazarse)"""
+    if isinstance(message, EncodedMessage):
+        return message.message_type if message.message_type in SUPERSEDED_MESSAGE_TYPES else None
+    message_type = message.get("type")
+    if message_type not in SUPERSEDED_MESSAGE_TYPES:
+        return None
+    # Los deltas del dashboard se acumulan: no pueden reemplazarse entre sí
+    if message.get("data", {}).get("delta"):
+        return None
+    return message_type
+
+def message_type_of(message: Union[Dict, EncodedMessage]) -> str:
+    if isinstance(message, EncodedMessage):
+        return message.message_type or "unknown"
+    return message.get("type") or "unknown"
+
+def enqueue_many(websockets: List[WebSocket], message: Union[Dict, EncodedMessage]):
+    """Serializa una vez por formato y encola en cada destinatario (no espera envíos)"""
+    started = time.perf_counter()
+    text: Optional[str] = None
+    binary: Optional[bytes] = None
+    key = supersede_key_for(message)
+    recipients = 0
+    for ws in websockets:
+        connection = connection_registry.get(ws)
+        if connection is None:
+            continue
+        recipients += 1
+        if connection.binary:
+            if binary is None:
+                binary = encode_message_binary(message)
+            frame = binary
+        else:
+            if text is None:
+                text = encode_message(message)
+            frame = text
+        if connection.session is not None:
+            frame = connection.session.stamp(frame, message)
+        connection.enqueue(frame, key)
+    if recipients:
+        message_type = message_type_of(message)
+        MESSAGES_SENT.labels(message_type).inc(recipients)
+        BROADCAST_RECIPIENTS.labels(message_type).observe(recipients)
+        BROADCAST_DURATION.labels(message_type).observe(time.perf_counter() - started)
+
+async def send_message(websocket: WebSocket, message: Union[Dict, EncodedMessage]):
+    """Envía un mensaje a un websocket (por su cola si está registrada)"""
+    MESSAGES_SENT.labels(message_type_of(message)).inc()
+    connection = connection_registry.get(websocket)
+    if connection is not None:
+        frame = encode_message_binary(message) if connection.binary else encode_message(message)
+        if connection.session is not None:
+            frame = connection.session.stamp(frame, message)
+        connection.enqueue(frame, supersede_key_for(message))
+    else:
+        await websocket.send_text(encode_message(message))
+
+def negotiate_subprotocol(websocket: WebSocket) -> Optional[str]:
+    """Subprotocolo a aceptar: MessagePack si el cliente lo pidió, si no JSON (None)"""
+    if MSGPACK_AVAILABLE and MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+async def accept_client(websocket: WebSocket) -> ClientConnection:
+    """Acepta el websocket con el subprotocolo negociado y abre su cola de salida"""
+    subprotocol = negotiate_subprotocol(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    return connection_registry.open(websocket, binary=subprotocol == MSGPACK_SUBPROTOCOL)
+
+async def receive_client_message(websocket: WebSocket) -> Union[str, bytes]:
+    """Recibe un frame de texto (JSON) o binario (MessagePack)"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("text") is not None:
+        return message["text"]
+    return message.get("bytes") or b""
+
+def decode_client_message(data: Union[str, bytes]) -> ClientMessage:
+    """Decodifica según el tipo de frame (un cliente binario puede enviar JSON igualmente)"""
+    if isinstance(data, str):
+        return decode_message(data)
+    return decode_binary_message(data)
+
+# ============================================================
+# SESIONES REANUDABLES
+# ============================================================
+
+class StudentSession:
+    """Flujo numerado de frames de un estudiante, reanudable con su token.
+    
+    Cada frame que recibe el estudiante lleva "seq" (creciente; puede saltar
+    cuando un RANKING_UPDATE nuevo descarta al que seguía en cola). Los
+    últimos RESUME_BUFFER_SIZE quedan en un buffer circular, también mientras
+    el estudiante está desconectado (hasta RESUME_WINDOW_SECONDS). Al reanudar
+    se reenvían solo los posteriores al último seq del cliente; si el buffer
+    ya se sobrescribió o la ventana venció, corresponde un snapshot completo.
+    """
+    __slots__ = ("session_id", "token", "seq", "buffer", "detached_at", "expired")
+    
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.token = secrets.token_urlsafe(24)
+        self.seq = 0
+        # Solo referencias a los mensajes (compartidas entre destinatarios): los
+        # seq son consecutivos, el último del buffer es self.seq
+        self.buffer: deque = deque(maxlen=RESUME_BUFFER_SIZE)
+        self.detached_at: Optional[float] = None  # monotonic al desconectarse
+        self.expired = False
+    
+    def record(self, message: Union[Dict, EncodedMessage]) -> int:
+        """Asigna el siguiente seq a un mensaje y lo guarda en el buffer"""
+        self.seq += 1
+        self.buffer.append(message)
+        return self.seq
+    
+    def stamp(self, frame: Union[str, bytes], message: Union[Dict, EncodedMessage]) -> Union[str, bytes]:
+        """Registra el mensaje y devuelve su frame serializado con "seq" """
+        seq = self.record(message)
+        if isinstance(frame, bytes):
+            return with_sequence_binary(frame, seq)
+        return with_sequence(frame, seq)
+    
+    def expire(self):
+        """Deja de guardar frames: la próxima reanudación recibe un snapshot"""
+        self.expired = True
+        self.buffer.clear()
+    
+    def missed_since(self, last_seq: int) -> Optional[List[tuple]]:
+        """(seq, mensaje) posteriores a last_seq en O(perdidos), o None si ya no están todos"""
+        if self.expired or last_seq > self.seq:
+            return None
+        missed = self.seq - last_seq
+        if missed > len(self.buffer):
+            return None
+        messages = list(itertools.islice(reversed(self.buffer), missed))
+        messages.reverse()
+        return list(zip(range(last_seq + 1, self.seq + 1), messages))
+
+def replay_frames(connection: ClientConnection, frames: List[tuple]) -> int:
+    """Encola frames del buffer con su seq original; devuelve cuántos quedaron"""
+    latest: Dict[str, int] = {}
+    for seq, message in frames:
+        key = supersede_key_for(message)
+        if key is not None:
+            latest[key] = seq
+    sent = 0
+    for seq, message in frames:
+        key = supersede_key_for(message)
+        if key is not None and latest[key] != seq:
+            continue  # Estado viejo: basta con el último
+        if connection.binary:
+            frame = with_sequence_binary(encode_message_binary(message), seq)
+        else:
+            frame = with_sequence(encode_message(message), seq)
+        connection.enqueue(frame, key)
+        sent += 1
+    return sent
 
 # ============================================================
 # MANAGER DE ESTUDIANTES
@@ -352,45 +1238,52 @@ class ActivityData:
 
 class StudentManager:
     """Gestiona estudiantes conectados - Soporta hasta 100 conexiones simultáneas"""
-    def __init__(self):
+    def __init__(self, store: ProgressStore):
         self.students: Dict[str, StudentData] = {}  # session_id -> StudentData
-        self.names_in_use: set = set()  # Nombres activos (evita duplicados)
+        self.name_index: Dict[str, str] = {}  # name_key -> session_id (evita duplicados)
+        self.aggregates = DashboardAggregates()  # Contadores del dashboard
+        self.roster_version = 0  # Versión del roster enviada en DASHBOARD_UPDATE
         self.websocket_to_student: Dict[WebSocket, str] = {}  # websocket -> session_id
+        self.sessions: Dict[str, StudentSession] = {}  # session_id -> sesión reanudable
+        self.resume_tokens: Dict[str, str] = {}  # token -> session_id
+        self.detached_sessions: Dict[str, StudentSession] = {}  # Desconectados dentro de la ventana
+        self.store = store
+        self.persistence = PersistenceScheduler(self.store, PERSIST_INTERVAL_SECONDS,
+                                                on_flush=observe_save_progress)
         self._load_saved_students()
     
     def _load_saved_students(self):
-        """Carga estudiantes con progreso guardado (sin WebSocket activo)"""
-        global _saved_progress
-        saved_students = _saved_progress.get("students", {})
-        for name, data in saved_students.items():
-            # No crear conexión, solo guardar datos para reconexión
-            print(f"[INFO] Progreso cargado: {name} - {data.get('accumulated_percentage', 0)}%")
+        """Reporta el progreso guardado disponible para reconexión.
+
+        Al arrancar solo se carga el índice de nombres; respuestas y
+        reflexiones se leen en register_student cuando el estudiante vuelve.
+        """
+        stats = self.store.stats()
+        print(f"[INFO] Progreso guardado: {stats['students']} estudiantes indexados "
+              f"en {stats['loadSeconds'] * 1000:.1f} ms (índice ~{stats['indexBytes'] / 1024:.0f} KB)")
     
     def _get_saved_data(self, name: str) -> Optional[Dict]:
         """Obtiene datos guardados de un estudiante por nombre"""
-        global _saved_progress
-        name_lower = name.lower()
-        for saved_name, data in _saved_progress.get("students", {}).items():
-            if saved_name.lower() == name_lower:
-                return data
-        return None
+        return self.store.load_student(name)
     
     def _save_all_progress(self):
-        """Guarda el progreso de todos los estudiantes"""
-        global _saved_progress
-        students_data = {}
-        for student in self.students.values():
-            students_data[student.name] = student.to_saveable()
-        save_progress(students_data)
-        _saved_progress = load_progress()
-    
+        """Guarda el progreso de todos los estudiantes en memoria (bloqueante)"""
+        for student in self.local_students():
+            self.persistence.mark_dirty(student)
+        self.persistence.flush_sync()
+
+    def save_response(self, student: StudentData, activity_id: str):
+        """Marca la respuesta para guardarse en el próximo flush de persistencia"""
+        self.persistence.mark_response(student, activity_id)
+
+    def save_reflection(self, student: StudentData, reflection: Dict):
+        """Marca la reflexión para guardarse en el próximo flush de persistencia"""
+        self.persistence.mark_reflection(student, reflection)
+
     def _find_student_by_name(self, name: str) -> Optional[StudentData]:
-        """Busca estudiante por nombre (ignorando mayúsculas)"""
-        name_lower = name.strip().lower()
-        for student in self.students.values():
-            if student.name.lower() == name_lower:
-                return student
-        return None
+        """Busca estudiante por nombre (ignorando mayúsculas y acentos)"""
+        session_id = self.name_index.get(name_key(name))
+        return self.students.get(session_id) if session_id else None
     
     def validate_name(self, name: str, allow_reconnect: bool = True) -> tuple[bool, str]:
         """Valida nombre de estudiante"""
@@ -413,7 +1306,7 @@ class StudentManager:
                 return False, "Este nombre ya está en uso en la clase"
         
         # Verificar si hay datos guardados (estudiante anterior que se reconecta)
-        if self._get_saved_data(name):
+        if self.store.has_student(name):
             return True, "RESTORE"
         
         return True, "OK"
@@ -434,8 +1327,8 @@ class StudentManager:
         # Generar ID de sesión
         session_id = generate_session_id()
         
-        # Verificar si hay datos guardados para restaurar
-        saved_data = self._get_saved_data(name)
+        # Cargar datos guardados solo si validate_name los encontró
+        saved_data = self._get_saved_data(name) if message == "RESTORE" else None
         
         # Crear estudiante (con datos guardados si existen)
         student = StudentData(session_id, name, from_saved=saved_data)
@@ -443,7 +1336,8 @@ class StudentManager:
         
         # Registrar
         self.students[session_id] = student
-        self.names_in_use.add(name)
+        self.aggregates.track(student)
+        self.name_index[name_key(name)] = session_id
         self.websocket_to_student[websocket] = session_id
         
         print(f"[INFO] Estudiante registrado: {name} (ID: {session_id})")
@@ -455,24 +1349,65 @@ class StudentManager:
         
         if student:
             # Estudiante encontrado, reconectar
-            student.websocket = websocket
-            student.status = StudentConnectionStatus.CONNECTED
-            self.websocket_to_student[websocket] = student.session_id
+            self._attach_socket(student, websocket)
             print(f"[INFO] Estudiante reconectado: {student.name}")
             return student, "Reconectado exitosamente"
         
         return None, "No se encontró sesión previa"
     
-    def disconnect_student(self, websocket: WebSocket):
-        """Desconecta un estudiante y guarda su progreso"""
+    def _attach_socket(self, student: StudentData, websocket: WebSocket):
+        previous = student.websocket
+        if previous is not None and previous is not websocket:
+            # Socket anterior medio abierto (el celular cambió de red): lo reemplaza el nuevo
+            self.websocket_to_student.pop(previous, None)
+            connection = connection_registry.get(previous)
+            if connection is not None:
+                connection.shutdown(4009)
+        student.websocket = websocket
+        student.worker = None  # Ahora el socket está en este worker
+        student.status = StudentConnectionStatus.CONNECTED
+        self.websocket_to_student[websocket] = student.session_id
+    
+    def attach_session(self, student: StudentData, websocket: WebSocket) -> StudentSession:
+        """Sesión reanudable del estudiante; desde aquí sus frames llevan seq"""
+        session = self.sessions.get(student.session_id)
+        if session is None:
+            session = self.sessions[student.session_id] = StudentSession(student.session_id)
+            self.resume_tokens[session.token] = student.session_id
+        elif session.expired:
+            session.expired = False  # Vuelve a guardar frames desde el snapshot
+        session.detached_at = None
+        self.detached_sessions.pop(student.session_id, None)
+        connection = connection_registry.get(websocket)
+        if connection is not None:
+            connection.session = session
+        return session
+    
+    def resume_student(self, token: str, websocket: WebSocket) -> tuple[Optional[StudentData], Optional[StudentSession]]:
+        """Reconecta al dueño de un token de reanudación (None si no existe aquí)"""
+        student = self.students.get(self.resume_tokens.get(token, ""))
+        if student is None or student.worker is not None:
+            return None, None
+        self._attach_socket(student, websocket)
+        print(f"[INFO] Estudiante reanudó su sesión: {student.name}")
+        return student, self.sessions[student.session_id]
+    
+    def disconnect_student(self, websocket: WebSocket) -> bool:
+        """Desconecta un estudiante (False si su sesión ya pasó a otro socket)"""
         session_id = self.websocket_to_student.pop(websocket, None)
         if session_id and session_id in self.students:
             student = self.students[session_id]
             student.status = StudentConnectionStatus.DISCONNECTED
             student.websocket = None
+            session = self.sessions.get(session_id)
+            if session is not None:
+                # Sigue guardando frames por si reanuda dentro de la ventana
+                session.detached_at = time.monotonic()
+                self.detached_sessions[session_id] = session
             print(f"[INFO] Estudiante desconectado: {student.name}")
-            # Guardar progreso al desconectar
-            self._save_all_progress()
+            # El progreso ya se persiste en cada respuesta: no hace falta reescribirlo
+            return True
+        return False
     
     def get_student_by_websocket(self, websocket: WebSocket) -> Optional[StudentData]:
         """Obtiene estudiante por websocket"""
@@ -483,49 +1418,161 @@ class StudentManager:
         """Obtiene estudiante por ID de sesión"""
         return self.students.get(session_id)
     
+    def local_students(self) -> List[StudentData]:
+        """Estudiantes cuyo socket (actual o último) está en este worker"""
+        return [s for s in self.students.values() if s.worker is None]
+    
+    def apply_snapshot(self, snapshot: Dict, response: Optional[Dict] = None,
+                       reflection: Optional[Dict] = None) -> Optional[StudentData]:
+        """Aplica la copia de un estudiante publicada por otro worker.
+        
+        Un encabezado sin "responses"/"reflections" (cambios posteriores a la
+        entrada) conserva las de la copia y agrega response o reflection.
+        Devuelve None si se ignora: el socket está en este worker, o es una
+        desconexión informada por un worker que ya no tiene al estudiante.
+        """
+        session_id = snapshot["session_id"]
+        worker = snapshot.get("worker")
+        status = StudentConnectionStatus(snapshot["status"])
+        student = self.students.get(session_id)
+        if student is not None:
+            if student.websocket is not None:
+                return None
+            if status == StudentConnectionStatus.DISCONNECTED and student.worker not in (None, worker):
+                return None
+            self.aggregates.untrack(student)
+        else:
+            key = name_key(snapshot["name"])
+            previous = self.students.get(self.name_index.get(key, ""))
+            if previous is not None:
+                if previous.websocket is not None:
+                    return None  # Mismo nombre conectado aquí: gana el socket local
+                self._forget(previous)
+            student = StudentData(session_id, snapshot["name"])
+            self.students[session_id] = student
+            self.name_index[key] = session_id
+        student.worker = worker
+        student.status = status
+        student.accumulated_percentage = snapshot.get("accumulated_percentage", 0.0)
+        if "responses" in snapshot:
+            student.responses = StudentResponses.from_saved(snapshot["responses"])
+        if response is not None:
+            student.responses.record_saved(response)
+        if "reflections" in snapshot:
+            student.reflections = list(snapshot["reflections"])
+        if reflection is not None:
+            student.reflections.append(reflection)
+        self.aggregates.track(student)
+        return student
+    
+    def _forget(self, student: StudentData):
+        """Quita un estudiante de memoria (reemplazado por otra sesión con su nombre)"""
+        self.aggregates.untrack(student)
+        del self.students[student.session_id]
+        key = name_key(student.name)
+        if self.name_index.get(key) == student.session_id:
+            del self.name_index[key]
+        session = self.sessions.pop(student.session_id, None)
+        if session is not None:
+            self.resume_tokens.pop(session.token, None)
+            self.detached_sessions.pop(student.session_id, None)
+    
+    def disconnect_worker(self, worker: str) -> int:
+        """Marca desconectados a los estudiantes de un worker que se detuvo"""
+        count = 0
+        for student in self.students.values():
+            if student.worker == worker and student.status != StudentConnectionStatus.DISCONNECTED:
+                student.status = StudentConnectionStatus.DISCONNECTED
+                count += 1
+        return count
+    
     def get_connected_students(self) -> List[StudentData]:
         """Obtiene lista de estudiantes conectados"""
         return [s for s in self.students.values() 
                 if s.status != StudentConnectionStatus.DISCONNECTED]
     
-    def get_dashboard_summary(self, current_activity_id: Optional[str] = None) -> Dict:
-        """Obtiene resumen para dashboard del docente"""
-        connected = self.get_connected_students()
-        responded = [s for s in connected if s.status == StudentConnectionStatus.RESPONDED]
-        not_responded = [s for s in connected if s.status == StudentConnectionStatus.NOT_RESPONDED]
-        
-        # Conteo de votos por opción para la actividad actual
-        vote_counts = {}
-        if current_activity_id:
-            for student in connected:
-                if student.has_responded(current_activity_id):
-                    response = student.responses.get(current_activity_id, {})
-                    answer = response.get('answer')
-                    if answer is not None:
-                        vote_counts[str(answer)] = vote_counts.get(str(answer), 0) + 1
+    def get_dashboard_summary(self, current_activity_id: Optional[str] = None,
+                              include_students: bool = True) -> Dict:
+        """Obtiene resumen para dashboard del docente (contadores en O(1))"""
+        aggregates = self.aggregates
+        connected = aggregates.connected
+        responded = aggregates.status_counts[StudentConnectionStatus.RESPONDED]
+        not_responded = aggregates.status_counts[StudentConnectionStatus.NOT_RESPONDED]
         
-        return {
-            "students": [s.to_summary() for s in connected],
-            "totalStudents": len(connected),
-            "respondedCount": len(responded),
-            "notRespondedCount": len(not_responded),
+        summary = {
+            "version": self.roster_version,
+            "totalStudents": connected,
+            "respondedCount": responded,
+            "notRespondedCount": not_responded,
             "currentActivityId": current_activity_id,
-            "responseRate": (len(responded) / len(connected) * 100) if connected else 0,
-            "voteCounts": vote_counts,  # Nuevo: conteo de votos por opción
+            "responseRate": (responded / connected * 100) if connected else 0,
+            "voteCounts": aggregates.vote_counts(current_activity_id),  # Conteo de votos por opción
         }
+        if include_students:
+            # El roster es lo único que recorre a los estudiantes
+            summary["students"] = [s.to_summary() for s in self.get_connected_students()]
+        return summary
+    
+    def take_dashboard_delta(self, current_activity_id: Optional[str] = None) -> Dict:
+        """Avanza la versión del roster y arma el delta respecto de la anterior.
+        
+        Solo incluye los estudiantes cuyo resumen cambió: "changed" (altas y
+        modificaciones) y "removed" (session_ids que dejaron de estar conectados).
+        Un cliente cuya versión no coincide con "baseVersion" debe pedir
+        REQUEST_DASHBOARD para recibir el snapshot completo.
+        """
+        base_version = self.roster_version
+        self.roster_version += 1
+        dirty = self.aggregates.roster_dirty
+        self.aggregates.roster_dirty = set()
+        
+        changed, removed = [], []
+        for session_id in dirty:
+            student = self.students.get(session_id)
+            if student and student.status != StudentConnectionStatus.DISCONNECTED:
+                changed.append(student.to_summary())
+            else:
+                removed.append(session_id)
+        
+        summary = self.get_dashboard_summary(current_activity_id, include_students=False)
+        summary.update({
+            "delta": True,
+            "baseVersion": base_version,
+            "changed": changed,
+            "removed": removed,
+        })
+        return summary
     
     def get_ranking(self, limit: int = 5) -> List[Dict]:
-        """Obtiene ranking de los mejores estudiantes"""
-        connected = self.get_connected_students()
-        # Ordenar por porcentaje descendente
-        sorted_students = sorted(
-            connected, 
-            key=lambda s: s.accumulated_percentage, 
-            reverse=True
-        )
-        # Tomar solo los primeros N
-        top_students = sorted_students[:limit]
-        return [s.to_ranking_entry() for s in top_students]
+        """Obtiene ranking de los mejores estudiantes (O(limit), sin ordenar a todos)"""
+        top_ids = self.aggregates.leaderboard.top(limit)
+        return [self.students[session_id].to_ranking_entry() for session_id in top_ids]
+    
+    def get_activity_stats(self, activity_id: str, activity: Optional[ActivityData] = None) -> Optional[Dict]:
+        """Estadísticas de una pregunta (cacheadas hasta la próxima respuesta).
+        
+        None si la actividad no está registrada y nadie la respondió.
+        """
+        stats = self.aggregates.items.stats(activity_id)
+        if stats is None:
+            if activity is None:
+                return None
+            stats = empty_item_stats()
+        data = {"activityId": activity_id, **stats}
+        if activity is not None:
+            # Todas las opciones, también las que nadie eligió
+            distribution = {str(i): 0 for i in range(len(activity.options or []))}
+            distribution.update(stats["distribution"])
+            data.update({
+                "distribution": distribution,
+                "options": activity.options,
+                "correctIndex": activity.correct_index,
+            })
+        return data
+    
+    def get_rank(self, session_id: str) -> Optional[int]:
+        """Posición de un estudiante en el ranking (O(log N))"""
+        return self.aggregates.leaderboard.rank(session_id)
     
     def reset_all_for_new_activity(self):
         """Resetea todos los estudiantes para nueva actividad"""
@@ -543,45 +1590,39 @@ class StudentManager:
         return reset_count
     
     def _clear_saved_progress(self):
-        """Limpia el archivo de progreso guardado"""
-        try:
-            import os
-            if os.path.exists(PROGRESS_FILE):
-                with open(PROGRESS_FILE, 'w', encoding='utf-8') as f:
-                    json.dump({}, f)
-                print(f"[INFO] Archivo de progreso limpiado: {PROGRESS_FILE}")
-        except Exception as e:
-            print(f"[ERROR] Error limpiando archivo de progreso: {e}")
+        """Limpia el progreso guardado"""
+        self.persistence.clear()
+        print("[INFO] Progreso guardado limpiado")
     
-    async def broadcast_to_students(self, message: Dict):
-        """Envía mensaje a todos los estudiantes conectados"""
-        json_msg = json.dumps(message, ensure_ascii=False)
-        disconnected = []
-        
-        for _, student in self.students.items():
-            if student.websocket and student.status != StudentConnectionStatus.DISCONNECTED:
-                try:
-                    await student.websocket.send_text(json_msg)
-                except (ConnectionError, RuntimeError) as e:
-                    print(f"[ERROR] Error enviando a {student.name}: {e}")
-                    disconnected.append(student.websocket)
-        
-        for ws in disconnected:
-            self.disconnect_student(ws)
+    async def broadcast_to_students(self, message: Union[Dict, EncodedMessage]):
+        """Envía mensaje a todos los estudiantes conectados (solo encola)"""
+        enqueue_many(
+            [student.websocket for student in self.students.values()
+             if student.websocket and student.status != StudentConnectionStatus.DISCONNECTED],
+            message
+        )
+        if self.detached_sessions:
+            self._record_detached(message)
+    
+    def _record_detached(self, message: Union[Dict, EncodedMessage]):
+        """Guarda el broadcast en las sesiones desconectadas (las vencidas se sueltan)"""
+        deadline = time.monotonic() - RESUME_WINDOW_SECONDS
+        for session_id, session in list(self.detached_sessions.items()):
+            if session.detached_at < deadline:
+                session.expire()
+                del self.detached_sessions[session_id]
+            else:
+                session.record(message)
     
     async def send_to_student(self, session_id: str, message: Dict):
         """Envía mensaje a un estudiante específico"""
         student = self.students.get(session_id)
         if student and student.websocket:
             try:
-                await student.websocket.send_text(
-                    json.dumps(message, ensure_ascii=False)
-                )
+                await send_message(student.websocket, message)
             except (ConnectionError, RuntimeError) as e:
                 print(f"[ERROR] Error enviando a {student.name}: {e}")
 
-student_manager = StudentManager()
-
 # ============================================================
 # MANAGER DE CONEXIONES (DOCENTE)
 # ============================================================
@@ -590,39 +1631,55 @@ class TeacherConnectionManager:
     """Gestiona conexiones de docentes"""
     def __init__(self):
         self.teacher_connections: List[WebSocket] = []
+        self.delta_connections: set = set()  # Docentes que reciben DASHBOARD_UPDATE por delta
     
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
+    async def connect(self, websocket: WebSocket, dashboard_delta: bool = False):
+        await accept_client(websocket)
         self.teacher_connections.append(websocket)
+        if dashboard_delta:
+            self.delta_connections.add(websocket)
         print(f"[INFO] Docente conectado (Total: {len(self.teacher_connections)})")
     
     def disconnect(self, websocket: WebSocket):
+        connection_registry.close(websocket)
+        self.delta_connections.discard(websocket)
         if websocket in self.teacher_connections:
             self.teacher_connections.remove(websocket)
             print("[INFO] Docente desconectado")
     
     async def broadcast_to_teachers(self, message: Dict):
-        """Envía mensaje a todos los docentes"""
-        json_msg = json.dumps(message, ensure_ascii=False)
-        disconnected = []
-        
-        for ws in self.teacher_connections:
-            try:
-                await ws.send_text(json_msg)
-            except (ConnectionError, RuntimeError):
-                disconnected.append(ws)
-        
-        for ws in disconnected:
-            self.disconnect(ws)
-
-teacher_manager = TeacherConnectionManager()
+        """Envía mensaje a todos los docentes (solo encola)"""
+        enqueue_many(self.teacher_connections, message)
+    
+    async def broadcast_dashboard(self, delta_data: Dict, build_full: Callable[[], Dict]):
+        """Envía DASHBOARD_UPDATE: delta a quienes lo negociaron, completo al resto"""
+        delta_ws = [ws for ws in self.teacher_connections if ws in self.delta_connections]
+        full_ws = [ws for ws in self.teacher_connections if ws not in self.delta_connections]
+        if delta_ws:
+            enqueue_many(delta_ws, {"type": "DASHBOARD_UPDATE", "data": delta_data})
+        if full_ws:
+            enqueue_many(full_ws, {"type": "DASHBOARD_UPDATE", "data": build_full()})
 
 # ============================================================
 # ESTADO DE LA CLASE
 # ============================================================
 
+# Acciones del docente que cambian ClassState: se guardan como eventos
+# (ClassStateLog) y se re-aplican al reiniciar
+CLASS_EVENT_ACTIONS = {
+    "SET_STATE", "SET_SLIDE", "REGISTER_ACTIVITY", "UNLOCK_ACTIVITY", "LOCK_ACTIVITY",
+    "LOCK_ALL_ACTIVITIES", "RESET_ALL_STUDENTS_PROGRESS",
+}
+# Eventos que genera el servidor (no el docente): cierre por tiempo límite
+EXPIRE_ACTIVITY_EVENT = "EXPIRE_ACTIVITY"
+
 class ClassState:
-    """Estado global de la clase"""
+    """Estado global de la clase
+    
+    STATE_UPDATE se serializa una sola vez por versión: los cambios de
+    estado, slide o actividad actual deben pasar por set_state/set_slide/
+    set_current_activity para invalidar el mensaje cacheado.
+    """
     def __init__(self):
         self.current_state = "LOBBY"
         self.current_slide_index = 0
@@ -630,6 +1687,30 @@ class ClassState:
         self.current_activity: Optional[ActivityData] = None
         self.activities: Dict[str, ActivityData] = {}  # activity_id -> ActivityData
         self.reflections: List[Dict] = []  # Todas las reflexiones recibidas
+        self.version = 0
+        self._frame: Optional[EncodedMessage] = None
+        self._frame_key: Optional[tuple] = None
+    
+    def touch(self):
+        """Marca el estado como modificado (descarta STATE_UPDATE cacheado)"""
+        self.version += 1
+        self._frame = None
+    
+    def set_state(self, value: str):
+        if value != self.current_state:
+            self.current_state = value
+            self.touch()
+    
+    def set_slide(self, slide: int, block: int):
+        if (slide, block) != (self.current_slide_index, self.current_block_index):
+            self.current_slide_index = slide
+            self.current_block_index = block
+            self.touch()
+    
+    def set_current_activity(self, activity: Optional[ActivityData]):
+        if activity is not self.current_activity:
+            self.current_activity = activity
+            self.touch()
     
     def register_activity(self, activity_id: str, question: str, options: List[str],
                          correct_index: int, percentage_value: float,
@@ -658,6 +1739,10 @@ class ClassState:
     def get_activity(self, activity_id: str) -> Optional[ActivityData]:
         return self.activities.get(activity_id)
     
+    @property
+    def current_activity_id(self) -> Optional[str]:
+        return self.current_activity.id if self.current_activity else None
+    
     def to_dict(self) -> Dict:
         return {
             "state": self.current_state,
@@ -665,41 +1750,567 @@ class ClassState:
             "block": self.current_block_index,
             "currentActivity": self.current_activity.to_student_dict() if self.current_activity else None,
         }
+    
+    def apply_event(self, action: str, payload: Dict, at: float) -> Any:
+        """Aplica una acción de CLASS_EVENT_ACTIONS o EXPIRE_ACTIVITY_EVENT (sin enviar nada).
+        
+        Es lo único que cambia el estado en esas acciones, así re-aplicar los
+        eventos guardados reconstruye exactamente el mismo ClassState. `at`
+        (time.time() original) fija la hora de cierre de UNLOCK_ACTIVITY.
+        Devuelve la actividad registrada/habilitada/vencida o las cerradas (LOCK_ALL).
+        """
+        if action == "SET_STATE":
+            self.set_state(payload.get("state", self.current_state))
+        
+        elif action == "SET_SLIDE":
+            self.set_slide(
+                payload.get("slide", self.current_slide_index),
+                payload.get("block", self.current_block_index)
+            )
+        
+        elif action == "REGISTER_ACTIVITY":
+            return self.register_activity(
+                activity_id=payload.get("activityId"),
+                question=payload.get("question", ""),
+                options=payload.get("options", []),
+                correct_index=payload.get("correctIndex", 0),
+                percentage_value=payload.get("percentageValue", 10.0),
+                activity_type=payload.get("activityType", "multipleChoice"),
+                time_limit=payload.get("timeLimitSeconds"),
+                title=payload.get("title"),
+                slide_content=payload.get("slideContent"),
+                biblical_reference=payload.get("biblicalReference")
+            )
+        
+        elif action == "UNLOCK_ACTIVITY":
+            activity = self.get_activity(payload.get("activityId"))
+            if activity:
+                activity.activate(at)
+                self.set_current_activity(activity)
+            return activity
+        
+        elif action == "LOCK_ACTIVITY":
+            activity_id = payload.get("activityId")
+            # Si se especifica un activityId, bloquear esa actividad específica
+            if activity_id:
+                activity = self.get_activity(activity_id)
+                if activity:
+                    activity.state = ActivityState.CLOSED
+                    # Solo limpiar current_activity si coincide
+                    if self.current_activity and self.current_activity.id == activity_id:
+                        self.set_current_activity(None)
+            else:
+                # Comportamiento original: bloquear la actividad actual
+                if self.current_activity:
+                    self.current_activity.state = ActivityState.CLOSED
+                    self.set_current_activity(None)
+        
+        elif action == EXPIRE_ACTIVITY_EVENT:
+            # Cierre por tiempo límite: solo si sigue activa con la misma hora de
+            # cierre (un UNLOCK posterior la re-habilitó con otra). El snapshot
+            # guarda closesAt en ISO: se compara al milisegundo
+            activity = self.get_activity(payload.get("activityId"))
+            closes_at = payload.get("closesAt")
+            if (activity is None or activity.state != ActivityState.ACTIVE or (
+                    closes_at is not None and activity.closes_at is not None
+                    and abs(activity.closes_at - closes_at) > 0.001)):
+                return None
+            activity.state = ActivityState.CLOSED
+            if self.current_activity is activity:
+                self.set_current_activity(None)
+            return activity
+        
+        elif action == "LOCK_ALL_ACTIVITIES":
+            # Cerrar TODAS las actividades activas de una vez
+            closed_count = 0
+            for activity in self.activities.values():
+                if activity.state == ActivityState.ACTIVE:
+                    activity.state = ActivityState.CLOSED
+                    closed_count += 1
+            self.set_current_activity(None)
+            return closed_count
+        
+        elif action == "RESET_ALL_STUDENTS_PROGRESS":
+            # Cerrar todas las actividades
+            for activity in self.activities.values():
+                activity.state = ActivityState.CLOSED
+            self.set_current_activity(None)
+            self.activities = {}
+        return None
+    
+    def to_snapshot(self) -> Dict:
+        """Estado completo (con correctIndex) para arrancar otro worker sincronizado"""
+        return {
+            "state": self.current_state,
+            "slide": self.current_slide_index,
+            "block": self.current_block_index,
+            "currentActivityId": self.current_activity_id,
+            "activities": [activity.to_dict() for activity in self.activities.values()],
+            "reflections": list(self.reflections),
+        }
+    
+    def apply_snapshot(self, data: Dict):
+        self.activities = {
+            item["id"]: ActivityData.from_dict(item) for item in data.get("activities", [])
+        }
+        self.reflections = list(data.get("reflections", self.reflections))
+        self.set_state(data.get("state", self.current_state))
+        self.set_slide(data.get("slide", 0), data.get("block", 0))
+        self.set_current_activity(self.activities.get(data.get("currentActivityId") or ""))
+        self.touch()
+    
+    def frame(self) -> EncodedMessage:
+        """STATE_UPDATE serializado (se reconstruye si cambió el estado o la actividad actual)"""
+        # La actividad actual puede cerrarse sin dejar de ser la actual: su versión
+        # forma parte de la clave
+        key = (self.version, self.current_activity.version if self.current_activity else None)
+        if self._frame is None or self._frame_key != key:
+            self._frame = EncodedMessage({
+                "type": "STATE_UPDATE",
+                "data": self.to_dict()
+            })
+            self._frame_key = key
+        return self._frame
 
-state = ClassState()
 
 # ============================================================
-# ENDPOINTS HTTP
+# CICLO DE VIDA
 # ============================================================
 
-@app.get("/")
-async def root():
-    """Endpoint de verificación"""
-    connected_students = student_manager.get_connected_students()
-    return {
-        "status": "ok",
-        "message": "Sapiencial App Server Running",
-        "version": "2.0.0",
-        "connectedStudents": len(connected_students),
-        "connectedTeachers": len(teacher_manager.teacher_connections),
-    }
+@app.on_event("startup")
+async def on_startup():
+    print(f"[INFO] Codec JSON: {CODEC_NAME}")
+    if cluster.enabled and PROGRESS_STORE_BACKEND != "sqlite":
+        print("[WARN] Con varios workers usa PROGRESS_STORE=sqlite (el JSON no se comparte entre procesos)")
+    await cluster.start()
+    activity_timers.start()
+    classrooms.start()
+    # El aula predeterminada siempre está abierta (clientes sin classCode)
+    await classrooms.open(DEFAULT_CLASS_CODE)
+    install_restart_notice()
 
-@app.get("/state")
-async def get_state():
+@app.on_event("shutdown")
+async def on_shutdown():
+    await activity_timers.stop()
+    await cluster.stop()
+    reports.shutdown()
+    # Guardar sincrónicamente lo pendiente de cada aula antes de terminar
+    await classrooms.stop()
+    print("[INFO] Progreso guardado al apagar")
+
+def notify_restart():
+    """Snapshot final de cada aula y aviso de reinicio a todos los clientes.
+    
+    Corre al recibir SIGTERM (deploy o reinicio en Render), antes de que
+    uvicorn cierre las conexiones con 1012: el cliente sabe que debe
+    reconectar en unos segundos en lugar de mostrar un error.
+    """
+    notice = {
+        "type": "SERVER_RESTARTING",
+        "data": {
+            "message": "El servidor se está reiniciando, reconectando en unos segundos...",
+            "reconnectAfterMs": RESTART_RECONNECT_MS,
+        }
+    }
+    for room in list(classrooms.rooms.values()):
+        room.save_state_snapshot()
+        enqueue_many(room.teacher_manager.teacher_connections + list(room.student_manager.websocket_to_student),
+                     notice)
+    print("[INFO] SIGTERM: estado guardado y aviso de reinicio enviado")
+
+def install_restart_notice():
+    """Agrega notify_restart a SIGTERM sin quitarle la señal a uvicorn.
+    
+    uvicorn la atiende por el event loop (loop.add_signal_handler), que se
+    sigue enterando por el wakeup fd aunque haya un handler de Python. Solo se
+    instala si ya hay un handler (con SIG_DFL el proceso debe seguir muriendo).
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+    if not callable(previous):
+        return
+    loop = asyncio.get_running_loop()
+    
+    def on_sigterm(signum, frame):
+        loop.call_soon_threadsafe(notify_restart)
+        previous(signum, frame)
+    
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+# ============================================================
+# REPORTES EN SEGUNDO PLANO
+# ============================================================
+
+REPORT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+# Orden de las clasificaciones en la hoja Resumen
+CLASSIFICATION_ORDER = [classification.value for classification in StudentClassification]
+
+class ReportJob:
+    """Un reporte pedido: pending -> running -> done | failed"""
+    def __init__(self, job_id: str, class_code: str, key: tuple):
+        self.id = job_id
+        self.class_code = class_code
+        self.key = key  # (aula, versión del progreso, resumen de las actividades)
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.summary: Optional[Dict] = None
+        self.path: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+    
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "classCode": self.class_code,
+            "status": self.status,
+            "error": self.error,
+            "summary": self.summary,
+            "createdAt": datetime.fromtimestamp(self.created_at).isoformat(),
+            "finishedAt": datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None,
+            # classCode en la URL: el gateway la envía al nodo del aula
+            "downloadUrl": f"/reports/{self.id}/download?classCode={self.class_code}" if self.status == "done" else None,
+        }
+
+class ReportQueue:
+    """Reportes XLSX generados en un ProcessPoolExecutor.
+    
+    Armar el libro (una hoja por estudiante) es trabajo de CPU: el volcado
+    del progreso corre en el threadpool y el XLSX en otro proceso, así el
+    event loop sigue atendiendo la clase en vivo.
+    
+    Cada reporte se identifica por (aula, store.version(), actividades): si
+    la clase no cambió, pedirlo de nuevo devuelve el mismo trabajo (en curso
+    o ya listo) sin generar nada. Se guardan los últimos cache_size reportes
+    listos; los anteriores se borran del disco.
+    """
+    def __init__(self, directory: str, workers: int, cache_size: int, max_pending: int):
+        self.directory = directory
+        self.workers = max(1, workers)
+        self.cache_size = max(1, cache_size)
+        self.max_pending = max(1, max_pending)
+        self.jobs: Dict[str, ReportJob] = {}  # id -> trabajo (en orden de creación)
+        self._by_key: Dict[tuple, ReportJob] = {}  # clave -> trabajo en curso o listo
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: set = set()  # Referencias a los trabajos en curso
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # spawn: el hijo no hereda los hilos ni los sockets del servidor
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+    
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        return self.jobs.get(job_id)
+    
+    def artifact_path(self, job_id: str) -> Optional[str]:
+        """Archivo de un reporte listo, también si lo generó otro worker"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.path if job.status == "done" else None
+        if not REPORT_ID_PATTERN.match(job_id):
+            return None
+        path = os.path.join(self.directory, f"{job_id}.xlsx")
+        return path if os.path.exists(path) else None
+    
+    @staticmethod
+    def report_key(room: "Classroom") -> tuple:
+        activities = {
+            activity.id: {
+                "question": activity.question,
+                "options": activity.options,
+                "correctIndex": activity.correct_index,
+            }
+            for activity in room.state.activities.values()
+        }
+        digest = hashlib.md5(json.dumps(activities, sort_keys=True).encode("utf-8")).hexdigest()
+        return (room.code, room.student_manager.store.version(), digest), activities
+    
+    async def submit(self, room: "Classroom") -> ReportJob:
+        """Reporte del aula: el cacheado si la clase no cambió, si no uno nuevo"""
+        # Lo que aún no se escribió también entra en el reporte
+        await room.student_manager.persistence.flush()
+        key, activities = self.report_key(room)
+        job = self._by_key.get(key)
+        if job is not None:
+            if job.status == "done":
+                REPORTS_REQUESTED.labels("cached").inc()
+            return job
+        if sum(1 for j in self.jobs.values() if not j.finished) >= self.max_pending:
+            raise HTTPException(status_code=429, detail="Hay demasiados reportes en curso, intenta en unos segundos")
+        job = ReportJob(uuid.uuid4().hex, room.code, key)
+        self.jobs[job.id] = job
+        self._by_key[key] = job
+        task = asyncio.create_task(self._run(job, room, activities))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+    
+    @staticmethod
+    def _dump(room: "Classroom", path: str):
+        """Volcado NDJSON del progreso (corre en el threadpool)"""
+        with open(path, "wb") as f:
+            for chunk in iter_export(room.student_manager.store, "students", "ndjson",
+                                     lambda percentage: get_classification(percentage).value):
+                room.touch()  # Un reporte en curso mantiene el aula cargada
+                f.write(chunk)
+    
+    async def _run(self, job: ReportJob, room: "Classroom", activities: Dict[str, Dict]):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        dump_path = os.path.join(self.directory, f"{job.id}.ndjson")
+        path = os.path.join(self.directory, f"{job.id}.xlsx")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            job.status = "running"
+            await loop.run_in_executor(None, self._dump, room, dump_path)
+            job.summary = await loop.run_in_executor(
+                self._get_pool(), build_class_report, dump_path, path + ".tmp", room.code,
+                activities, CLASSIFICATION_ORDER, REPORT_STUDENT_SHEETS,
+            )
+            # Renombrar al final: otro worker solo ve el archivo completo
+            os.replace(path + ".tmp", path)
+            job.path = path
+            job.status = "done"
+            REPORTS_REQUESTED.labels("generated").inc()
+            REPORT_DURATION.observe(time.perf_counter() - started)
+            print(f"[INFO] Reporte del aula {room.code} listo: {job.summary['students']} estudiantes, "
+                  f"{job.summary['bytes']} bytes en {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # Un proceso del pool murió: el próximo reporte crea otro pool
+                self._pool = None
+            job.status = "failed"
+            job.error = str(e) or type(e).__name__
+            self._by_key.pop(job.key, None)
+            self._remove(path + ".tmp")
+            REPORTS_REQUESTED.labels("failed").inc()
+            print(f"[ERROR] Error generando reporte del aula {room.code}: {job.error}")
+        finally:
+            job.finished_at = time.time()
+            self._remove(dump_path)
+            self._trim()
+    
+    def _trim(self):
+        """Conserva los últimos cache_size reportes listos (y tantos fallidos)"""
+        for status in ("done", "failed"):
+            finished = [job for job in self.jobs.values() if job.status == status]
+            for job in finished[:max(0, len(finished) - self.cache_size)]:
+                del self.jobs[job.id]
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+                if job.path:
+                    self._remove(job.path)
+    
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[WARN] No se pudo borrar {path}: {e}")
+    
+    def shutdown(self):
+        """Detiene el pool y borra los reportes de este worker"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        for job in self.jobs.values():
+            if job.path:
+                self._remove(job.path)
+        self.jobs.clear()
+        self._by_key.clear()
+
+reports = ReportQueue(REPORTS_DIR, REPORT_WORKERS, REPORT_CACHE_SIZE, REPORT_MAX_PENDING)
+
+# ============================================================
+# ENDPOINTS HTTP
+# ============================================================
+
+def validate_class_code_or_400(class_code: str) -> str:
+    code = normalize_class_code(class_code)
+    if code is None:
+        raise HTTPException(status_code=400, detail="Código de clase inválido")
+    return code
+
+def get_classroom_or_404(class_code: str) -> "Classroom":
+    """Aula ya cargada: las consultas sin token no abren ni crean aulas"""
+    room = classrooms.get(validate_class_code_or_400(class_code))
+    if room is None:
+        raise HTTPException(status_code=404, detail="Aula no encontrada")
+    room.touch()
+    return room
+
+async def open_classroom_or_404(class_code: str) -> "Classroom":
+    """Aula cargada o guardada en disco (endpoints del docente); nunca crea una nueva"""
+    room = await classrooms.open(validate_class_code_or_400(class_code), create=False)
+    if room is None:
+        raise HTTPException(status_code=404, detail="Aula no encontrada")
+    return room
+
+@app.get("/")
+async def root():
+    """Endpoint de verificación"""
+    rooms = list(classrooms.rooms.values())
+    return {
+        "status": "ok",
+        "message": "Sapiencial App Server Running",
+        "version": "2.0.0",
+        "connectedStudents": sum(len(r.student_manager.get_connected_students()) for r in rooms),
+        "connectedTeachers": sum(len(r.teacher_manager.teacher_connections) for r in rooms),
+        "rooms": len(rooms),
+    }
+
+@app.get("/rooms")
+async def get_rooms():
+    """Aulas cargadas en este worker"""
+    return [room.summary() for room in classrooms.rooms.values()]
+
+@app.get("/state")
+async def get_state(class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")):
     """Obtiene el estado actual de la clase"""
-    return state.to_dict()
+    room = get_classroom_or_404(class_code)
+    return room.state.to_dict()
+
+@app.get("/persistence")
+async def get_persistence_stats(class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")):
+    """Métricas de persistencia (cambios pendientes y retraso de escritura)"""
+    room = get_classroom_or_404(class_code)
+    return room.student_manager.persistence.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(METRICS.render(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+@app.get("/protocol")
+async def get_protocol():
+    """Subprotocolo binario opcional, su diccionario de claves compactas y la reanudación"""
+    return {
+        "default": "json",
+        "msgpack": {
+            "subprotocol": MSGPACK_SUBPROTOCOL,
+            "available": MSGPACK_AVAILABLE,
+            "keys": COMPACT_KEYS,
+        },
+        "resume": {
+            "bufferSize": RESUME_BUFFER_SIZE,
+            "windowSeconds": RESUME_WINDOW_SECONDS,
+        },
+    }
 
 @app.get("/students")
-async def get_students():
+async def get_students(class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")):
     """Obtiene lista de estudiantes (para debug)"""
-    return student_manager.get_dashboard_summary(
-        state.current_activity.id if state.current_activity else None
+    room = get_classroom_or_404(class_code)
+    return room.student_manager.get_dashboard_summary(
+        room.state.current_activity_id
+    )
+
+@app.get("/activities/{activity_id}/stats")
+async def get_activity_stats(
+    activity_id: str,
+    token: str = Query(default=""),
+    class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")
+):
+    """Estadísticas de una pregunta para el docente (ver GET_ACTIVITY_STATS)"""
+    if not validate_token(token, "teacher"):
+        raise HTTPException(status_code=403, detail="Token inválido")
+    room = await open_classroom_or_404(class_code)
+    stats = room.student_manager.get_activity_stats(activity_id, room.state.get_activity(activity_id))
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Actividad no encontrada")
+    return stats
+
+@app.get("/export/{table}")
+async def export_progress(
+    table: str,
+    export_format: str = Query(default="csv", alias="format"),
+    token: str = Query(default=""),
+    class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")
+):
+    """Descarga el progreso guardado del aula (students, responses o reflections) en CSV o NDJSON"""
+    if not validate_token(token, "teacher"):
+        raise HTTPException(status_code=403, detail="Token inválido")
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail=f"Tabla inválida (usar: {', '.join(EXPORT_TABLES)})")
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido (usar: {', '.join(EXPORT_FORMATS)})")
+    room = await open_classroom_or_404(class_code)
+    # Lo que aún no se escribió también entra en la exportación
+    await room.student_manager.persistence.flush()
+    
+    def chunks():
+        # Corre en el threadpool de Starlette (generador síncrono): no bloquea el loop
+        for chunk in iter_export(room.student_manager.store, table, export_format,
+                                 lambda percentage: get_classification(percentage).value):
+            room.touch()  # Una descarga en curso mantiene el aula cargada
+            yield chunk
+    
+    filename = f"{room.code}-{table}-{datetime.now():%Y%m%d-%H%M}.{export_format}"
+    return StreamingResponse(
+        chunks(),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
+@app.post("/reports", status_code=202)
+async def create_report(
+    token: str = Query(default=""),
+    class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")
+):
+    """Pide el reporte XLSX del aula (consultar luego GET /reports/{id})"""
+    if not validate_token(token, "teacher"):
+        raise HTTPException(status_code=403, detail="Token inválido")
+    room = await open_classroom_or_404(class_code)
+    job = await reports.submit(room)
+    return job.to_dict()
+
+@app.get("/reports/{report_id}")
+async def get_report(
+    report_id: str,
+    token: str = Query(default=""),
+    class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")
+):
+    """Estado de un reporte (pending, running, done o failed)"""
+    if not validate_token(token, "teacher"):
+        raise HTTPException(status_code=403, detail="Token inválido")
+    job = reports.get(report_id)
+    if job is not None:
+        return job.to_dict()
+    if reports.artifact_path(report_id) is not None:
+        # Generado por otro worker: solo se sabe que está listo
+        code = normalize_class_code(class_code) or DEFAULT_CLASS_CODE
+        return {"id": report_id, "status": "done", "downloadUrl": f"/reports/{report_id}/download?classCode={code}"}
+    raise HTTPException(status_code=404, detail="Reporte no encontrado")
+
+@app.get("/reports/{report_id}/download")
+async def download_report(report_id: str, token: str = Query(default="")):
+    """Descarga el XLSX de un reporte listo"""
+    if not validate_token(token, "teacher"):
+        raise HTTPException(status_code=403, detail="Token inválido")
+    path = reports.artifact_path(report_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Reporte no encontrado o todavía en curso")
+    job = reports.get(report_id)
+    code = job.class_code if job is not None else "clase"
+    filename = f"{code}-reporte-{datetime.fromtimestamp(os.path.getmtime(path)):%Y%m%d-%H%M}.xlsx"
+    return FileResponse(path, media_type=XLSX_MEDIA_TYPE, filename=filename)
+
 @app.post("/validate-name")
-async def validate_student_name(name: str = Query(...)):
+async def validate_student_name(
+    name: str = Query(...),
+    class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")
+):
     """Valida si un nombre está disponible"""
-    is_valid, message = student_manager.validate_name(name)
+    room = get_classroom_or_404(class_code)
+    is_valid, message = room.student_manager.validate_name(name)
     return {"valid": is_valid, "message": message}
 
 # ============================================================
@@ -709,175 +2320,146 @@ async def validate_student_name(name: str = Query(...)):
 @app.websocket("/ws/teacher")
 async def teacher_websocket(
     websocket: WebSocket,
-    token: str = Query(default="")
+    token: str = Query(default=""),
+    dashboard: str = Query(default="full"),
+    class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")
 ):
-    """WebSocket para docente"""
+    """WebSocket para docente
+    
+    ?classCode=XYZ elige el aula (sin él, el aula predeterminada).
+    Con ?dashboard=delta los DASHBOARD_UPDATE posteriores al snapshot inicial
+    solo traen los estudiantes que cambiaron (ver take_dashboard_delta).
+    Con el subprotocolo MSGPACK_SUBPROTOCOL los mensajes viajan en MessagePack
+    (ver GET /protocol); sin negociarlo todo sigue en JSON.
+    """
     if not validate_token(token, "teacher"):
         await websocket.accept()
-        await websocket.send_text(json.dumps({
+        await send_message(websocket, {
             "type": "ERROR",
             "data": {"message": "Token inválido", "code": "AUTH_FAILED"}
-        }))
+        })
         await websocket.close(code=4003)
         return
     
-    await teacher_manager.connect(websocket)
+    room = await open_classroom_or_reject(websocket, class_code, create=True)
+    if room is None:
+        return
+    
+    await room.teacher_manager.connect(websocket, dashboard_delta=(dashboard == "delta"))
     
     try:
         # Enviar estado inicial
-        await websocket.send_text(json.dumps({
-            "type": "STATE_UPDATE",
-            "data": state.to_dict()
-        }))
+        await send_message(websocket, room.state.frame())
         
-        # Enviar resumen de estudiantes
-        await websocket.send_text(json.dumps({
+        # Enviar resumen de estudiantes (snapshot completo con versión)
+        await send_message(websocket, {
             "type": "DASHBOARD_UPDATE",
-            "data": student_manager.get_dashboard_summary(
-                state.current_activity.id if state.current_activity else None
+            "data": room.student_manager.get_dashboard_summary(
+                room.state.current_activity_id
             )
-        }))
+        })
         
         while True:
-            data = await websocket.receive_text()
+            data = await receive_client_message(websocket)
             
             try:
-                message = json.loads(data)
-            except json.JSONDecodeError:
-                await websocket.send_text(json.dumps({
+                message = decode_client_message(data)
+            except DecodeError:
+                await send_message(websocket, {
                     "type": "ERROR",
                     "data": {"message": "JSON inválido"}
-                }))
+                })
                 continue
             
-            await handle_teacher_action(websocket, message)
+            await dispatch_teacher_action(room, websocket, message)
     
     except WebSocketDisconnect:
-        teacher_manager.disconnect(websocket)
-    except (ConnectionError, RuntimeError, json.JSONDecodeError) as e:
+        pass
+    except (ConnectionError, RuntimeError, DecodeError) as e:
         print(f"[ERROR] Teacher WebSocket: {e}")
-        teacher_manager.disconnect(websocket)
+    finally:
+        room.teacher_manager.disconnect(websocket)
 
-async def handle_teacher_action(websocket: WebSocket, message: Dict):
-    """Procesa acciones del docente"""
-    action = message.get("action")
-    payload = message.get("payload", {})
+async def handle_teacher_action(room: "Classroom", websocket: Optional[WebSocket], message: ClientMessage):
+    """Procesa acciones del docente (websocket None si llega replicada por el broker)
+    
+    Los cambios de estado pasan por ClassState.apply_event y quedan como
+    eventos del aula; aquí solo van los efectos (estudiantes, timers, envíos).
+    """
+    action = message.action
+    payload = message.payload
+    
+    result = None
+    if action in CLASS_EVENT_ACTIONS:
+        at = time.time()
+        result = room.state.apply_event(action, payload, at)
+        if websocket is not None:  # Replicado: lo registró el worker de origen
+            room.record_event(action, payload, at)
     
     if action == "SET_STATE":
-        state.current_state = payload.get("state", state.current_state)
-        await broadcast_all({
+        await broadcast_all(room, {
             "type": "STATE_UPDATE",
-            "data": {"state": state.current_state}
+            "data": {"state": room.state.current_state}
         })
     
     elif action == "SET_SLIDE":
-        state.current_slide_index = payload.get("slide", state.current_slide_index)
-        state.current_block_index = payload.get("block", state.current_block_index)
-        await broadcast_all({
+        await broadcast_all(room, {
             "type": "SLIDE_UPDATE",
             "data": {
-                "slide": state.current_slide_index,
-                "block": state.current_block_index
+                "slide": room.state.current_slide_index,
+                "block": room.state.current_block_index
             }
         })
     
     elif action == "REGISTER_ACTIVITY":
         # Registrar actividad antes de habilitarla
-        activity = state.register_activity(
-            activity_id=payload.get("activityId"),
-            question=payload.get("question", ""),
-            options=payload.get("options", []),
-            correct_index=payload.get("correctIndex", 0),
-            percentage_value=payload.get("percentageValue", 10.0),
-            activity_type=payload.get("activityType", "multipleChoice"),
-            time_limit=payload.get("timeLimitSeconds"),
-            title=payload.get("title"),
-            slide_content=payload.get("slideContent"),
-            biblical_reference=payload.get("biblicalReference")
-        )
-        await websocket.send_text(json.dumps({
-            "type": "ACTIVITY_REGISTERED",
-            "data": activity.to_dict()
-        }))
+        activity = result
+        if websocket is not None:  # None: comando replicado desde otro worker
+            await send_message(websocket, activity.frame("ACTIVITY_REGISTERED", audience="teacher"))
     
     elif action == "UNLOCK_ACTIVITY":
-        activity_id = payload.get("activityId")
-        activity = state.get_activity(activity_id)
+        activity = result
         
         if activity:
-            activity.state = ActivityState.ACTIVE
-            state.current_activity = activity
-            student_manager.reset_all_for_new_activity()
+            room.student_manager.reset_all_for_new_activity()
+            activity_timers.schedule(room, activity)
             
             # Enviar a estudiantes (sin respuesta correcta)
-            await student_manager.broadcast_to_students({
-                "type": "ACTIVITY_UNLOCKED",
-                "data": activity.to_student_dict()
-            })
+            await room.student_manager.broadcast_to_students(activity.frame("ACTIVITY_UNLOCKED"))
             
             # Actualizar dashboard
-            await teacher_manager.broadcast_to_teachers({
-                "type": "DASHBOARD_UPDATE",
-                "data": student_manager.get_dashboard_summary(activity_id)
-            })
+            await broadcast_dashboard(room, activity.id)
     
     elif action == "LOCK_ACTIVITY":
         activity_id = payload.get("activityId")
         
-        # Si se especifica un activityId, bloquear esa actividad específica
-        if activity_id:
-            activity = state.get_activity(activity_id)
-            if activity:
-                activity.state = ActivityState.CLOSED
-                # Solo limpiar current_activity si coincide
-                if state.current_activity and state.current_activity.id == activity_id:
-                    state.current_activity = None
-        else:
-            # Comportamiento original: bloquear la actividad actual
-            if state.current_activity:
-                state.current_activity.state = ActivityState.CLOSED
-                state.current_activity = None
-        
-        await student_manager.broadcast_to_students({
+        await room.student_manager.broadcast_to_students({
             "type": "ACTIVITY_LOCKED",
             "data": {"activityId": activity_id} if activity_id else {}
         })
         
-        await teacher_manager.broadcast_to_teachers({
-            "type": "DASHBOARD_UPDATE",
-            "data": student_manager.get_dashboard_summary()
-        })
+        await broadcast_dashboard(room)
     
     elif action == "LOCK_ALL_ACTIVITIES":
-        # Cerrar TODAS las actividades activas de una vez
-        closed_count = 0
-        for activity in state.activities.values():
-            if activity.state == ActivityState.ACTIVE:
-                activity.state = ActivityState.CLOSED
-                closed_count += 1
-        
-        state.current_activity = None
+        closed_count = result
         
         # Notificar a todos los estudiantes
-        await student_manager.broadcast_to_students({
+        await room.student_manager.broadcast_to_students({
             "type": "ALL_ACTIVITIES_LOCKED",
             "data": {"closedCount": closed_count}
         })
         
         # Actualizar dashboard
-        await teacher_manager.broadcast_to_teachers({
-            "type": "DASHBOARD_UPDATE",
-            "data": student_manager.get_dashboard_summary()
-        })
+        await broadcast_dashboard(room)
         
         print(f"[INFO] {closed_count} actividades cerradas")
     
     elif action == "REVEAL_ANSWER":
         activity_id = payload.get("activityId")
-        activity = state.get_activity(activity_id)
+        activity = room.state.get_activity(activity_id)
         
         if activity:
-            await broadcast_all({
+            await broadcast_all(room, {
                 "type": "ANSWER_REVEALED",
                 "data": {
                     "activityId": activity_id,
@@ -888,35 +2470,44 @@ async def handle_teacher_action(websocket: WebSocket, message: Dict):
     elif action == "GET_REFLECTIONS":
         # Enviar todas las reflexiones al docente
         all_reflections = []
-        for student in student_manager.students.values():
+        for student in room.student_manager.students.values():
             all_reflections.extend(student.reflections)
         
-        await websocket.send_text(json.dumps({
+        await send_message(websocket, {
             "type": "REFLECTIONS_LIST",
             "data": {"reflections": all_reflections}
-        }))
+        })
+    
+    elif action == "GET_ACTIVITY_STATS":
+        # Estadísticas por pregunta (por defecto la actividad actual)
+        activity_id = payload.get("activityId") or room.state.current_activity_id
+        stats = room.student_manager.get_activity_stats(
+            activity_id, room.state.get_activity(activity_id)
+        ) if activity_id else None
+        if stats is None:
+            await send_message(websocket, {
+                "type": "ERROR",
+                "data": {"message": "Actividad no encontrada", "code": "ACTIVITY_NOT_FOUND"}
+            })
+        else:
+            await send_message(websocket, {"type": "ACTIVITY_STATS", "data": stats})
     
     elif action == "REQUEST_DASHBOARD":
-        # Docente solicita actualización del dashboard
-        await websocket.send_text(json.dumps({
+        # Docente solicita actualización del dashboard (también sirve para
+        # resincronizar si detectó un salto de versión en los deltas)
+        await send_message(websocket, {
             "type": "DASHBOARD_UPDATE",
-            "data": student_manager.get_dashboard_summary(
-                state.current_activity.id if state.current_activity else None
+            "data": room.student_manager.get_dashboard_summary(
+                room.state.current_activity_id
             )
-        }))
+        })
     
     elif action == "RESET_ALL_STUDENTS_PROGRESS":
         # Reinicio GLOBAL de progreso de todos los estudiantes (función admin)
-        reset_count = student_manager.reset_all_students_progress()
-        
-        # Cerrar todas las actividades
-        for activity in state.activities.values():
-            activity.state = ActivityState.CLOSED
-        state.current_activity = None
-        state.activities = {}
+        reset_count = room.student_manager.reset_all_students_progress()
         
         # Notificar a todos los estudiantes que su progreso fue reiniciado
-        await student_manager.broadcast_to_students({
+        await room.student_manager.broadcast_to_students({
             "type": "PROGRESS_RESET",
             "data": {
                 "message": "El administrador ha reiniciado el progreso de todos los estudiantes",
@@ -925,7 +2516,7 @@ async def handle_teacher_action(websocket: WebSocket, message: Dict):
         })
         
         # Confirmar al docente
-        await teacher_manager.broadcast_to_teachers({
+        await room.teacher_manager.broadcast_to_teachers({
             "type": "STUDENTS_RESET_COMPLETE",
             "data": {
                 "resetCount": reset_count,
@@ -934,301 +2525,955 @@ async def handle_teacher_action(websocket: WebSocket, message: Dict):
         })
         
         # Actualizar dashboard
-        await teacher_manager.broadcast_to_teachers({
-            "type": "DASHBOARD_UPDATE",
-            "data": student_manager.get_dashboard_summary()
-        })
+        await broadcast_dashboard(room)
         
         print(f"[INFO] Progreso reiniciado para {reset_count} estudiantes")
 
-async def broadcast_all(message: Dict):
-    """Envía mensaje a docentes y estudiantes"""
-    await teacher_manager.broadcast_to_teachers(message)
-    await student_manager.broadcast_to_students(message)
+async def broadcast_all(room: "Classroom", message: Dict):
+    """Envía mensaje a docentes y estudiantes del aula"""
+    await room.teacher_manager.broadcast_to_teachers(message)
+    await room.student_manager.broadcast_to_students(message)
+
+async def emit_dashboard(room: "Classroom", current_activity_id: Optional[str] = None):
+    """Envía DASHBOARD_UPDATE a los docentes (nueva versión del roster)"""
+    delta = room.student_manager.take_dashboard_delta(current_activity_id)
+    await room.teacher_manager.broadcast_dashboard(
+        delta,
+        lambda: room.student_manager.get_dashboard_summary(current_activity_id)
+    )
+
+async def emit_ranking(room: "Classroom"):
+    """Envía el ranking actualizado a TODOS los estudiantes del aula"""
+    await room.student_manager.broadcast_to_students({
+        "type": "RANKING_UPDATE",
+        "data": {
+            "ranking": room.student_manager.get_ranking(5)
+        }
+    })
+
+class BroadcastTicker:
+    """Agrupa RANKING_UPDATE y DASHBOARD_UPDATE en ticks.
+    
+    Los cambios solo marcan el ranking/dashboard como pendiente; cada
+    `interval` segundos se envía como máximo una actualización de cada uno.
+    Con interval <= 0 (o sin event loop iniciado) se envía al instante.
+    """
+    def __init__(self, interval: float,
+                 emit_ranking: Callable[[], Any],
+                 emit_dashboard: Callable[[Optional[str]], Any]):
+        self.interval = interval
+        self._emit_ranking = emit_ranking
+        self._emit_dashboard = emit_dashboard
+        self._ranking_dirty = False
+        self._dashboard_dirty = False
+        self._dashboard_activity_id: Optional[str] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Métricas
+        self.ticks = 0
+        self.coalesced = 0  # Actualizaciones absorbidas por un tick
+    
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None and self.interval > 0
+    
+    async def mark_ranking(self):
+        if not self.enabled:
+            await self._emit_ranking()
+            return
+        if self._ranking_dirty:
+            self.coalesced += 1
+        self._ranking_dirty = True
+        self._wakeup.set()
+    
+    async def mark_dashboard(self, current_activity_id: Optional[str] = None):
+        if not self.enabled:
+            await self._emit_dashboard(current_activity_id)
+            return
+        if self._dashboard_dirty:
+            self.coalesced += 1
+        self._dashboard_dirty = True
+        self._dashboard_activity_id = current_activity_id  # Gana el último pedido
+        self._wakeup.set()
+    
+    async def flush(self):
+        """Envía lo pendiente"""
+        ranking, dashboard = self._ranking_dirty, self._dashboard_dirty
+        self._ranking_dirty = self._dashboard_dirty = False
+        if ranking:
+            await self._emit_ranking()
+        if dashboard:
+            await self._emit_dashboard(self._dashboard_activity_id)
+        if ranking or dashboard:
+            self.ticks += 1
+    
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            await self.flush()
+    
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+async def broadcast_dashboard(room: "Classroom", current_activity_id: Optional[str] = None):
+    """Pide un DASHBOARD_UPDATE (agrupado en el próximo tick)"""
+    await room.ticker.mark_dashboard(current_activity_id)
+
+# ============================================================
+# AULAS
+# ============================================================
+
+class Classroom:
+    """Aula identificada por su código de clase.
+    
+    Tiene su propio estado, estudiantes, docentes, progreso guardado y
+    ticker de broadcasts: nada de lo que pasa en un aula llega a otra.
+    
+    El estado de la clase se guarda como eventos más snapshots (state_log) y
+    se reconstruye al abrir el aula. Las escrituras del log van al hilo de
+    persistencia del aula, igual que el progreso. Con varios workers el estado
+    compartido vive en el broker (ClusterSync) y no se escribe el log local.
+    """
+    def __init__(self, code: str):
+        self.code = code
+        self.state = ClassState()
+        self.state_log = create_class_state_log(code)
+        self.student_manager = StudentManager(create_room_store(code))
+        self.teacher_manager = TeacherConnectionManager()
+        self.ticker = BroadcastTicker(
+            BROADCAST_TICK_SECONDS,
+            lambda: emit_ranking(self),
+            lambda activity_id: emit_dashboard(self, activity_id),
+        )
+        self.last_seen = time.monotonic()
+        self.events_since_snapshot = 0
+    
+    def touch(self):
+        self.last_seen = time.monotonic()
+    
+    def has_connections(self) -> bool:
+        return bool(self.teacher_manager.teacher_connections or self.student_manager.websocket_to_student)
+    
+    def restore_state(self):
+        """Reconstruye ClassState: último snapshot más los eventos posteriores"""
+        started = time.perf_counter()
+        snapshot, events = self.state_log.load()
+        self.events_since_snapshot = len(events)
+        if snapshot is None and not events:
+            return
+        if snapshot is not None:
+            self.state.apply_snapshot(snapshot)
+        for event in events:
+            self.state.apply_event(event["action"], event.get("payload") or {}, event.get("at") or time.time())
+        # Solo las que siguen activas: las vencidas ya tienen su EXPIRE_ACTIVITY.
+        # Una que venció con el servidor apagado se cierra (y registra) al instante
+        activity_timers.schedule_room(self)
+        print(f"[INFO] Estado del aula {self.code} restaurado: {len(self.state.activities)} actividades, "
+              f"{len(events)} eventos en {(time.perf_counter() - started) * 1000:.1f} ms")
+    
+    def record_event(self, action: str, payload: Dict, at: float):
+        """Guarda una acción del docente ya aplicada (snapshot cada CLASS_SNAPSHOT_EVERY)"""
+        if cluster.enabled:
+            return
+        self.student_manager.persistence.submit(self.state_log.append, action, payload, at)
+        self.events_since_snapshot += 1
+        if self.events_since_snapshot >= CLASS_SNAPSHOT_EVERY:
+            self.save_state_snapshot()
+    
+    def save_state_snapshot(self):
+        """Encola el snapshot del estado (copiado aquí, escrito en el hilo de persistencia)"""
+        if cluster.enabled:
+            return
+        self.events_since_snapshot = 0
+        self.student_manager.persistence.submit(self.state_log.write_snapshot, self.state.to_snapshot())
+    
+    def start(self):
+        self.student_manager.persistence.start()
+        self.ticker.start()
+    
+    async def close(self):
+        await self.ticker.stop()
+        self.save_state_snapshot()
+        # Guardar sincrónicamente lo pendiente (progreso y log) antes de descargar el aula
+        await self.student_manager.persistence.stop()
+        self.state_log.close()
+    
+    def summary(self) -> Dict:
+        return {
+            "classCode": self.code,
+            "state": self.state.current_state,
+            "currentActivityId": self.state.current_activity_id,
+            "students": len(self.student_manager.students),
+            "connectedStudents": len(self.student_manager.websocket_to_student),
+            "connectedTeachers": len(self.teacher_manager.teacher_connections),
+        }
+
+class ClassroomRegistry:
+    """Aulas cargadas en este worker (código -> Classroom).
+    
+    Un aula nueva (y su carpeta en ROOMS_DIR) solo la crea la conexión de un
+    docente; estudiantes y endpoints con token abren las que ya existen en
+    disco. Se descarga tras idle_seconds sin conexiones (su progreso queda
+    en disco).
+    """
+    def __init__(self, idle_seconds: float):
+        self.idle_seconds = idle_seconds
+        self.rooms: Dict[str, Classroom] = {}
+        self._opening: Dict[str, asyncio.Future] = {}
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+    
+    def get(self, code: str) -> Optional[Classroom]:
+        return self.rooms.get(code)
+    
+    async def open(self, code: str, create: bool = True) -> Optional[Classroom]:
+        """Devuelve el aula, cargándola (y sincronizándola) si no está cargada.
+        
+        Con create=False devuelve None si el aula no existe todavía.
+        """
+        room = self.rooms.get(code)
+        if room is not None:
+            room.touch()
+            return room
+        # Dos conexiones simultáneas al mismo código esperan la misma carga
+        pending = self._opening.get(code)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        if not create and not room_exists(code):
+            return None
+        pending = asyncio.get_running_loop().create_future()
+        self._opening[code] = pending
+        try:
+            room = Classroom(code)
+            if not cluster.enabled:
+                room.restore_state()
+            await cluster.load_room(room)
+            if self._running:
+                room.start()
+            self.rooms[code] = room
+            pending.set_result(room)
+            print(f"[INFO] Aula abierta: {code} (Total: {len(self.rooms)})")
+            return room
+        except BaseException as e:
+            pending.set_exception(e)
+            pending.exception()  # Evita el aviso de excepción no recuperada
+            raise
+        finally:
+            del self._opening[code]
+    
+    async def evict_idle(self):
+        """Descarga las aulas sin conexiones desde hace idle_seconds"""
+        now = time.monotonic()
+        for code, room in list(self.rooms.items()):
+            if code == DEFAULT_CLASS_CODE:
+                continue
+            if room.has_connections():
+                room.touch()
+            elif now - room.last_seen >= self.idle_seconds:
+                del self.rooms[code]
+                await room.close()
+                print(f"[INFO] Aula descargada por inactividad: {code}")
+    
+    async def _run(self):
+        interval = max(1.0, min(60.0, self.idle_seconds / 4))
+        while True:
+            await asyncio.sleep(interval)
+            await self.evict_idle()
+    
+    def start(self):
+        self._running = True
+        for room in self.rooms.values():
+            room.start()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._running = False
+        for room in self.rooms.values():
+            await room.close()
+
+classrooms = ClassroomRegistry(ROOM_IDLE_SECONDS)
+
+async def open_classroom_or_reject(websocket: WebSocket, class_code: str,
+                                   create: bool = False) -> Optional[Classroom]:
+    """Abre el aula del código recibido; si es inválido (o el aula no existe
+    y create es False) responde ERROR y cierra"""
+    code = normalize_class_code(class_code)
+    room = await classrooms.open(code, create=create) if code is not None else None
+    if room is None:
+        await websocket.accept()
+        error = ({"message": "Código de clase inválido", "code": "INVALID_CLASS_CODE"} if code is None
+                 else {"message": "Aula no encontrada", "code": "ROOM_NOT_FOUND"})
+        await send_message(websocket, {"type": "ERROR", "data": error})
+        await websocket.close(code=4004)
+        return None
+    return room
+
+# ============================================================
+# TEMPORIZADORES DE ACTIVIDADES
+# ============================================================
+
+class ActivityTimers:
+    """Cierre automático de actividades con tiempo límite.
+    
+    Un solo heap (hora de cierre, aula, actividad) y una sola tarea para todas
+    las aulas: la cantidad de temporizadores no agrega tareas al event loop.
+    Las entradas no se borran al cerrar o reabrir una actividad; al vencer se
+    descartan si la actividad ya no está activa o su hora de cierre cambió.
+    """
+    def __init__(self):
+        self._heap: List[tuple] = []  # (closes_at, seq, class_code, activity_id)
+        self._seq = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Métricas
+        self.expired = 0
+    
+    def __len__(self) -> int:
+        return len(self._heap)
+    
+    def schedule(self, room: "Classroom", activity: ActivityData):
+        if activity.closes_at is None:
+            return
+        self._seq += 1
+        deadline = activity.closes_at + ACTIVITY_TIME_GRACE_SECONDS
+        heapq.heappush(self._heap, (deadline, self._seq, room.code, activity.id))
+        # Solo hace falta despertar si es el nuevo primero
+        if self._wakeup is not None and self._heap[0][1] == self._seq:
+            self._wakeup.set()
+    
+    def schedule_room(self, room: "Classroom"):
+        """Programa las actividades activas de un aula recién sincronizada"""
+        for activity in room.state.activities.values():
+            if activity.state == ActivityState.ACTIVE:
+                self.schedule(room, activity)
+    
+    async def _expire(self, deadline: float, class_code: str, activity_id: str):
+        room = classrooms.get(class_code)
+        if room is None:
+            return
+        activity = room.state.get_activity(activity_id)
+        if (activity is None or activity.state != ActivityState.ACTIVE
+                or activity.closes_at is None
+                or activity.closes_at + ACTIVITY_TIME_GRACE_SECONDS != deadline):
+            return
+        self.expired += 1
+        await close_expired_activity(room, activity)
+    
+    async def _run(self):
+        while True:
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            deadline, _, class_code, activity_id = heapq.heappop(self._heap)
+            try:
+                await self._expire(deadline, class_code, activity_id)
+            except (ConnectionError, RuntimeError) as e:
+                print(f"[ERROR] Cierre automático de {activity_id}: {e}")
+    
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wakeup = None
+
+activity_timers = ActivityTimers()
+
+async def close_expired_activity(room: Classroom, activity: ActivityData):
+    """Cierra una actividad cuyo tiempo límite venció (cada worker cierra la suya)"""
+    # Como evento del aula: al reiniciar, el log solo ya la deja cerrada
+    at = time.time()
+    payload = {"activityId": activity.id, "closesAt": activity.closes_at, "reason": "TIME_EXPIRED"}
+    if room.state.apply_event(EXPIRE_ACTIVITY_EVENT, payload, at) is None:
+        return
+    room.record_event(EXPIRE_ACTIVITY_EVENT, payload, at)
+    await broadcast_all(room, {
+        "type": "ACTIVITY_LOCKED",
+        "data": {"activityId": activity.id, "reason": "TIME_EXPIRED"}
+    })
+    await broadcast_dashboard(room)
+    print(f"[INFO] Actividad cerrada por tiempo: {activity.id} ({room.code})")
+
+# ============================================================
+# REPLICACIÓN ENTRE WORKERS
+# ============================================================
+
+# Acciones del docente que cambian estado compartido: cada worker las re-ejecuta
+REPLICATED_TEACHER_ACTIONS = {
+    "SET_STATE", "SET_SLIDE", "REGISTER_ACTIVITY", "UNLOCK_ACTIVITY", "LOCK_ACTIVITY",
+    "LOCK_ALL_ACTIVITIES", "REVEAL_ANSWER", "RESET_ALL_STUDENTS_PROGRESS",
+}
+# Acciones que cambian a todos los estudiantes: cada worker republica los suyos
+STUDENT_RESETTING_ACTIONS = {"UNLOCK_ACTIVITY", "RESET_ALL_STUDENTS_PROGRESS"}
+BROKER_ERRORS = (BrokerError, OSError, asyncio.IncompleteReadError)
+
+class ClusterSync:
+    """Mantiene ClassState y el roster de cada aula iguales en todos los workers.
+    
+    - Los comandos del docente se publican y cada worker que tiene el aula
+      cargada los vuelve a ejecutar, repartiendo los mensajes a sus sockets.
+    - Cada cambio de un estudiante se publica desde el worker que tiene su
+      socket: completo al entrar, después el encabezado (tamaño fijo) más la
+      respuesta o reflexión nueva. Los demás guardan una copia
+      (student.worker) que cuenta para dashboard, ranking y nombres en uso.
+      El puntaje solo lo calcula el dueño del socket.
+    - El estado queda además en hashes del broker para que un worker que abre
+      el aula tarde empiece sincronizado: el de la clase, los encabezados de
+      los estudiantes, y un campo por respuesta y por reflexión.
+    
+    Con el broker en proceso (un solo worker) no se publica nada.
+    """
+    TEACHER_CHANNEL = "sapiencial:teacher"
+    STUDENT_CHANNEL = "sapiencial:student"
+    WORKER_CHANNEL = "sapiencial:worker"
+    
+    def __init__(self, broker: Broker, worker_id: str):
+        self.broker = broker
+        self.worker_id = worker_id
+    
+    @property
+    def enabled(self) -> bool:
+        return self.broker.shared
+    
+    @staticmethod
+    def class_key(code: str) -> str:
+        return f"sapiencial:{code}:class"
+    
+    @staticmethod
+    def students_key(code: str) -> str:
+        return f"sapiencial:{code}:students"
+    
+    @staticmethod
+    def responses_key(code: str) -> str:
+        """Campos "<session_id>:<activity_id>" -> respuesta"""
+        return f"sapiencial:{code}:responses"
+    
+    @staticmethod
+    def reflections_key(code: str) -> str:
+        """Campos id de reflexión -> reflexión (con student_session_id)"""
+        return f"sapiencial:{code}:reflections"
+    
+    async def start(self):
+        if not self.enabled:
+            return
+        self.broker.subscribe(self.TEACHER_CHANNEL, self._on_teacher_action)
+        self.broker.subscribe(self.STUDENT_CHANNEL, self._on_student)
+        self.broker.subscribe(self.WORKER_CHANNEL, self._on_worker)
+        try:
+            await self.broker.start()
+        except BrokerError as e:
+            print(f"[ERROR] {e}: revisa BROKER_URL o que el broker esté en marcha")
+            raise
+        print(f"[INFO] Worker {self.worker_id} conectado al broker")
+    
+    async def load_room(self, room: Classroom):
+        """Carga del broker el estado y el roster compartidos de un aula recién abierta"""
+        if not self.enabled:
+            return
+        try:
+            snapshot = (await self.broker.hgetall(self.class_key(room.code))).get("state")
+            students = await self.broker.hgetall(self.students_key(room.code))
+            responses = await self.broker.hgetall(self.responses_key(room.code))
+            reflections = await self.broker.hgetall(self.reflections_key(room.code))
+        except BROKER_ERRORS as e:
+            print(f"[ERROR] No se pudo sincronizar el aula {room.code}: {e}")
+            return
+        if snapshot:
+            room.state.apply_snapshot(snapshot)
+            activity_timers.schedule_room(room)
+        history: Dict[str, tuple] = {}  # session_id -> (respuestas, reflexiones)
+        for field, response in responses.items():
+            session_id = field.partition(":")[0]
+            history.setdefault(session_id, ({}, []))[0][response["activity_id"]] = response
+        for reflection in sorted(reflections.values(), key=lambda r: r.get("created_at") or ""):
+            history.setdefault(reflection.get("student_session_id"), ({}, []))[1].append(reflection)
+        for session_id, header in students.items():
+            student_responses, student_reflections = history.get(session_id, ({}, []))
+            room.student_manager.apply_snapshot(
+                {**header, "responses": student_responses, "reflections": student_reflections})
+        print(f"[INFO] Aula {room.code} sincronizada por broker "
+              f"({len(room.state.activities)} actividades, {len(room.student_manager.students)} estudiantes)")
+    
+    async def stop(self):
+        if self.enabled:
+            try:
+                await self.broker.publish(self.WORKER_CHANNEL, {
+                    "origin": self.worker_id,
+                    "event": "stopped",
+                })
+            except BROKER_ERRORS as e:
+                print(f"[WARN] No se pudo avisar la salida del worker: {e}")
+        await self.broker.close()
+    
+    async def _republish_local_students(self, room: Classroom):
+        """Encabezados de los estudiantes de este worker (tras cambiar a todos)"""
+        await self.broker.hset_many(self.students_key(room.code), {
+            student.session_id: student.to_header(self.worker_id)
+            for student in room.student_manager.local_students()
+        })
+    
+    async def publish_teacher_action(self, room: Classroom, message: ClientMessage):
+        """Replica un comando del docente ya ejecutado en este worker"""
+        if not self.enabled or message.action not in REPLICATED_TEACHER_ACTIONS:
+            return
+        try:
+            if message.action == "RESET_ALL_STUDENTS_PROGRESS":
+                for key in (self.students_key(room.code), self.responses_key(room.code),
+                            self.reflections_key(room.code)):
+                    await self.broker.delete(key)
+            await self.broker.hset(self.class_key(room.code), "state", room.state.to_snapshot())
+            if message.action in STUDENT_RESETTING_ACTIONS:
+                await self._republish_local_students(room)
+            await self.broker.publish(self.TEACHER_CHANNEL, {
+                "origin": self.worker_id,
+                "room": room.code,
+                "action": message.action,
+                "payload": message.payload,
+            })
+        except BROKER_ERRORS as e:
+            print(f"[ERROR] No se pudo replicar {message.action}: {e}")
+    
+    async def _on_teacher_action(self, message: Dict):
+        if message.get("origin") == self.worker_id:
+            return
+        # Un aula que este worker no tiene cargada se sincroniza al abrirse
+        room = classrooms.get(message.get("room") or DEFAULT_CLASS_CODE)
+        if room is None:
+            return
+        action = message.get("action")
+        await handle_teacher_action(room, None, ClientMessage(action=action, payload=message.get("payload") or {}))
+        if action in STUDENT_RESETTING_ACTIONS:
+            await self._republish_local_students(room)
+    
+    async def publish_student(self, room: Classroom, student: StudentData, event: str,
+                              notice: Optional[Dict] = None, change: Optional[Dict] = None):
+        """Publica el estado de un estudiante de este worker (y el aviso para los docentes)
+        
+        Al entrar ("joined") va completo; después solo el encabezado y change
+        ({"response": ...} o {"reflection": ...}): lo escrito por respuesta no
+        crece con el historial del estudiante.
+        """
+        if not self.enabled:
+            return
+        header = student.to_header(self.worker_id)
+        message = {
+            "origin": self.worker_id,
+            "room": room.code,
+            "event": event,
+            "student": header,
+            "notice": notice,
+        }
+        try:
+            await self.broker.hset(self.students_key(room.code), student.session_id, header)
+            if event == "joined":
+                saved = student.to_saveable()
+                await self.broker.hset_many(self.responses_key(room.code), {
+                    f"{student.session_id}:{activity_id}": response
+                    for activity_id, response in saved["responses"].items()
+                })
+                await self.broker.hset_many(self.reflections_key(room.code), {
+                    reflection["id"]: reflection for reflection in saved["reflections"]
+                })
+                message["student"] = {**header, "responses": saved["responses"],
+                                      "reflections": saved["reflections"]}
+            elif change:
+                response = change.get("response")
+                if response is not None:
+                    await self.broker.hset(self.responses_key(room.code),
+                                           f"{student.session_id}:{response['activity_id']}", response)
+                reflection = change.get("reflection")
+                if reflection is not None:
+                    await self.broker.hset(self.reflections_key(room.code), reflection["id"], reflection)
+                message.update(change)
+            await self.broker.publish(self.STUDENT_CHANNEL, message)
+        except BROKER_ERRORS as e:
+            print(f"[ERROR] No se pudo replicar a {student.name}: {e}")
+    
+    async def _on_student(self, message: Dict):
+        if message.get("origin") == self.worker_id:
+            return
+        room = classrooms.get(message.get("room") or DEFAULT_CLASS_CODE)
+        if room is None:
+            return
+        if room.student_manager.apply_snapshot(message["student"], message.get("response"),
+                                               message.get("reflection")) is None:
+            return
+        if message.get("notice"):
+            await room.teacher_manager.broadcast_to_teachers(message["notice"])
+        await broadcast_dashboard(room, room.state.current_activity_id)
+        if message.get("event") == "answer":
+            await room.ticker.mark_ranking()
+    
+    async def _on_worker(self, message: Dict):
+        if message.get("origin") == self.worker_id or message.get("event") != "stopped":
+            return
+        for room in list(classrooms.rooms.values()):
+            if room.student_manager.disconnect_worker(message["origin"]):
+                await broadcast_dashboard(room, room.state.current_activity_id)
+
+cluster = ClusterSync(create_broker(BROKER_URL, BROKER_CONNECT_TIMEOUT_SECONDS), generate_session_id())
+
+async def dispatch_teacher_action(room: Classroom, websocket: WebSocket, message: ClientMessage):
+    """Ejecuta la acción del docente y la replica en los demás workers"""
+    started = time.perf_counter()
+    try:
+        await handle_teacher_action(room, websocket, message)
+    finally:
+        observe_action("teacher", message.action, TEACHER_ACTIONS, started)
+    await cluster.publish_teacher_action(room, message)
+
+async def notify_student_event(room: Classroom, student: StudentData, event: str,
+                               notice: Optional[Dict] = None, change: Optional[Dict] = None):
+    """Avisa a los docentes del aula y publica el cambio para los demás workers"""
+    if notice is not None:
+        await room.teacher_manager.broadcast_to_teachers(notice)
+    await cluster.publish_student(room, student, event, notice, change)
 
 # ============================================================
 # WEBSOCKET - ESTUDIANTE
 # ============================================================
 
+async def send_registration(room: Classroom, websocket: WebSocket, student: StudentData, reconnected: bool):
+    """REGISTRATION_SUCCESS (con token de reanudación) y el estado actual de la clase"""
+    session = room.student_manager.attach_session(student, websocket)
+    data = {**student.to_dict(), "resumeToken": session.token}
+    if reconnected:
+        data["reconnected"] = True
+    await send_message(websocket, {"type": "REGISTRATION_SUCCESS", "data": data})
+    
+    # Enviar estado actual
+    await send_message(websocket, room.state.frame())
+    
+    # IMPORTANTE: Si hay actividad activa, enviarla explícitamente
+    if room.state.current_activity and room.state.current_activity.state == ActivityState.ACTIVE:
+        await send_message(websocket, room.state.current_activity.frame("ACTIVITY_UNLOCKED"))
+        print(f"[INFO] Actividad activa enviada a {student.name}: {room.state.current_activity.id}")
+
 @app.websocket("/ws/student")
-async def student_websocket(websocket: WebSocket):
-    """WebSocket para estudiante"""
-    await websocket.accept()
+async def student_websocket(
+    websocket: WebSocket,
+    class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")
+):
+    """WebSocket para estudiante (JSON, o MessagePack si negoció MSGPACK_SUBPROTOCOL)
+    
+    ?classCode=XYZ elige el aula (sin él, el aula predeterminada).
+    """
+    room = await open_classroom_or_reject(websocket, class_code)
+    if room is None:
+        return
+    await accept_client(websocket)
     student: Optional[StudentData] = None
     
     try:
         # Esperar registro del estudiante
-        await websocket.send_text(json.dumps({
+        await send_message(websocket, {
             "type": "REGISTRATION_REQUIRED",
             "data": {"message": "Por favor, ingresa tu nombre"}
-        }))
+        })
         
         while True:
-            data = await websocket.receive_text()
+            data = await receive_client_message(websocket)
             
             try:
-                message = json.loads(data)
-            except json.JSONDecodeError:
-                await websocket.send_text(json.dumps({
+                message = decode_client_message(data)
+            except DecodeError:
+                await send_message(websocket, {
                     "type": "ERROR",
                     "data": {"message": "JSON inválido"}
-                }))
+                })
                 continue
             
-            action = message.get("action")
-            payload = message.get("payload", {})
+            action = message.action
+            payload = message.payload
             
-            # ---- REGISTRO DE ESTUDIANTE ----
-            if action == "REGISTER":
-                name = payload.get("name", "").strip()
-                reconnect = payload.get("reconnect", False)
-                
-                if reconnect:
-                    # Intentar reconexión
-                    student, msg = student_manager.reconnect_student(name, websocket)
-                    if student:
-                        await websocket.send_text(json.dumps({
-                            "type": "REGISTRATION_SUCCESS",
-                            "data": {
-                                **student.to_dict(),
-                                "reconnected": True
-                            }
-                        }))
-                    else:
-                        # No encontrado, registrar como nuevo
-                        student, msg = student_manager.register_student(name, websocket)
-                        if student:
-                            await websocket.send_text(json.dumps({
-                                "type": "REGISTRATION_SUCCESS",
-                                "data": student.to_dict()
-                            }))
-                        else:
-                            await websocket.send_text(json.dumps({
+            started = time.perf_counter()
+            try:
+                # ---- REGISTRO DE ESTUDIANTE ----
+                if action == "REGISTER":
+                    name = payload.get("name", "").strip()
+                    reconnect = payload.get("reconnect", False)
+                    
+                    reconnected = False
+                    if reconnect:
+                        # Intentar reconexión
+                        student, msg = room.student_manager.reconnect_student(name, websocket)
+                        reconnected = student is not None
+                    if not reconnected:
+                        # Nuevo registro (o no se encontró la sesión a reconectar)
+                        student, msg = room.student_manager.register_student(name, websocket)
+                        if not student:
+                            await send_message(websocket, {
                                 "type": "REGISTRATION_ERROR",
                                 "data": {"message": msg}
-                            }))
+                            })
                             continue
-                else:
-                    # Nuevo registro
-                    student, msg = student_manager.register_student(name, websocket)
-                    if student:
-                        await websocket.send_text(json.dumps({
-                            "type": "REGISTRATION_SUCCESS",
-                            "data": student.to_dict()
-                        }))
-                    else:
-                        await websocket.send_text(json.dumps({
-                            "type": "REGISTRATION_ERROR",
-                            "data": {"message": msg}
-                        }))
-                        continue
-                
-                # Enviar estado actual
-                await websocket.send_text(json.dumps({
-                    "type": "STATE_UPDATE",
-                    "data": state.to_dict()
-                }))
+                    
+                    await send_registration(room, websocket, student, reconnected)
+                    
+                    # Notificar al docente
+                    await notify_student_event(room, student, "joined", {
+                        "type": "STUDENT_JOINED",
+                        "data": student.to_summary()
+                    })
+                    await broadcast_dashboard(room, room.state.current_activity_id)
                 
-                # IMPORTANTE: Si hay actividad activa, enviarla explícitamente
-                if state.current_activity and state.current_activity.state == ActivityState.ACTIVE:
-                    await websocket.send_text(json.dumps({
-                        "type": "ACTIVITY_UNLOCKED",
-                        "data": state.current_activity.to_student_dict()
-                    }))
-                    print(f"[INFO] Actividad activa enviada a {student.name}: {state.current_activity.id}")
+                # ---- REANUDAR SESIÓN (token de REGISTRATION_SUCCESS) ----
+                elif action == "RESUME":
+                    resumed, session = room.student_manager.resume_student(
+                        str(payload.get("resumeToken") or ""), websocket)
+                    if not resumed:
+                        SESSION_RESUMES.labels("failed").inc()
+                        await send_message(websocket, {
+                            "type": "ERROR",
+                            "data": {"message": "Sesión no encontrada, vuelve a registrarte", "code": "RESUME_FAILED"}
+                        })
+                        continue
+                    student = resumed
+                    try:
+                        last_seq = int(payload.get("lastSeq") or 0)
+                    except (TypeError, ValueError):
+                        last_seq = 0
+                    missed = session.missed_since(last_seq)
+                    if missed is None:
+                        # Buffer sobrescrito o ventana vencida: snapshot completo
+                        SESSION_RESUMES.labels("snapshot").inc()
+                        await send_registration(room, websocket, student, True)
+                    else:
+                        SESSION_RESUMES.labels("replay").inc()
+                        await send_message(websocket, {
+                            "type": "SESSION_RESUMED",
+                            "data": {"sessionId": student.session_id, "missed": len(missed)}
+                        })
+                        # Sin await entre attach y replay: nada nuevo se cuela antes de lo perdido
+                        room.student_manager.attach_session(student, websocket)
+                        replayed = replay_frames(connection_registry.get(websocket), missed)
+                        RESUME_REPLAYED_FRAMES.inc(replayed)
+                    
+                    await notify_student_event(room, student, "joined", {
+                        "type": "STUDENT_JOINED",
+                        "data": student.to_summary()
+                    })
+                    await broadcast_dashboard(room, room.state.current_activity_id)
                 
-                # Notificar al docente
-                await teacher_manager.broadcast_to_teachers({
-                    "type": "STUDENT_JOINED",
-                    "data": student.to_summary()
-                })
-                await teacher_manager.broadcast_to_teachers({
-                    "type": "DASHBOARD_UPDATE",
-                    "data": student_manager.get_dashboard_summary(
-                        state.current_activity.id if state.current_activity else None
+                # ---- ENVIAR RESPUESTA ----
+                elif action == "SUBMIT_ANSWER":
+                    if not student:
+                        await send_message(websocket, {
+                            "type": "ERROR",
+                            "data": {"message": "Debes registrarte primero"}
+                        })
+                        continue
+                    
+                    activity_id = payload.get("activityId")
+                    answer = payload.get("answer")
+                    # Texto, negativos o fuera de rango quedan como "sin tiempo"
+                    response_time_ms = coerce_response_time(payload.get("responseTimeMs"))
+                    
+                    # Verificar actividad
+                    activity = room.state.get_activity(activity_id)
+                    if not activity:
+                        await send_message(websocket, {
+                            "type": "ERROR",
+                            "data": {"message": "Actividad no encontrada"}
+                        })
+                        continue
+                    
+                    if activity.state != ActivityState.ACTIVE:
+                        await send_message(websocket, {
+                            "type": "ERROR",
+                            "data": {"message": "La actividad no está activa. Pide al profesor que la habilite."}
+                        })
+                        continue
+                    
+                    # El tiempo se mide en el servidor (el reloj del dispositivo no cuenta)
+                    if activity.is_expired(time.time()):
+                        await send_message(websocket, {
+                            "type": "ERROR",
+                            "data": {"message": "Se acabó el tiempo de esta actividad", "code": "TIME_EXPIRED"}
+                        })
+                        continue
+                    
+                    if student.has_responded(activity_id):
+                        await send_message(websocket, {
+                            "type": "ERROR",
+                            "data": {"message": "Ya has respondido esta actividad"}
+                        })
+                        continue
+                    
+                    # Evaluar respuesta
+                    is_correct = (answer == activity.correct_index)
+                    
+                    # Calcular puntos ganados
+                    points_earned = activity.percentage_value if is_correct else 0
+                    
+                    # Registrar respuesta
+                    student.add_response(
+                        activity_id=activity_id,
+                        answer=answer,
+                        is_correct=is_correct,
+                        percentage_value=activity.percentage_value,
+                        response_time_ms=response_time_ms
                     )
-                })
-            
-            # ---- ENVIAR RESPUESTA ----
-            elif action == "SUBMIT_ANSWER":
-                if not student:
-                    await websocket.send_text(json.dumps({
-                        "type": "ERROR",
-                        "data": {"message": "Debes registrarte primero"}
-                    }))
-                    continue
-                
-                activity_id = payload.get("activityId")
-                answer = payload.get("answer")
-                response_time_ms = payload.get("responseTimeMs")
-                
-                # Verificar actividad
-                activity = state.get_activity(activity_id)
-                if not activity:
-                    await websocket.send_text(json.dumps({
-                        "type": "ERROR",
-                        "data": {"message": "Actividad no encontrada"}
-                    }))
-                    continue
+                    
+                    # Confirmar al estudiante CON resultado
+                    await send_message(websocket, {
+                        "type": "ANSWER_RECEIVED",
+                        "data": {
+                            "activityId": activity_id,
+                            "isCorrect": is_correct,
+                            "pointsEarned": points_earned,
+                            "accumulatedPercentage": student.accumulated_percentage,
+                            "motivationalMessage": student.motivational_message,
+                            "rank": student.rank,
+                            "rankedStudents": len(room.student_manager.aggregates.leaderboard),
+                        }
+                    })
+                    
+                    # Notificar al docente
+                    await notify_student_event(room, student, "answer", {
+                        "type": "STUDENT_RESPONDED",
+                        "data": {
+                            "studentSessionId": student.session_id,
+                            "studentName": student.name,
+                            "activityId": activity_id,
+                            "answer": answer,
+                            "isCorrect": is_correct,
+                            "accumulatedPercentage": student.accumulated_percentage,
+                        }
+                    }, {"response": student.responses[activity_id]})
+                    
+                    # Actualizar dashboard
+                    await broadcast_dashboard(room, activity_id)
+                    
+                    # Enviar ranking actualizado a TODOS los estudiantes (agrupado por tick)
+                    await room.ticker.mark_ranking()
+                    
+                    # Guardar progreso después de cada respuesta
+                    room.student_manager.save_response(student, activity_id)
                 
-                if activity.state != ActivityState.ACTIVE:
-                    await websocket.send_text(json.dumps({
-                        "type": "ERROR",
-                        "data": {"message": "La actividad no está activa. Pide al profesor que la habilite."}
-                    }))
-                    continue
-                
-                if student.has_responded(activity_id):
-                    await websocket.send_text(json.dumps({
-                        "type": "ERROR",
-                        "data": {"message": "Ya has respondido esta actividad"}
-                    }))
-                    continue
-                
-                # Evaluar respuesta
-                is_correct = (answer == activity.correct_index)
-                
-                # Calcular puntos ganados
-                points_earned = activity.percentage_value if is_correct else 0
-                
-                # Registrar respuesta
-                student.add_response(
-                    activity_id=activity_id,
-                    answer=answer,
-                    is_correct=is_correct,
-                    percentage_value=activity.percentage_value,
-                    response_time_ms=response_time_ms
-                )
-                
-                # Confirmar al estudiante CON resultado
-                await websocket.send_text(json.dumps({
-                    "type": "ANSWER_RECEIVED",
-                    "data": {
-                        "activityId": activity_id,
-                        "isCorrect": is_correct,
-                        "pointsEarned": points_earned,
-                        "accumulatedPercentage": student.accumulated_percentage,
-                        "motivationalMessage": student.motivational_message,
-                    }
-                }))
-                
-                # Notificar al docente
-                await teacher_manager.broadcast_to_teachers({
-                    "type": "STUDENT_RESPONDED",
-                    "data": {
-                        "studentSessionId": student.session_id,
-                        "studentName": student.name,
-                        "activityId": activity_id,
-                        "answer": answer,
-                        "isCorrect": is_correct,
-                        "accumulatedPercentage": student.accumulated_percentage,
-                    }
-                })
-                
-                # Actualizar dashboard
-                await teacher_manager.broadcast_to_teachers({
-                    "type": "DASHBOARD_UPDATE",
-                    "data": student_manager.get_dashboard_summary(activity_id)
-                })
-                
-                # Enviar ranking actualizado a TODOS los estudiantes
-                await student_manager.broadcast_to_students({
-                    "type": "RANKING_UPDATE",
-                    "data": {
-                        "ranking": student_manager.get_ranking(5)
-                    }
-                })
-                
-                # Guardar progreso después de cada respuesta
-                student_manager._save_all_progress()
-            
-            # ---- ENVIAR reflexión ----
-            elif action == "SUBMIT_REFLECTION":
-                if not student:
-                    await websocket.send_text(json.dumps({
-                        "type": "ERROR",
-                        "data": {"message": "Debes registrarte primero"}
-                    }))
-                    continue
-                
-                topic = payload.get("topic", "General")
-                content = payload.get("content", "").strip()
-                
-                if len(content) < 10:
-                    await websocket.send_text(json.dumps({
-                        "type": "ERROR",
-                        "data": {"message": "La reflexión debe tener al menos 10 caracteres"}
-                    }))
-                    continue
-                
-                # Registrar reflexión
-                reflection = student.add_reflection(topic, content)
-                
-                # Confirmar al estudiante
-                await websocket.send_text(json.dumps({
-                    "type": "REFLECTION_RECEIVED",
-                    "data": {"message": "reflexión enviada correctamente"}
-                }))
-                
-                # Notificar al docente
-                await teacher_manager.broadcast_to_teachers({
-                    "type": "NEW_REFLECTION",
-                    "data": reflection
-                })
-            
-            # ---- SOLICITAR ESTADO ----
-            elif action == "GET_STATE":
-                await websocket.send_text(json.dumps({
-                    "type": "STATE_UPDATE",
-                    "data": state.to_dict()
-                }))
+                # ---- ENVIAR reflexión ----
+                elif action == "SUBMIT_REFLECTION":
+                    if not student:
+                        await send_message(websocket, {
+                            "type": "ERROR",
+                            "data": {"message": "Debes registrarte primero"}
+                        })
+                        continue
+                    
+                    topic = payload.get("topic", "General")
+                    content = payload.get("content", "").strip()
+                    
+                    if len(content) < 10:
+                        await send_message(websocket, {
+                            "type": "ERROR",
+                            "data": {"message": "La reflexión debe tener al menos 10 caracteres"}
+                        })
+                        continue
+                    
+                    # Registrar reflexión
+                    reflection = student.add_reflection(topic, content)
+                    room.student_manager.save_reflection(student, reflection)
+                    
+                    # Confirmar al estudiante
+                    await send_message(websocket, {
+                        "type": "REFLECTION_RECEIVED",
+                        "data": {"message": "reflexión enviada correctamente"}
+                    })
+                    
+                    # Notificar al docente
+                    await notify_student_event(room, student, "reflection", {
+                        "type": "NEW_REFLECTION",
+                        "data": reflection
+                    }, {"reflection": dict(reflection)})
                 
-                if student:
-                    await websocket.send_text(json.dumps({
-                        "type": "STUDENT_UPDATE",
-                        "data": student.to_dict()
-                    }))
+                # ---- SOLICITAR ESTADO ----
+                elif action == "GET_STATE":
+                    await send_message(websocket, room.state.frame())
+                    
+                    if student:
+                        await send_message(websocket, {
+                            "type": "STUDENT_UPDATE",
+                            "data": student.to_dict()
+                        })
+            finally:
+                observe_action("student", action, STUDENT_ACTIONS, started)
     
     except WebSocketDisconnect:
-        if student:
-            student_manager.disconnect_student(websocket)
-            # Notificar al docente
-            await teacher_manager.broadcast_to_teachers({
-                "type": "STUDENT_LEFT",
-                "data": {"sessionId": student.session_id, "name": student.name}
-            })
-            await teacher_manager.broadcast_to_teachers({
-                "type": "DASHBOARD_UPDATE",
-                "data": student_manager.get_dashboard_summary(
-                    state.current_activity.id if state.current_activity else None
-                )
-            })
-    except (ConnectionError, RuntimeError, json.JSONDecodeError) as e:
+        pass
+    except (ConnectionError, RuntimeError, DecodeError) as e:
+        # También llega aquí una conexión cerrada por lenta (ClientConnection.evict)
         print(f"[ERROR] Student WebSocket: {e}")
-        if student:
-            student_manager.disconnect_student(websocket)
+    finally:
+        connection_registry.close(websocket)
+    
+    # Si la sesión se reanudó en otro socket, el estudiante sigue conectado
+    if student and room.student_manager.disconnect_student(websocket):
+        # Notificar al docente
+        await notify_student_event(room, student, "left", {
+            "type": "STUDENT_LEFT",
+            "data": {"sessionId": student.session_id, "name": student.name}
+        })
+        await broadcast_dashboard(room, room.state.current_activity_id)
 
 # ============================================================
 # ENDPOINT LEGACY (desarrollo)
 # ============================================================
 
 @app.websocket("/ws-dev/{role}")
-async def websocket_dev_endpoint(websocket: WebSocket, role: str):
+async def websocket_dev_endpoint(
+    websocket: WebSocket,
+    role: str,
+    class_code: str = Query(default=DEFAULT_CLASS_CODE, alias="classCode")
+):
     """Endpoint de desarrollo SIN autenticación"""
     if role == "teacher":
-        await teacher_manager.connect(websocket)
+        room = await open_classroom_or_reject(websocket, class_code, create=True)
+        if room is None:
+            return
+        await room.teacher_manager.connect(websocket)
         try:
-            await websocket.send_text(json.dumps({
-                "type": "STATE_UPDATE",
-                "data": state.to_dict()
-            }))
+            await send_message(websocket, room.state.frame())
             while True:
-                data = await websocket.receive_text()
-                message = json.loads(data)
-                await handle_teacher_action(websocket, message)
+                data = await receive_client_message(websocket)
+                message = decode_client_message(data)
+                await dispatch_teacher_action(room, websocket, message)
         except WebSocketDisconnect:
-            teacher_manager.disconnect(websocket)
+            pass
+        finally:
+            room.teacher_manager.disconnect(websocket)
     elif role == "student":
         # Redirigir a endpoint de estudiante
-        await student_websocket(websocket)
+        await student_websocket(websocket, class_code)
 
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Reporte de clase en XLSX
+build_class_report corre en un proceso del pool de reportes (ver ReportQueue
+en main.py), fuera del event loop de la clase en vivo. Lee el volcado NDJSON
+del progreso (un estudiante por línea, con su clasificación) y escribe:
+
+  - Resumen:      totales y distribución por clasificación
+  - Estudiantes:  una fila por estudiante, en orden de porcentaje
+  - Actividades:  respuestas, aciertos, tiempo medio y respuesta más elegida
+  - una hoja por estudiante (respuestas y reflexiones), hasta max_student_sheets
+
+Este módulo no importa main (el proceso hijo no debe levantar la app) ni
+dependencias externas: XlsxWriter escribe el SpreadsheetML mínimo con zipfile.
+Los tiempos guardados pasan por coerce_response_time (el progreso anterior
+puede traer texto o valores fuera de rango).
+"""
+import json
+import math
+import os
+import re
+import time
+import zipfile
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from answers import coerce_response_time
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Límites de Excel
+MAX_SHEET_NAME = 31
+MAX_CELL_CHARS = 32767
+INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+# Caracteres que XML 1.0 no admite (controles y surrogates sueltos)
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+
+SPREADSHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIP_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '{sheets}</Types>'
+)
+ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+# Estilo 0: normal; estilo 1: negrita (encabezados)
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<styleSheet xmlns="{SPREADSHEET_NS}">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+# Encabezado congelado: la primera fila queda visible al desplazarse
+FROZEN_HEADER_XML = (
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '</sheetView></sheetViews>'
+)
+
+
+def _xml_text(value: str) -> str:
+    value = INVALID_XML_CHARS.sub("", value[:MAX_CELL_CHARS])
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def column_letter(index: int) -> str:
+    """Letra de columna de Excel (0 -> A, 26 -> AA)"""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _cell_xml(ref: str, value: Any, style: str) -> str:
+    if value is None or value == "":
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return f'<c r="{ref}"{style}><v>{value!r}</v></c>'
+    # Texto en línea: nunca se interpreta como fórmula
+    return f'<c r="{ref}"{style} t="inlineStr"><is><t xml:space="preserve">{_xml_text(str(value))}</t></is></c>'
+
+
+# ============================================================
+# ESCRITOR XLSX
+# ============================================================
+
+class XlsxWriter:
+    """Libro XLSX mínimo: texto en línea, números y booleanos.
+
+    Cada hoja se escribe directo al zip a partir de un iterable de filas,
+    así las hojas por estudiante no se acumulan en memoria. Las pestañas
+    quedan en el orden en que se agregan.
+    """
+    def __init__(self, path: str):
+        self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        self._sheets: List[str] = []  # nombres en orden de pestañas
+        self._taken = set()  # nombres en minúsculas (Excel no distingue)
+        self._columns: List[str] = []
+
+    def _sheet_name(self, name: str) -> str:
+        """Nombre válido y único: sin []:*?/\\, hasta 31 caracteres"""
+        base = INVALID_SHEET_CHARS.sub("_", INVALID_XML_CHARS.sub("", str(name))).strip().strip("'")
+        base = base[:MAX_SHEET_NAME] or "Hoja"
+        candidate, n = base, 1
+        while candidate.casefold() in self._taken:
+            n += 1
+            suffix = f" ({n})"
+            candidate = base[:MAX_SHEET_NAME - len(suffix)] + suffix
+        self._taken.add(candidate.casefold())
+        return candidate
+
+    def _column(self, index: int) -> str:
+        while len(self._columns) <= index:
+            self._columns.append(column_letter(len(self._columns)))
+        return self._columns[index]
+
+    def add_sheet(self, name: str, rows: Iterable[Sequence[Any]], header: bool = True,
+                  widths: Optional[Sequence[float]] = None) -> str:
+        """Escribe una hoja. Con header=True la primera fila va en negrita y
+        congelada. Retorna el nombre final de la pestaña"""
+        name = self._sheet_name(name)
+        self._sheets.append(name)
+        part = f"xl/worksheets/sheet{len(self._sheets)}.xml"
+        parts = [f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{SPREADSHEET_NS}">']
+        if header:
+            parts.append(FROZEN_HEADER_XML)
+        if widths:
+            parts.append("<cols>" + "".join(
+                f'<col min="{i}" max="{i}" width="{width}" customWidth="1"/>'
+                for i, width in enumerate(widths, 1)
+            ) + "</cols>")
+        parts.append("<sheetData>")
+        with self._zip.open(part, "w") as out:
+            out.write("".join(parts).encode("utf-8"))
+            buffer: List[str] = []
+            for r, row in enumerate(rows, 1):
+                style = ' s="1"' if header and r == 1 else ""
+                cells = "".join(_cell_xml(f"{self._column(c)}{r}", value, style) for c, value in enumerate(row))
+                buffer.append(f'<row r="{r}">{cells}</row>')
+                if len(buffer) >= 512:
+                    out.write("".join(buffer).encode("utf-8"))
+                    buffer = []
+            buffer.append("</sheetData></worksheet>")
+            out.write("".join(buffer).encode("utf-8"))
+        return name
+
+    def close(self):
+        """Escribe el libro, sus relaciones y los tipos de contenido"""
+        sheets = "".join(
+            f'<sheet name="{_xml_text(name)}" sheetId="{i}" r:id="rId{i}"/>'
+            for i, name in enumerate(self._sheets, 1)
+        )
+        self._zip.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<workbook xmlns="{SPREADSHEET_NS}" xmlns:r="{RELATIONSHIP_NS}">'
+            f'<sheets>{sheets}</sheets></workbook>'
+        ))
+        relationships = "".join(
+            f'<Relationship Id="rId{i}" Type="{RELATIONSHIP_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+            for i in range(1, len(self._sheets) + 1)
+        )
+        relationships += (f'<Relationship Id="rId{len(self._sheets) + 1}" '
+                          f'Type="{RELATIONSHIP_NS}/styles" Target="styles.xml"/>')
+        self._zip.writestr("xl/_rels/workbook.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'{relationships}</Relationships>'
+        ))
+        self._zip.writestr("xl/styles.xml", STYLES_XML)
+        self._zip.writestr("_rels/.rels", ROOT_RELS_XML)
+        self._zip.writestr("[Content_Types].xml", CONTENT_TYPES_XML.format(sheets="".join(
+            f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for i in range(1, len(self._sheets) + 1)
+        )))
+        self._zip.close()
+
+    def abort(self):
+        """Cierra el zip sin completar el libro (el llamador borra el archivo)"""
+        self._zip.close()
+
+
+# ============================================================
+# REPORTE DE CLASE
+# ============================================================
+
+def _answer_label(answer: Any, activity: Optional[Dict]) -> Any:
+    """Texto de la opción elegida (o la respuesta tal cual si no es un índice)"""
+    options = (activity or {}).get("options") or []
+    if isinstance(answer, int) and not isinstance(answer, bool) and 0 <= answer < len(options):
+        return options[answer]
+    if isinstance(answer, (list, dict)):
+        return json.dumps(answer, ensure_ascii=False)
+    return answer
+
+
+def _seconds(ms: Optional[float]) -> Optional[float]:
+    return round(ms / 1000, 2) if ms is not None else None
+
+
+def _ratio(part: float, total: float) -> Optional[float]:
+    return round(100 * part / total, 1) if total else None
+
+
+def _student_sheet_rows(record: Dict, activities: Dict[str, Dict]) -> Iterable[list]:
+    yield ["Actividad", "Pregunta", "Respuesta", "Correcta", "Puntaje", "Tiempo (s)", "Respondida"]
+    for activity_id, response in record.get("responses", {}).items():
+        activity = activities.get(activity_id)
+        yield [
+            activity_id,
+            (activity or {}).get("question"),
+            _answer_label(response.get("answer"), activity),
+            bool(response.get("is_correct")),
+            response.get("percentage_value"),
+            _seconds(coerce_response_time(response.get("response_time_ms"))),
+            response.get("answered_at"),
+        ]
+    yield []
+    yield ["Porcentaje acumulado", record.get("accumulated_percentage", 0.0)]
+    yield ["Clasificación", record.get("classification")]
+    reflections = record.get("reflections", [])
+    if reflections:
+        yield []
+        yield ["Reflexiones", "Tema", "Contenido", "Fecha"]
+        for reflection in reflections:
+            yield [None, reflection.get("topic"), reflection.get("content"), reflection.get("created_at")]
+
+
+def build_class_report(records_path: str, output_path: str, class_code: str,
+                       activities: Dict[str, Dict], classifications: List[str],
+                       max_student_sheets: int) -> Dict:
+    """Arma el XLSX del aula a partir del volcado NDJSON (corre en otro proceso).
+
+    activities: activity_id -> {"question", "options", "correctIndex"}
+    classifications: valores de clasificación en el orden del resumen
+    Retorna un resumen del reporte generado.
+    """
+    started = time.perf_counter()
+    students: List[tuple] = []  # (nombre, %, clasificación, respuestas, correctas, tiempo medio, reflexiones, posición)
+    by_classification: Counter = Counter()
+    # activity_id -> [respuestas, correctas, suma de tiempos, tiempos, Counter de respuestas]
+    per_activity: Dict[str, list] = {activity_id: [0, 0, 0, 0, Counter()] for activity_id in activities}
+    total_responses = total_correct = 0
+
+    # Primera pasada: agregados y posición de cada registro en el volcado
+    with open(records_path, "rb") as f:
+        offset = 0
+        for line in f:
+            position, offset = offset, offset + len(line)
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            responses = record.get("responses", {})
+            correct = time_sum = time_count = 0
+            for activity_id, response in responses.items():
+                totals = per_activity.setdefault(activity_id, [0, 0, 0, 0, Counter()])
+                totals[0] += 1
+                if response.get("is_correct"):
+                    totals[1] += 1
+                    correct += 1
+                ms = coerce_response_time(response.get("response_time_ms"))
+                if ms is not None:
+                    totals[2] += ms
+                    totals[3] += 1
+                    time_sum += ms
+                    time_count += 1
+                answer = response.get("answer")
+                if isinstance(answer, (list, dict)):
+                    answer = json.dumps(answer, ensure_ascii=False)
+                totals[4][answer] += 1
+            total_responses += len(responses)
+            total_correct += correct
+            by_classification[record.get("classification")] += 1
+            students.append((
+                record.get("name"),
+                record.get("accumulated_percentage", 0.0),
+                record.get("classification"),
+                len(responses),
+                correct,
+                _seconds(time_sum / time_count) if time_count else None,
+                len(record.get("reflections", [])),
+                position,
+            ))
+
+    students.sort(key=lambda s: (-s[1], str(s[0]).casefold()))
+    average = sum(s[1] for s in students) / len(students) if students else 0.0
+    student_sheets = min(len(students), max(0, max_student_sheets))
+
+    book = XlsxWriter(output_path)
+    try:
+        summary = [
+            ["Reporte de clase", class_code],
+            ["Generado", datetime.now().isoformat(timespec="seconds")],
+            ["Estudiantes", len(students)],
+            ["Actividades", len(per_activity)],
+            ["Respuestas", total_responses],
+            ["Precisión general (%)", _ratio(total_correct, total_responses)],
+            ["Porcentaje promedio", round(average, 2)],
+            ["Hojas por estudiante", f"{student_sheets} de {len(students)}"],
+            [],
+            ["Clasificación", "Estudiantes", "% de la clase"],
+        ]
+        for classification in classifications + sorted(set(by_classification) - set(classifications), key=str):
+            count = by_classification.get(classification, 0)
+            summary.append([classification, count, _ratio(count, len(students))])
+        book.add_sheet("Resumen", summary, header=False, widths=[24, 16, 14])
+
+        book.add_sheet("Estudiantes", (
+            [["Nombre", "Porcentaje", "Clasificación", "Respuestas", "Correctas", "Precisión (%)",
+              "Tiempo medio (s)", "Reflexiones"]]
+            + [[name, percentage, classification, responses, correct, _ratio(correct, responses), avg_time, reflections]
+               for name, percentage, classification, responses, correct, avg_time, reflections, _ in students]
+        ), widths=[28, 12, 14, 12, 12, 14, 16, 12])
+
+        activity_rows = [["Actividad", "Pregunta", "Respuestas", "Correctas", "Precisión (%)",
+                          "Tiempo medio (s)", "Respuesta más elegida", "Veces"]]
+        for activity_id, (responses, correct, time_sum, time_count, answers) in per_activity.items():
+            activity = activities.get(activity_id)
+            top = answers.most_common(1)
+            activity_rows.append([
+                activity_id,
+                (activity or {}).get("question"),
+                responses,
+                correct,
+                _ratio(correct, responses),
+                _seconds(time_sum / time_count) if time_count else None,
+                _answer_label(top[0][0], activity) if top else None,
+                top[0][1] if top else None,
+            ])
+        book.add_sheet("Actividades", activity_rows, widths=[16, 48, 12, 12, 14, 16, 28, 8])
+
+        # Segunda pasada: una hoja por estudiante, en orden alfabético
+        with open(records_path, "rb") as f:
+            for student in sorted(students[:student_sheets], key=lambda s: str(s[0]).casefold()):
+                f.seek(student[7])
+                record = json.loads(f.readline())
+                book.add_sheet(record.get("name") or "Estudiante", _student_sheet_rows(record, activities),
+                               widths=[16, 48, 24, 10, 10, 10, 22])
+        book.close()
+    except BaseException:
+        book.abort()
+        raise
+    return {
+        "students": len(students),
+        "studentSheets": student_sheets,
+        "responses": total_responses,
+        "bytes": os.path.getsize(output_path),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,1022 @@
+# -*- coding: utf-8 -*-
+"""
+Almacenamiento de progreso de estudiantes
+Interfaz ProgressStore con dos implementaciones:
+  - JsonProgressStore: snapshot JSON (un estudiante por línea, cargado bajo
+    demanda) + diario append-only
+  - SQLiteProgressStore: base de datos embebida (modo WAL)
+PersistenceScheduler escribe los cambios fuera del event loop.
+ClassStateLog guarda el estado de la clase como eventos más snapshots.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# El diario se compacta cuando además pesa esta fracción del snapshot:
+# reescribirlo cuesta O(clase), así el costo se reparte entre muchos cambios
+JOURNAL_COMPACT_RATIO = 0.5
+
+def name_key(name: str) -> str:
+    """Clave de búsqueda de un nombre: sin mayúsculas, acentos ni espacios repetidos.
+
+    "  José  Pérez" y "jose perez" producen la misma clave.
+    """
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    without_marks = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(without_marks.split())
+
+
+def empty_saved_student(name: str) -> Dict:
+    """Registro guardado vacío para un estudiante"""
+    return {
+        "name": name,
+        "accumulated_percentage": 0.0,
+        "responses": {},
+        "reflections": [],
+    }
+
+
+# ============================================================
+# INTERFAZ
+# ============================================================
+
+class ProgressStore:
+    """Interfaz de almacenamiento de progreso.
+
+    Los registros guardados tienen el formato de StudentData.to_saveable():
+    {"name", "accumulated_percentage", "responses": {activity_id: {...}}, "reflections": [...]}
+    """
+    bytes_written = 0  # Bytes escritos desde que se abrió (métricas)
+    load_seconds = 0.0  # Tiempo de apertura al arrancar (métricas)
+
+    def load_student(self, name: str) -> Optional[Dict]:
+        """Obtiene el registro guardado de un estudiante (búsqueda por name_key)"""
+        raise NotImplementedError
+
+    def has_student(self, name: str) -> bool:
+        """Indica si hay progreso guardado para el nombre (sin cargarlo)"""
+        return self.load_student(name) is not None
+
+    def iter_index(self) -> Iterator[Tuple[str, float]]:
+        """Itera (nombre, porcentaje acumulado) de los estudiantes guardados"""
+        raise NotImplementedError
+
+    def iter_students(self) -> Iterator[Dict]:
+        """Itera los registros completos de todos los estudiantes guardados"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        """Cantidad de estudiantes guardados"""
+        raise NotImplementedError
+
+    def save_students(self, students_data: Dict[str, Dict]):
+        """Persiste (reemplaza) los registros completos de varios estudiantes.
+
+        Puede llamarse desde el hilo de PersistenceScheduler: las
+        implementaciones deben ser seguras entre hilos.
+        """
+        raise NotImplementedError
+
+    def save_changes(self, records: List[Dict]):
+        """Persiste cambios individuales, en orden: registros con el formato del
+        diario ({"op": "response" | "reflection", "name", ...}, ver
+        apply_journal_record). El costo es proporcional al cambio, no al
+        historial del estudiante.
+
+        Se llama desde el hilo de PersistenceScheduler.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """Elimina todo el progreso guardado"""
+        raise NotImplementedError
+
+    def version(self) -> tuple:
+        """Identifica el contenido guardado: cambia con cada escritura (clave de
+        caché de los reportes generados)"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        """Métricas de arranque: estudiantes indexados, segundos de carga y
+        memoria aproximada del índice en bytes"""
+        return {
+            "students": self.count(),
+            "loadSeconds": round(self.load_seconds, 4),
+            "indexBytes": 0,
+        }
+
+    def close(self):
+        """Libera recursos (archivos, conexiones)"""
+
+
+# ============================================================
+# IMPLEMENTACIÓN JSON (SNAPSHOT + DIARIO)
+# ============================================================
+
+def apply_journal_record(students_data: Dict, record: Dict):
+    """Aplica un registro del diario sobre el diccionario de progreso"""
+    op = record.get("op")
+    if op == "reset":
+        students_data.clear()
+        return
+    name = record.get("name")
+    if not name:
+        return
+    if op == "student":
+        students_data[name] = record["student"]
+        return
+    saved = students_data.get(name)
+    if saved is None:
+        saved = students_data[name] = empty_saved_student(name)
+    if op == "response":
+        response = record["response"]
+        saved.setdefault("responses", {})[response["activity_id"]] = response
+        saved["accumulated_percentage"] = record.get(
+            "accumulated_percentage", saved.get("accumulated_percentage", 0.0)
+        )
+    elif op == "reflection":
+        reflection = record["reflection"]
+        reflections = saved.setdefault("reflections", [])
+        # Idempotente: el diario puede re-aplicarse sobre un snapshot ya compactado
+        if not any(r.get("id") == reflection.get("id") for r in reflections):
+            reflections.append(reflection)
+
+
+class ProgressJournal:
+    """Diario append-only de cambios de progreso.
+
+    Cada respuesta, reflexión o reinicio agrega una línea JSON compacta, de
+    modo que el costo de escritura es proporcional al cambio y no al tamaño
+    de la clase. Los registros "student" (completos) quedan para importar.
+    """
+    def __init__(self, path: str, compact_threshold: int):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self.record_count = 0
+        self.bytes_written = 0
+        self.size = 0  # Bytes actuales del archivo
+        self._file = None
+
+    def records(self) -> Iterator[Dict]:
+        """Itera los registros del diario en orden (cuenta los leídos en record_count)"""
+        self.record_count = 0
+        if not os.path.exists(self.path):
+            return
+        self.size = os.path.getsize(self.path)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Última línea truncada por un cierre abrupto: se ignora
+                        print("[WARN] Registro de diario corrupto ignorado")
+                        continue
+                    self.record_count += 1
+                    yield record
+        except Exception as e:
+            print(f"[WARN] Error leyendo diario {self.path}: {e}")
+
+    def replay(self, students_data: Dict) -> int:
+        """Re-aplica el diario sobre el snapshot cargado. Retorna registros aplicados"""
+        for record in self.records():
+            apply_journal_record(students_data, record)
+        return self.record_count
+
+    def append(self, record: Dict):
+        """Agrega un registro al final del diario"""
+        try:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+                if self._file.tell() and not self._ends_with_newline():
+                    # Línea cortada por un cierre abrupto: no pegarle el registro nuevo
+                    self._file.write("\n")
+                    self.size += 1
+            line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+            self._file.write(line)
+            self._file.flush()
+            self.record_count += 1
+            size = len(line.encode('utf-8'))
+            self.bytes_written += size
+            self.size += size
+        except Exception as e:
+            print(f"[ERROR] Error escribiendo diario de progreso: {e}")
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.record_count >= self.compact_threshold
+
+    def truncate(self):
+        """Vacía el diario (tras escribir un snapshot)"""
+        try:
+            self.close()
+            with open(self.path, 'w', encoding='utf-8'):
+                pass
+            self.record_count = 0
+            self.size = 0
+        except Exception as e:
+            print(f"[ERROR] Error vaciando diario de progreso: {e}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class JsonProgressStore(ProgressStore):
+    """Progreso en un snapshot JSON más un diario append-only.
+
+    El snapshot guarda un estudiante por línea. Al abrir solo se arma un
+    índice name_key -> posición de su línea (sin parsear los registros) y el
+    registro completo se lee del disco al pedirlo (load_student). En memoria
+    quedan solo los estudiantes modificados desde el último snapshot
+    (self.changed); el diario se compacta en el snapshot al superar
+    compact_threshold registros y JOURNAL_COMPACT_RATIO del tamaño del
+    snapshot.
+    """
+    SNAPSHOT_FORMAT = "lines-v1"
+
+    def __init__(self, path: str, journal_path: str, compact_threshold: int = 500):
+        self.path = path
+        self.journal = ProgressJournal(journal_path, compact_threshold)
+        self._lock = threading.RLock()
+        self._snapshot_bytes = 0
+        self._snapshot_size = 0  # Bytes del snapshot actual
+        self._reader = None
+        # name_key -> (nombre guardado, posición, largo) de su registro en el snapshot
+        self._offsets: Dict[str, Tuple[str, int, int]] = {}
+        # nombre -> registro completo de los modificados desde el último snapshot
+        self.changed: Dict[str, Dict] = {}
+        # name_key -> nombre guardado (búsqueda O(1) sin distinguir mayúsculas/acentos)
+        self._index: Dict[str, str] = {}
+        started = time.perf_counter()
+        self._load()
+        self.load_seconds = time.perf_counter() - started
+        self.index_bytes = self._index_size()
+        # Archivos al abrir + escrituras desde entonces (ver version)
+        self._opened = self._files_signature()
+        self._writes = 0
+
+    # ---------- snapshot ----------
+
+    def _header(self) -> bytes:
+        return ('{"format":"%s","last_updated":%s,"students":{\n'
+                % (self.SNAPSHOT_FORMAT, json.dumps(datetime.now().isoformat()))).encode('utf-8')
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path) and not self._index_snapshot():
+                self._convert_legacy()
+        except Exception as e:
+            print(f"[WARN] Error cargando progreso: {e}")
+        for record in self.journal.records():
+            self._apply(record)
+        if self.journal.record_count:
+            print(f"[INFO] Diario de progreso aplicado: {self.journal.record_count} registros")
+
+    def _index_snapshot(self) -> bool:
+        """Arma el índice leyendo solo la clave de cada línea. False si el archivo
+        tiene el formato anterior (JSON con sangría)"""
+        with open(self.path, 'rb') as f:
+            header = f.readline()
+            if not header.startswith(b'{"format":"%s"' % self.SNAPSHOT_FORMAT.encode('ascii')):
+                return False
+            position = len(header)
+            self._snapshot_size = os.fstat(f.fileno()).st_size
+            for line in f:
+                start = position
+                position += len(line)
+                raw = line.rstrip(b"\r\n")
+                if raw.startswith(b","):
+                    raw = raw[1:]
+                    start += 1
+                if not raw.startswith(b'"'):
+                    continue  # Cierre del documento
+                # Los nombres tienen a lo sumo 50 caracteres: la clave está al principio
+                name, _ = json.decoder.scanstring(raw[:512].decode('utf-8', 'ignore'), 1)
+                key = name_key(name)
+                self._offsets[key] = (name, start, len(raw))
+                self._index[key] = name
+        return True
+
+    def _convert_legacy(self):
+        """Convierte una única vez el snapshot con sangría al formato por líneas"""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        students = data.get("students", {}) if isinstance(data, dict) else {}
+        with self._lock:
+            self.changed = dict(students)
+            self._index = {name_key(name): name for name in students}
+            # El diario se re-aplica encima: la conversión no lo vacía
+            self._rewrite_snapshot()
+        print(f"[INFO] Progreso convertido al formato por líneas: {len(students)} estudiantes")
+
+    def _read_record(self, entry: Tuple[str, int, int]) -> Dict:
+        """Lee y parsea una sola línea del snapshot"""
+        _, offset, length = entry
+        if self._reader is None:
+            self._reader = open(self.path, 'rb')
+        self._reader.seek(offset)
+        # La línea es '"nombre":{...}': entre llaves es un objeto JSON válido
+        record = json.loads(b"{" + self._reader.read(length) + b"}")
+        return next(iter(record.values()))
+
+    def _rewrite_snapshot(self):
+        """Escribe un snapshot nuevo: copia sin parsear las líneas que no
+        cambiaron y agrega los modificados. Memoria constante respecto de la clase"""
+        changed_keys = {name_key(name) for name in self.changed}
+        offsets: Dict[str, Tuple[str, int, int]] = {}
+        tmp_file = self.path + ".tmp"
+        written = 0
+        with open(tmp_file, 'wb') as out:
+            header = self._header()
+            out.write(header)
+            position = len(header)
+
+            def write_line(key: str, name: str, raw: bytes):
+                nonlocal position
+                prefix = b"," if offsets else b""
+                out.write(prefix + raw + b"\n")
+                offsets[key] = (name, position + len(prefix), len(raw))
+                position += len(prefix) + len(raw) + 1
+
+            for key, (name, offset, length) in self._offsets.items():
+                if key in changed_keys:
+                    continue
+                if self._reader is None:
+                    self._reader = open(self.path, 'rb')
+                self._reader.seek(offset)
+                write_line(key, name, self._reader.read(length))
+            for name, data in self.changed.items():
+                raw = (json.dumps(name, ensure_ascii=False) + ":" +
+                       json.dumps(data, ensure_ascii=False, separators=(',', ':'))).encode('utf-8')
+                write_line(name_key(name), name, raw)
+            out.write(b"}}\n")
+            written = position + 3
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        os.replace(tmp_file, self.path)
+        self._snapshot_bytes += written
+        self._snapshot_size = written
+        self._offsets = offsets
+        self._index = {key: entry[0] for key, entry in offsets.items()}
+        self.changed = {}
+        self.index_bytes = self._index_size()
+
+    def _write_snapshot(self):
+        """Guarda el snapshot (escritura atómica) y vacía el diario"""
+        try:
+            with self._lock:
+                self._rewrite_snapshot()
+                count = len(self._offsets)
+                self.journal.truncate()
+            print(f"[INFO] Progreso guardado: {count} estudiantes")
+        except Exception as e:
+            print(f"[ERROR] Error guardando progreso: {e}")
+
+    def _files_signature(self) -> tuple:
+        """(mtime, tamaño) del snapshot y tamaño del diario: igual entre aperturas
+        si nadie escribió"""
+        signature = []
+        for path in (self.path, self.journal.path):
+            try:
+                st = os.stat(path)
+                signature += [st.st_mtime_ns, st.st_size]
+            except OSError:
+                signature += [0, 0]
+        return tuple(signature)
+
+    def _index_size(self) -> int:
+        """Memoria aproximada del índice (bytes)"""
+        size = sys.getsizeof(self._offsets) + sys.getsizeof(self._index)
+        for key, entry in self._offsets.items():
+            # La clave y el nombre se comparten con _index; se cuentan una vez
+            size += sys.getsizeof(key) + sys.getsizeof(entry) + sys.getsizeof(entry[0]) + 2 * 28
+        return size
+
+    @property
+    def bytes_written(self) -> int:
+        return self._snapshot_bytes + self.journal.bytes_written
+
+    # ---------- diario ----------
+
+    def _apply(self, record: Dict):
+        """Aplica un registro del diario sobre los modificados en memoria"""
+        with self._lock:
+            if record.get("op") == "reset":
+                self._offsets.clear()
+                self._index.clear()
+                self.changed.clear()
+                return
+            name = record.get("name")
+            if not name:
+                return
+            key = name_key(name)
+            if name not in self.changed and record.get("op") != "student":
+                # Cambio parcial: parte del registro guardado (aunque esté escrito distinto)
+                previous = self._index.get(key)
+                if previous in self.changed:
+                    base = self.changed[previous]
+                else:
+                    entry = self._offsets.get(key)
+                    base = self._read_record(entry) if entry is not None else None
+                if base is not None:
+                    self.changed[name] = {**base, "name": name}
+            apply_journal_record(self.changed, record)
+            previous = self._index.get(key)
+            if previous is not None and previous != name:
+                # Mismo estudiante escrito distinto ("Jose" / "josé"): queda uno
+                self.changed.pop(previous, None)
+            self._index[key] = name
+
+    def _journal(self, record: Dict):
+        with self._lock:
+            self._apply(record)
+            self.journal.append(record)
+            self._writes += 1
+            needs_compaction = (self.journal.needs_compaction and
+                                self.journal.size >= self._snapshot_size * JOURNAL_COMPACT_RATIO)
+        if needs_compaction:
+            self._write_snapshot()
+
+    # ---------- lectura ----------
+
+    def load_student(self, name: str) -> Optional[Dict]:
+        with self._lock:
+            key = name_key(name)
+            saved_name = self._index.get(key)
+            if saved_name is None:
+                return None
+            if saved_name in self.changed:
+                return self.changed[saved_name]
+            entry = self._offsets.get(key)
+            return self._read_record(entry) if entry is not None else None
+
+    def has_student(self, name: str) -> bool:
+        return name_key(name) in self._index
+
+    def iter_index(self) -> Iterator[Tuple[str, float]]:
+        for data in self.iter_students():
+            yield data["name"], data.get('accumulated_percentage', 0)
+
+    def iter_students(self) -> Iterator[Dict]:
+        """Lee los registros de a uno (en memoria solo la lista de nombres)"""
+        with self._lock:
+            names = list(self._index.values())
+        for name in names:
+            record = self.load_student(name)
+            if record is not None:
+                yield record
+
+    def count(self) -> int:
+        return len(self._index)
+
+    def version(self) -> tuple:
+        return self._opened, self._writes
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats["indexBytes"] = self.index_bytes
+        stats["modifiedInMemory"] = len(self.changed)
+        return stats
+
+    def save_students(self, students_data: Dict[str, Dict]):
+        for name, data in students_data.items():
+            self._journal({"op": "student", "name": name, "student": data})
+
+    def save_changes(self, records: List[Dict]):
+        for record in records:
+            self._journal(record)
+
+    def clear(self):
+        self._journal({"op": "reset", "at": datetime.now().isoformat()})
+
+    def close(self):
+        # Al cerrar se compacta para que el próximo arranque no re-aplique el diario
+        if self.journal.record_count:
+            self._write_snapshot()
+        self.journal.close()
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+
+# ============================================================
+# IMPLEMENTACIÓN SQLITE
+# ============================================================
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    name_key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    accumulated_percentage REAL NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS responses (
+    name_key TEXT NOT NULL,
+    activity_id TEXT NOT NULL,
+    answer TEXT,
+    is_correct INTEGER NOT NULL DEFAULT 0,
+    percentage_value REAL,
+    answered_at TEXT,
+    response_time_ms INTEGER,
+    PRIMARY KEY (name_key, activity_id)
+);
+CREATE INDEX IF NOT EXISTS idx_responses_activity ON responses(activity_id);
+CREATE TABLE IF NOT EXISTS reflections (
+    id TEXT PRIMARY KEY,
+    name_key TEXT NOT NULL,
+    student_session_id TEXT,
+    student_name TEXT,
+    topic TEXT,
+    content TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reflections_name ON reflections(name_key, created_at);
+"""
+
+
+SQLITE_PAGE_SIZE = 500  # Estudiantes por consulta al recorrer todo el progreso
+
+
+class SQLiteProgressStore(ProgressStore):
+    """Progreso en SQLite: una fila por estudiante y una por respuesta/reflexión.
+
+    Las búsquedas usan el nombre normalizado (name_key) como clave primaria, así
+    restaurar un estudiante lee solo sus filas.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        started = time.perf_counter()
+        # La conexión se comparte con el hilo de PersistenceScheduler
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._conn.commit()
+        self.bytes_written = 0  # Tamaño de los valores escritos (aproximado)
+        # Escrituras de esta conexión; las de otros workers las cuenta data_version
+        self._opened = time.time_ns()
+        self._writes = 0
+        # El índice por name_key vive en el archivo: abrir no lee estudiantes
+        self.load_seconds = time.perf_counter() - started
+
+    def _execute_write(self, sql: str, params: tuple):
+        self._conn.execute(sql, params)
+        self.bytes_written += sum(
+            len(v.encode('utf-8')) if isinstance(v, str) else 8 for v in params if v is not None
+        )
+
+    def _upsert_student(self, name: str, accumulated_percentage: float):
+        self._execute_write(
+            "INSERT INTO students (name_key, name, accumulated_percentage, updated_at) "
+            "VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(name_key) DO UPDATE SET "
+            "accumulated_percentage = excluded.accumulated_percentage, "
+            "updated_at = excluded.updated_at",
+            (name_key(name), name, accumulated_percentage, datetime.now().isoformat())
+        )
+
+    def _insert_response(self, name: str, response: Dict):
+        self._execute_write(
+            "INSERT OR REPLACE INTO responses (name_key, activity_id, answer, is_correct, "
+            "percentage_value, answered_at, response_time_ms) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                name_key(name),
+                response["activity_id"],
+                json.dumps(response.get("answer"), ensure_ascii=False),
+                1 if response.get("is_correct") else 0,
+                response.get("percentage_value"),
+                response.get("answered_at"),
+                response.get("response_time_ms"),
+            )
+        )
+
+    def _insert_reflection(self, name: str, reflection: Dict):
+        self._execute_write(
+            "INSERT OR IGNORE INTO reflections (id, name_key, student_session_id, "
+            "student_name, topic, content, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                reflection["id"],
+                name_key(name),
+                reflection.get("student_session_id"),
+                reflection.get("student_name", name),
+                reflection.get("topic"),
+                reflection.get("content"),
+                reflection.get("created_at"),
+            )
+        )
+
+    def _load_rows(self, row: sqlite3.Row) -> Dict:
+        """Arma el registro completo de un estudiante a partir de su fila"""
+        key = row["name_key"]
+        responses = {}
+        for r in self._conn.execute(
+            "SELECT * FROM responses WHERE name_key = ?", (key,)
+        ):
+            responses[r["activity_id"]] = {
+                "activity_id": r["activity_id"],
+                "answer": json.loads(r["answer"]) if r["answer"] is not None else None,
+                "is_correct": bool(r["is_correct"]),
+                "percentage_value": r["percentage_value"],
+                "answered_at": r["answered_at"],
+                "response_time_ms": r["response_time_ms"],
+            }
+        reflections = [
+            {
+                "id": r["id"],
+                "student_session_id": r["student_session_id"],
+                "student_name": r["student_name"],
+                "topic": r["topic"],
+                "content": r["content"],
+                "created_at": r["created_at"],
+            }
+            for r in self._conn.execute(
+                "SELECT * FROM reflections WHERE name_key = ? ORDER BY created_at", (key,)
+            )
+        ]
+        return {
+            "name": row["name"],
+            "accumulated_percentage": row["accumulated_percentage"],
+            "responses": responses,
+            "reflections": reflections,
+        }
+
+    def load_student(self, name: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM students WHERE name_key = ?", (name_key(name),)
+            ).fetchone()
+            return self._load_rows(row) if row else None
+
+    def has_student(self, name: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM students WHERE name_key = ?", (name_key(name),)
+            ).fetchone() is not None
+
+    def iter_index(self) -> Iterator[Tuple[str, float]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, accumulated_percentage FROM students ORDER BY name"
+            ).fetchall()
+        for row in rows:
+            yield row["name"], row["accumulated_percentage"]
+
+    def iter_students(self) -> Iterator[Dict]:
+        """Recorre por páginas de name_key (memoria constante aunque haya miles)"""
+        last_key = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT * FROM students WHERE name_key > ? ORDER BY name_key LIMIT ?",
+                    (last_key, SQLITE_PAGE_SIZE)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                with self._lock:
+                    record = self._load_rows(row)
+                yield record
+            last_key = rows[-1]["name_key"]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM students").fetchone()[0]
+
+    def version(self) -> tuple:
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            return self._opened, self._writes, data_version
+
+    def save_students(self, students_data: Dict[str, Dict]):
+        with self._lock, self._conn:
+            self._writes += 1
+            for name, data in students_data.items():
+                key = name_key(name)
+                self._upsert_student(name, data.get("accumulated_percentage", 0.0))
+                self._conn.execute("DELETE FROM responses WHERE name_key = ?", (key,))
+                self._conn.execute("DELETE FROM reflections WHERE name_key = ?", (key,))
+                for response in data.get("responses", {}).values():
+                    self._insert_response(name, response)
+                for reflection in data.get("reflections", []):
+                    self._insert_reflection(name, reflection)
+
+    def save_changes(self, records: List[Dict]):
+        with self._lock, self._conn:
+            self._writes += 1
+            for record in records:
+                name = record["name"]
+                self._upsert_student(name, record.get("accumulated_percentage", 0.0))
+                if record["op"] == "response":
+                    self._insert_response(name, record["response"])
+                elif record["op"] == "reflection":
+                    self._insert_reflection(name, record["reflection"])
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._writes += 1
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM reflections")
+            self._conn.execute("DELETE FROM students")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ============================================================
+# PERSISTENCIA EN SEGUNDO PLANO
+# ============================================================
+
+class PersistenceScheduler:
+    """Escribe el progreso fuera del event loop, agrupando ráfagas de cambios.
+
+    Los handlers solo marcan lo que cambió: una respuesta (mark_response) o una
+    reflexión (mark_reflection), que se escriben como registros del diario; o el
+    estudiante completo (mark_dirty), solo para guardar todo o importar. Una
+    tarea de fondo espera `interval` segundos desde el primer cambio y guarda
+    todos los pendientes en una sola escritura, ejecutada en un hilo dedicado.
+    El hilo es único, así que escrituras y limpiezas se aplican en orden.
+    """
+    def __init__(self, store: ProgressStore, interval: float = 1.0,
+                 on_flush: Optional[Callable[[float, int, int], None]] = None):
+        self.store = store
+        self.interval = interval
+        # on_flush(segundos, bytes, estudiantes) tras cada escritura (en el hilo de persistencia)
+        self.on_flush = on_flush
+        self._dirty: Dict[str, Any] = {}  # nombre -> objeto con to_saveable()
+        # (nombre, op, activity_id o id de reflexión) -> (estudiante, reflexión)
+        self._changes: Dict[Tuple[str, str, str], Tuple[Any, Optional[Dict]]] = {}
+        self._dirty_since: Optional[float] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Métricas
+        self.flush_count = 0
+        self.students_written = 0
+        self.bytes_written = 0
+        self.last_flush_duration = 0.0
+        self.last_flush_lag = 0.0
+        self.max_flush_lag = 0.0
+
+    def _mark(self):
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+        if self._wake is not None:
+            self._wake.set()
+
+    def mark_dirty(self, obj: Any):
+        """Marca un estudiante completo como pendiente de guardar"""
+        self._dirty[obj.name] = obj
+        self._mark()
+
+    def mark_response(self, student: Any, activity_id: str):
+        """Marca una respuesta como pendiente (la última por actividad)"""
+        self._changes[(student.name, "response", activity_id)] = (student, None)
+        self._mark()
+
+    def mark_reflection(self, student: Any, reflection: Dict):
+        """Marca una reflexión como pendiente"""
+        self._changes[(student.name, "reflection", reflection.get("id"))] = (student, dict(reflection))
+        self._mark()
+
+    @property
+    def pending_students(self) -> int:
+        return len(set(self._dirty) | {key[0] for key in self._changes})
+
+    def submit(self, fn: Callable, *args):
+        """Ejecuta fn(*args) en el hilo de persistencia, en orden con las escrituras"""
+        self._executor.submit(self._safe_call, fn, *args)
+
+    def clear(self):
+        """Descarta cambios pendientes y limpia el almacenamiento (en orden)"""
+        self._dirty = {}
+        self._changes = {}
+        self._dirty_since = None
+        self.submit(self.store.clear)
+
+    def _take_batch(self) -> Tuple[Dict[str, Dict], List[Dict], Optional[float]]:
+        # Los registros son copias: el hilo no comparte estado con el loop
+        batch = {name: obj.to_saveable() for name, obj in self._dirty.items()}
+        changes = []
+        for (name, op, item_id), (student, reflection) in self._changes.items():
+            if name in batch:
+                continue  # Ya va completo
+            record = {"op": op, "name": name, "accumulated_percentage": student.accumulated_percentage}
+            if op == "response":
+                if item_id not in student.responses:
+                    continue  # Reiniciado antes del flush
+                record["response"] = student.responses[item_id]
+            else:
+                record["reflection"] = reflection
+            changes.append(record)
+        since = self._dirty_since
+        self._dirty = {}
+        self._changes = {}
+        self._dirty_since = None
+        return batch, changes, since
+
+    def _safe_call(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"[ERROR] Error en persistencia: {e}")
+
+    def _write(self, batch: Dict[str, Dict], changes: List[Dict], since: Optional[float]):
+        bytes_before = self.store.bytes_written
+        start = time.monotonic()
+        if batch:
+            self._safe_call(self.store.save_students, batch)
+        if changes:
+            self._safe_call(self.store.save_changes, changes)
+        end = time.monotonic()
+        written = self.store.bytes_written - bytes_before
+        students = len(set(batch) | {record["name"] for record in changes})
+        self.flush_count += 1
+        self.students_written += students
+        self.bytes_written += written
+        self.last_flush_duration = end - start
+        if self.on_flush is not None:
+            self._safe_call(self.on_flush, end - start, written, students)
+        if since is not None:
+            self.last_flush_lag = end - since
+            self.max_flush_lag = max(self.max_flush_lag, self.last_flush_lag)
+
+    async def flush(self):
+        """Guarda los cambios pendientes en el hilo de persistencia.
+
+        Sin pendientes igual espera lo ya encolado (un lote que _run tomó y se
+        está escribiendo): al volver, todo lo anterior está en el almacenamiento.
+        """
+        loop = asyncio.get_running_loop()
+        if not self._dirty and not self._changes:
+            await loop.run_in_executor(self._executor, lambda: None)
+            return
+        await loop.run_in_executor(self._executor, self._write, *self._take_batch())
+
+    def flush_sync(self):
+        """Guarda los cambios pendientes bloqueando hasta terminar"""
+        if self._dirty or self._changes:
+            self._executor.submit(self._write, *self._take_batch()).result()
+        else:
+            # Esperar escrituras/limpiezas ya encoladas
+            self._executor.submit(lambda: None).result()
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            # Ventana de agrupación: los cambios que lleguen mientras tanto van juntos
+            await asyncio.sleep(self.interval)
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        """Inicia la tarea de fondo (requiere event loop activo)"""
+        self._wake = asyncio.Event()
+        if self._dirty or self._changes:
+            self._wake.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detiene la tarea, guarda lo pendiente y cierra el almacenamiento"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush_sync()
+        self._executor.shutdown(wait=True)
+        self.store.close()
+
+    def stats(self) -> Dict:
+        """Métricas de persistencia (segundos)"""
+        pending_lag = time.monotonic() - self._dirty_since if self._dirty_since else 0.0
+        return {
+            "pendingStudents": self.pending_students,
+            "pendingChanges": len(self._changes),
+            "pendingLagSeconds": round(pending_lag, 4),
+            "flushCount": self.flush_count,
+            "studentsWritten": self.students_written,
+            "bytesWritten": self.bytes_written,
+            "lastFlushDurationSeconds": round(self.last_flush_duration, 4),
+            "lastFlushLagSeconds": round(self.last_flush_lag, 4),
+            "maxFlushLagSeconds": round(self.max_flush_lag, 4),
+            "intervalSeconds": self.interval,
+            "store": self.store.stats(),
+        }
+
+
+# ============================================================
+# FÁBRICA
+# ============================================================
+
+def create_progress_store(backend: str, json_path: str, journal_path: str,
+                          sqlite_path: str, compact_threshold: int = 500) -> ProgressStore:
+    """Crea el almacenamiento configurado ("json" o "sqlite")"""
+    if backend == "sqlite":
+        store = SQLiteProgressStore(sqlite_path)
+        # Primera vez con SQLite: importar el progreso existente en JSON
+        if store.count() == 0 and os.path.exists(json_path):
+            legacy = JsonProgressStore(json_path, journal_path, compact_threshold)
+            if legacy.count():
+                # En tandas: el JSON se lee de a un estudiante
+                batch: Dict[str, Dict] = {}
+                for data in legacy.iter_students():
+                    batch[data["name"]] = data
+                    if len(batch) >= 500:
+                        store.save_students(batch)
+                        batch = {}
+                if batch:
+                    store.save_students(batch)
+                print(f"[INFO] Progreso importado a SQLite: {legacy.count()} estudiantes")
+            legacy.close()
+        return store
+    return JsonProgressStore(json_path, journal_path, compact_threshold)
+
+
+# ============================================================
+# ESTADO DE LA CLASE (EVENTOS + SNAPSHOT)
+# ============================================================
+
+class ClassStateLog:
+    """Acciones del docente como eventos append-only, con snapshots periódicos.
+
+    Cada evento lleva un número correlativo ("seq") y el snapshot guarda el
+    del último evento que ya incluye: al arrancar se carga el snapshot y se
+    re-aplican solo los eventos posteriores. Un corte entre escribir el
+    snapshot y vaciar el diario no aplica ningún evento dos veces.
+
+    append y write_snapshot escriben en disco: el aula los ejecuta en el hilo
+    de su PersistenceScheduler (submit), nunca en el event loop.
+    """
+    def __init__(self, snapshot_path: str, events_path: str, snapshot_every: int = 100):
+        self.snapshot_path = snapshot_path
+        self.journal = ProgressJournal(events_path, snapshot_every)
+        self.seq = 0
+
+    def load(self) -> Tuple[Optional[Dict], List[Dict]]:
+        """(estado del último snapshot o None, eventos posteriores en orden)"""
+        snapshot = None
+        try:
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                snapshot = data.get("state")
+                self.seq = data.get("seq", 0)
+        except Exception as e:
+            print(f"[WARN] Error cargando snapshot de la clase: {e}")
+        events = [event for event in self.journal.records() if event.get("seq", 0) > self.seq]
+        # Los ya incluidos en el snapshot (corte antes de vaciar el diario) no cuentan
+        self.journal.record_count = len(events)
+        if events:
+            self.seq = events[-1]["seq"]
+        return snapshot, events
+
+    def append(self, action: str, payload: Dict, at: float) -> Dict:
+        """Agrega un evento (at: hora time.time() en que se aplicó)"""
+        self.seq += 1
+        event = {"seq": self.seq, "at": at, "action": action, "payload": payload}
+        self.journal.append(event)
+        return event
+
+    def write_snapshot(self, state: Dict):
+        """Guarda el estado completo (escritura atómica) y vacía el diario de eventos"""
+        try:
+            data = {
+                "seq": self.seq,
+                "state": state,
+                "last_updated": datetime.now().isoformat()
+            }
+            tmp_file = self.snapshot_path + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_file, self.snapshot_path)
+            self.journal.truncate()
+        except Exception as e:
+            print(f"[ERROR] Error guardando snapshot de la clase: {e}")
+
+    def close(self):
+        self.journal.close()
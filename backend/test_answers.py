@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de answers.py: tiempos de respuesta inválidos (del cliente o del
+progreso guardado) se guardan como "sin tiempo" y sobreviven el ida y vuelta
+por el formato guardado; estadísticas por pregunta sobre las columnas.
+
+    python -m pytest test_answers.py
+"""
+import math
+
+from answers import (
+    MAX_RESPONSE_TIME_MS, NO_RESPONSE_TIME, SLOT_INDEX_MIN, ItemResponseStore, StudentResponses,
+    coerce_response_time,
+)
+
+# valor recibido -> response_time_ms guardado
+RESPONSE_TIMES = {
+    1234: 1234,
+    0: 0,
+    1500.7: 1500,
+    MAX_RESPONSE_TIME_MS - 1: MAX_RESPONSE_TIME_MS - 1,
+    None: None,
+    "rapido": None,
+    "1200": None,
+    -1: None,
+    -50: None,
+    MAX_RESPONSE_TIME_MS: None,
+    2 ** 40: None,
+    float("nan"): None,
+    float("inf"): None,
+    True: None,
+}
+
+
+def test_coerce_response_time():
+    for value, expected in RESPONSE_TIMES.items():
+        assert coerce_response_time(value) == expected, value
+
+
+def test_record_round_trip():
+    responses = StudentResponses()
+    for i, value in enumerate(RESPONSE_TIMES):
+        responses.record(f"act-{i}", i % 4, i % 2 == 0, 5.0, value)
+    saved = responses.to_saveable()
+    restored = StudentResponses.from_saved(saved)
+    assert restored.to_saveable() == saved
+    for i, expected in enumerate(RESPONSE_TIMES.values()):
+        assert saved[f"act-{i}"]["response_time_ms"] == expected
+        assert restored[f"act-{i}"]["response_time_ms"] == expected
+
+
+def test_from_saved_with_invalid_persisted_times():
+    # Progreso guardado antes de validar: el valor llegaba tal cual del cliente
+    saved = {
+        f"act-{i}": {"activity_id": f"act-{i}", "answer": 1, "is_correct": True,
+                     "percentage_value": 5.0, "answered_at": "2026-01-01T10:00:00",
+                     "response_time_ms": value}
+        for i, value in enumerate(RESPONSE_TIMES)
+    }
+    restored = StudentResponses.from_saved(saved)
+    assert len(restored) == len(RESPONSE_TIMES)
+    times = [time_ms for _, _, _, time_ms in restored.iter_items()]
+    assert times == list(RESPONSE_TIMES.values())
+    assert not any(isinstance(t, float) and math.isnan(t) for t in times)
+
+
+def test_lookup_before_and_after_slot_index():
+    responses = StudentResponses()
+    count = SLOT_INDEX_MIN * 3
+    for i in range(count):
+        responses.record(f"slot-{i}", i, i % 3 == 0, 1.0, i * 10)
+        # Cada respuesta anterior se sigue encontrando al cruzar SLOT_INDEX_MIN
+        assert all(responses.answer(f"slot-{j}") == j for j in range(i + 1))
+        assert f"slot-{i + 1}" not in responses
+    # Reemplazar no agrega posiciones
+    responses.record("slot-0", "otra", False, 2.0, 5)
+    assert len(responses) == count
+    assert responses["slot-0"]["answer"] == "otra"
+    assert responses["slot-0"]["response_time_ms"] == 5
+    assert list(responses) == [f"slot-{i}" for i in range(count)]
+    assert responses.answer("desconocida") is None
+
+
+def test_item_store_ignores_invalid_times():
+    items = ItemResponseStore()
+    for i, value in enumerate(RESPONSE_TIMES):
+        items.record(f"s{i}", "act", i % 4, i % 2 == 0, value)
+    column = items.columns["act"]
+    stored = [None if t == NO_RESPONSE_TIME else t for t in column.times]
+    assert stored == list(RESPONSE_TIMES.values())
+    # Reemplazar la respuesta con un tiempo inválido tampoco rompe la columna
+    items.record("s0", "act", 1, True, "rapido")
+    assert column.times[0] == NO_RESPONSE_TIME
+
+
+def test_item_stats():
+    items = ItemResponseStore()
+    # Segunda pregunta: solo s0 y s1 aciertan (separa los grupos de discriminación)
+    for i, hit in enumerate((True, True, False, False)):
+        items.record(f"s{i}", "b", 1 if hit else 0, hit, None)
+    items.record("s0", "a", 1, True, 1000)
+    items.record("s1", "a", 1, True, 2000)
+    items.record("s2", "a", 2, False, 3000)
+    items.record("s3", "a", None, False, "rapido")
+    stats = items.stats("a")
+    assert stats == {
+        "responses": 4,
+        "correct": 2,
+        "accuracy": 50.0,
+        "distribution": {"1": 2, "2": 1},
+        "responseTimeMs": {"count": 3, "mean": 2000.0, "min": 1000, "max": 3000,
+                           "p50": 2000.0, "p90": 2800.0, "p95": 2900.0},
+        "difficulty": 0.5,
+        "discrimination": 1.0,
+        "pointBiserial": 1.0,
+    }
+    # Cacheadas hasta la próxima respuesta
+    assert items.stats("a") is stats
+    items.record("s3", "a", 1, True, 4000)
+    assert items.stats("a")["correct"] == 3
+    assert items.stats("nadie") is None
+
+
+def test_item_stats_after_remove():
+    items = ItemResponseStore()
+    responses = {}
+    for i in range(5):
+        responses[f"s{i}"] = StudentResponses()
+        responses[f"s{i}"].record("a", i % 2, i % 2 == 1, 5.0, 100 * (i + 1))
+        items.add_student(f"s{i}", responses[f"s{i}"])
+    items.remove_student("s1", responses["s1"])
+    stats = items.stats("a")
+    assert stats["responses"] == 4
+    assert stats["correct"] == 1
+    assert stats["distribution"] == {"0": 3, "1": 1}
+    assert stats["responseTimeMs"]["min"] == 100
+    assert stats["responseTimeMs"]["max"] == 500
+    # Sin diferencias en las demás preguntas no hay discriminación
+    assert stats["discrimination"] is None
+    for i in (0, 2, 3, 4):
+        items.remove_student(f"s{i}", responses[f"s{i}"])
+    assert items.stats("a") is None
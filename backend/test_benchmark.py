@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de las herramientas de medición: benchmark.py corre de punta a
+punta sobre una clase chica, sus nombres coinciden con la base guardada y
+detecta regresiones; los perfiles de llegada y percentiles de load_test.py
+son los esperados.
+
+    python -m pytest test_benchmark.py
+"""
+import asyncio
+import json
+
+import pytest
+
+import benchmark
+from load_test import arrival_offsets, percentile, summarize
+
+
+def test_bench_size_matches_baseline_names(monkeypatch):
+    monkeypatch.setattr(benchmark, "MIN_ROUND_SECONDS", 0.001)
+    monkeypatch.setattr(benchmark, "ROUNDS", 1)
+    results = asyncio.run(benchmark.bench_size(50))
+    assert all(seconds > 0 for seconds in results.values())
+    assert not benchmark.connection_registry.connections
+    with open(benchmark.BASELINE_FILE, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    assert set(results) <= set(baseline)
+
+
+def test_compare_flags_only_regressions_over_threshold(capsys):
+    baseline = {"get_ranking[50]": 1e-5, "get_dashboard_summary[50]": 2e-5}
+    results = {"get_ranking[50]": 1.2e-5, "get_dashboard_summary[50]": 3e-5, "nuevo[50]": 1e-3}
+    assert benchmark.compare(results, baseline, threshold=0.3) == ["get_dashboard_summary[50]"]
+    assert "(sin base)" in capsys.readouterr().out
+
+
+def test_arrival_profiles_and_percentiles():
+    assert arrival_offsets("spike", 3, 10.0) == [0.0, 0.0, 0.0]
+    assert arrival_offsets("ramp", 4, 8.0) == [0.0, 2.0, 4.0, 6.0]
+    assert arrival_offsets("step", 6, 9.0, steps=3) == [0.0, 0.0, 3.0, 3.0, 6.0, 6.0]
+    assert arrival_offsets("ramp", 0, 8.0) == []
+    with pytest.raises(ValueError):
+        arrival_offsets("ola", 3, 1.0)
+    values = [float(v) for v in range(1, 101)]
+    assert [percentile(values, p) for p in (50, 95, 99, 100)] == [50.0, 95.0, 99.0, 100.0]
+    assert percentile([], 50) == 0.0
+    assert summarize([3.0, 1.0, 2.0]) == {"count": 3, "p50": 2.0, "p95": 3.0, "p99": 3.0,
+                                          "max": 3.0, "mean": 2.0}
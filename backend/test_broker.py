@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de broker.py contra LocalBrokerServer: hashes y publicación ida y
+vuelta por el protocolo RESP, y un arranque que no cuelga si el broker no
+responde.
+
+    python -m pytest test_broker.py
+"""
+import asyncio
+import socket
+
+import pytest
+
+from broker import BrokerError, LocalBrokerServer, RedisBroker
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_hashes_and_publish_round_trip():
+    async def scenario():
+        server = LocalBrokerServer(port=0)
+        await server.start()
+        broker = RedisBroker("127.0.0.1", server.port, connect_timeout=2.0)
+        received = []
+
+        async def handler(message):
+            received.append(message)
+
+        broker.subscribe("canal", handler)
+        await broker.start()
+        try:
+            await broker.hset("aula", "s1", {"name": "Ana", "accumulated_percentage": 12.5})
+            await broker.hset_many("aula", {"s2": {"name": "José"}, "s3": {"name": "Lía", "tags": [1, None]}})
+            await broker.hset_many("aula", {})
+            assert await broker.hgetall("aula") == {
+                "s1": {"name": "Ana", "accumulated_percentage": 12.5},
+                "s2": {"name": "José"},
+                "s3": {"name": "Lía", "tags": [1, None]},
+            }
+            await broker.hdel("aula", "s2")
+            assert set(await broker.hgetall("aula")) == {"s1", "s3"}
+            await broker.delete("aula")
+            assert await broker.hgetall("aula") == {}
+
+            await broker.publish("canal", {"event": "answer", "n": 1})
+            for _ in range(50):
+                if received:
+                    break
+                await asyncio.sleep(0.01)
+            assert received == [{"event": "answer", "n": 1}]
+        finally:
+            await broker.close()
+            await server.close()
+
+    asyncio.run(scenario())
+
+
+def test_start_fails_when_broker_is_unreachable():
+    broker = RedisBroker("127.0.0.1", free_port(), connect_timeout=0.5)
+    with pytest.raises(BrokerError):
+        asyncio.run(broker.start())
+
+
+def test_start_times_out_without_subscription():
+    async def scenario():
+        # Acepta la conexión pero nunca responde
+        server = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        broker = RedisBroker("127.0.0.1", port, connect_timeout=0.3)
+        broker.subscribe("canal", lambda message: None)
+        try:
+            with pytest.raises(BrokerError):
+                await broker.start()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(scenario())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de codec.py: los mensajes vuelven iguales tras serializar y leer
+(JSON y MessagePack con claves compactas, también con el "seq" agregado al
+frame ya serializado), y las acciones mal formadas se rechazan con
+DecodeError.
+
+    python -m pytest test_codec.py
+"""
+import msgpack
+import pytest
+
+import codec
+
+
+MESSAGE = {
+    "type": "DASHBOARD_UPDATE",
+    "data": {
+        "totalStudents": 2,
+        "responseRate": 50.0,
+        "studentName": "José Ñandú",
+        "ranking": [{"sessionId": "s1", "percentage": 12.5, "isCorrect": True}],
+        "slideContent": None,
+    },
+}
+
+
+def test_encode_decode_round_trip():
+    text = codec.encode(MESSAGE)
+    # UTF-8 sin escapar y sin espacios
+    assert "José Ñandú" in text and ": " not in text and ", " not in text
+    assert codec.decode(text) == MESSAGE
+    assert codec.decode(text.encode("utf-8")) == MESSAGE
+    # Votos por índice de opción: claves numéricas como texto
+    assert codec.decode(codec.encode({"voteCounts": {0: 3, 1: 1}})) == {"voteCounts": {"0": 3, "1": 1}}
+
+
+def test_decode_message():
+    message = codec.decode_message('{"action":"SUBMIT_ANSWER","payload":{"activityId":"a1","answer":2}}')
+    assert message.action == "SUBMIT_ANSWER"
+    assert message.payload == {"activityId": "a1", "answer": 2}
+    assert codec.decode_message('{"action":"PING"}').payload == {}
+    for bad in ('{"action":', '[1,2]', '{"action":5}', '{"action":"X","payload":[]}'):
+        with pytest.raises(codec.DecodeError):
+            codec.decode_message(bad)
+
+
+def test_compact_keys_table_is_reversible():
+    shorts = list(codec.COMPACT_KEYS.values())
+    assert len(set(shorts)) == len(shorts)
+    # Una clave corta no puede confundirse con una completa al expandir
+    assert not set(shorts) & set(codec.COMPACT_KEYS)
+    assert not {"type", "data", "seq", "action", "payload"} & set(shorts)
+
+
+def test_msgpack_round_trip_with_compact_keys():
+    data = codec.encode_binary(MESSAGE)
+    raw = msgpack.unpackb(data, raw=False)
+    # El sobre queda igual; el contenido viaja con claves cortas
+    assert set(raw) == {"type", "data"}
+    assert raw["data"]["ts"] == 2 and raw["data"]["rk"][0]["si"] == "s1"
+    assert codec.expand_keys(raw) == MESSAGE
+    assert len(data) < len(codec.encode(MESSAGE).encode("utf-8"))
+    assert codec.expand_keys(msgpack.unpackb(codec.encode_binary({"voteCounts": {0: 3}}), raw=False)) == {
+        "voteCounts": {"0": 3}}
+
+
+def test_decode_binary_message():
+    compact = msgpack.packb({"action": "SUBMIT_ANSWER", "payload": {"ai": "a1", "answer": [0, 2]}})
+    message = codec.decode_binary_message(compact)
+    assert message.action == "SUBMIT_ANSWER"
+    assert message.payload == {"activityId": "a1", "answer": [0, 2]}
+    # También acepta claves completas
+    full = msgpack.packb({"action": "PING", "payload": {"activityId": "a1"}})
+    assert codec.decode_binary_message(full).payload == {"activityId": "a1"}
+    for bad in (b"\xc1", msgpack.packb([1, 2]), msgpack.packb({"action": "X", "payload": 3})):
+        with pytest.raises(codec.DecodeError):
+            codec.decode_binary_message(bad)
+
+
+def test_with_sequence():
+    assert codec.decode(codec.with_sequence("{}", 1)) == {"seq": 1}
+    text = codec.with_sequence(codec.encode(MESSAGE), 42)
+    assert text.startswith('{"seq":42,')
+    assert codec.decode(text) == {"seq": 42, **MESSAGE}
+
+
+def test_with_sequence_binary_for_every_map_header():
+    # fixmap, el paso de fixmap a map16, map16, el paso de map16 a map32 y map32
+    for size in (0, 1, 14, 15, 16, 300, 0xffff, 0x10000):
+        message = {f"k{i}": i for i in range(size)}
+        data = codec.with_sequence_binary(codec.encode_binary(message), 70000)
+        assert msgpack.unpackb(data, raw=False) == {"seq": 70000, **message}
+    with pytest.raises(ValueError):
+        codec.with_sequence_binary(msgpack.packb([1, 2]), 1)
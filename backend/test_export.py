@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de export.py: las filas exportadas en CSV y NDJSON se leen de vuelta
+igual que el progreso guardado, sin importar cómo se partan los trozos.
+
+    python -m pytest test_export.py
+"""
+import csv
+import io
+import json
+
+from export import iter_export
+from storage import JsonProgressStore
+
+ANA = {
+    "name": "Ana Gómez",
+    "accumulated_percentage": 20.0,
+    "responses": {
+        "a1": {"activity_id": "a1", "answer": 2, "is_correct": True, "percentage_value": 20.0,
+               "answered_at": "2024-05-01T10:00:00", "response_time_ms": 1500},
+        "a2": {"activity_id": "a2", "answer": "=SUMA(A1)", "is_correct": False, "percentage_value": 0.0,
+               "answered_at": "2024-05-01T10:01:00", "response_time_ms": None},
+    },
+    "reflections": [{"id": "r1", "student_session_id": "s1", "student_name": "Ana Gómez",
+                     "topic": "Repaso", "content": 'Dijo "vanidad",\nen dos líneas',
+                     "created_at": "2024-05-01T10:05:00"}],
+}
+LUIS = {"name": "Luis", "accumulated_percentage": 0.0, "responses": {}, "reflections": []}
+
+
+def classify(percentage):
+    return "alto" if percentage >= 20 else "bajo"
+
+
+def make_store(tmp_path):
+    store = JsonProgressStore(str(tmp_path / "student_progress.json"),
+                              str(tmp_path / "student_progress.journal"))
+    store.save_students({"Ana Gómez": ANA, "Luis": LUIS})
+    return store
+
+
+def read_csv(chunks):
+    text = b"".join(chunks).decode("utf-8")
+    assert text.startswith("\ufeff")
+    return list(csv.reader(io.StringIO(text[1:], newline="")))
+
+
+def test_csv_round_trip(tmp_path):
+    store = make_store(tmp_path)
+    header, *rows = read_csv(iter_export(store, "responses", "csv", classify))
+    assert header == ["student_name", "activity_id", "answer", "is_correct", "percentage_value",
+                      "answered_at", "response_time_ms"]
+    # Texto que una planilla tomaría como fórmula queda escapado
+    assert sorted(rows) == [
+        ["Ana Gómez", "a1", "2", "True", "20.0", "2024-05-01T10:00:00", "1500"],
+        ["Ana Gómez", "a2", "'=SUMA(A1)", "False", "0.0", "2024-05-01T10:01:00", ""],
+    ]
+    _, reflection = read_csv(iter_export(store, "reflections", "csv", classify))
+    assert reflection == ["Ana Gómez", "r1", "Repaso", 'Dijo "vanidad",\nen dos líneas', "2024-05-01T10:05:00"]
+    chunks = list(iter_export(store, "students", "csv", classify, chunk_bytes=16))
+    assert len(chunks) == 2
+    header, *students = read_csv(chunks)
+    assert sorted(students) == [["Ana Gómez", "20.0", "alto", "2", "1", "1"],
+                                ["Luis", "0.0", "bajo", "0", "0", "0"]]
+
+
+def test_ndjson_round_trip(tmp_path):
+    store = make_store(tmp_path)
+    text = b"".join(iter_export(store, "students", "ndjson", classify, chunk_bytes=16)).decode("utf-8")
+    students = sorted((json.loads(line) for line in text.splitlines()), key=lambda s: s["name"])
+    assert students == [{**ANA, "classification": "alto"}, {**LUIS, "classification": "bajo"}]
+    text = b"".join(iter_export(store, "responses", "ndjson", classify)).decode("utf-8")
+    responses = sorted((json.loads(line) for line in text.splitlines()), key=lambda r: r["activity_id"])
+    assert responses == [{"student_name": "Ana Gómez", **response} for response in ANA["responses"].values()]
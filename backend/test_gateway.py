@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de gateway.py: el anillo de hashing consistente asigna cada aula al
+mismo nodo sin importar el orden de alta, reparte parejo y al agregar o
+quitar un nodo solo mueve las aulas de ese nodo; el gateway cierra con 1012
+solo las conexiones de las aulas que cambiaron de dueño.
+
+    python -m pytest test_gateway.py
+"""
+import asyncio
+from collections import Counter
+
+from gateway import Gateway, HashRing, ProxySession, normalize_class_code
+
+NODES = ["http://10.0.0.1:8101", "http://10.0.0.2:8101", "http://10.0.0.3:8101"]
+CODES = [f"CLASE{i}" for i in range(3000)]
+
+
+def owners(ring):
+    return {code: ring.node_for(code) for code in CODES}
+
+
+def test_routing_is_stable_and_balanced():
+    assert HashRing().node_for("CLASE1") is None
+    ring = HashRing(NODES)
+    assignment = owners(ring)
+    assert owners(HashRing(list(reversed(NODES)))) == assignment
+    assert not ring.add_node(NODES[0])  # Ya estaba: nada cambia
+    assert owners(ring) == assignment
+    # Con 160 puntos por nodo ninguno queda muy por encima del promedio
+    counts = Counter(assignment.values())
+    assert set(counts) == set(NODES)
+    assert max(counts.values()) < 1.25 * len(CODES) / len(NODES)
+    assert normalize_class_code(" clase1 ") == "CLASE1" and normalize_class_code(None) == "GENERAL"
+
+
+def test_adding_and_removing_a_node_moves_only_its_rooms():
+    ring = HashRing(NODES)
+    before = owners(ring)
+    new_node = "http://10.0.0.4:8101"
+    assert ring.add_node(new_node)
+    after = owners(ring)
+    moved = [code for code in CODES if before[code] != after[code]]
+    assert moved and all(after[code] == new_node for code in moved)
+    assert len(moved) < 0.4 * len(CODES)
+
+    assert ring.remove_node(new_node) and not ring.remove_node(new_node)
+    assert owners(ring) == before
+    ring.remove_node(NODES[0])
+    remaining = owners(ring)
+    for code in CODES:
+        if before[code] != NODES[0]:
+            assert remaining[code] == before[code]
+        else:
+            assert remaining[code] in NODES[1:]
+
+
+class ClosingWebSocket:
+    def __init__(self):
+        self.closed_with = None
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_rebalance_closes_only_moved_rooms():
+    gateway = Gateway(NODES[:2])
+    sessions = []
+    for code in CODES[:200]:
+        session = ProxySession(ClosingWebSocket(), code, gateway.node_for(code))
+        gateway.sessions.setdefault(code, set()).add(session)
+        sessions.append(session)
+    new_node = NODES[2]
+    moved = asyncio.run(gateway.add_node(new_node))
+    closed = [s for s in sessions if s.websocket.closed_with is not None]
+    assert moved == len(closed) > 0
+    assert all(s.websocket.closed_with == 1012 and s.moved for s in closed)
+    assert {gateway.node_for(s.class_code) for s in closed} == {new_node}
+    assert all(gateway.node_for(s.class_code) == s.node for s in sessions if s not in closed)
+    # Un segundo rebalanceo no vuelve a cerrar las ya movidas
+    assert asyncio.run(gateway._rebalance()) == 0
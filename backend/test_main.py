@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de main.py sin levantar el servidor: búsqueda de estudiantes por
+nombre sin distinguir mayúsculas ni acentos, contadores del dashboard contra
+un recálculo completo, roster del docente reconstruido desde los deltas,
+ranking (treap) contra un
+ordenamiento simple, cola de salida de una conexión con mensajes de estado
+que se reemplazan, agrupación de broadcasts por tick, mensajes cacheados que se invalidan al
+cambiar el estado, aulas aisladas que se crean solo a pedido y se
+descargan sin perder nada, cierre de actividades por tiempo límite, y reanudación de sesiones (frames perdidos reenviados con
+su seq original).
+
+    python -m pytest test_main.py
+"""
+import asyncio
+import random
+import time
+
+import msgpack
+
+import main
+from codec import decode, encode_binary, expand_keys
+from storage import JsonProgressStore
+
+
+def make_manager(tmp_path):
+    store = JsonProgressStore(str(tmp_path / "student_progress.json"),
+                              str(tmp_path / "student_progress.journal"))
+    return main.StudentManager(store)
+
+
+def test_name_lookup_ignores_case_and_accents(tmp_path):
+    manager = make_manager(tmp_path)
+    manager.store.save_students({"Ana Gómez": {"name": "Ana Gómez", "accumulated_percentage": 30.0,
+                                               "responses": {}, "reflections": []}})
+    websocket = object()
+    student, _ = manager.register_student("  José  Pérez ", websocket)
+    assert student.name == "José  Pérez"
+    assert manager.validate_name("jose perez") == (False, "Este nombre ya está en uso en la clase")
+    assert manager.validate_name("JOSÉ PÉREZ ", allow_reconnect=False)[0] is False
+    manager.disconnect_student(websocket)
+    assert manager.validate_name("jose perez") == (True, "RECONNECT")
+    again, _ = manager.register_student("Jose Perez", object())
+    assert again is student and len(manager.students) == 1
+
+    # Progreso guardado con otra escritura del nombre
+    assert manager.validate_name("ana gomez") == (True, "RESTORE")
+    restored, _ = manager.register_student("ANA GOMEZ", object())
+    assert restored.accumulated_percentage == 30.0
+    assert manager.validate_name("Luis") == (True, "OK")
+    assert manager.validate_name("Lu")[0] is False
+
+
+def random_class_activity(manager, rng, steps):
+    """Altas, respuestas, desconexiones, reinicios y copias de otro worker al azar"""
+    sockets = {}
+    for step in range(steps):
+        choice = rng.random()
+        if choice < 0.2 or not manager.students:
+            websocket = object()
+            student, _ = manager.register_student(f"Estudiante {rng.randrange(40)}", websocket)
+            if student is not None:
+                sockets[student.session_id] = websocket
+        else:
+            student = rng.choice(list(manager.students.values()))
+            if choice < 0.6:
+                correct = rng.random() < 0.5
+                student.add_response(f"a{rng.randrange(3)}", rng.randrange(4), correct, 10.0 if correct else 0.0)
+            elif choice < 0.7 and student.session_id in sockets:
+                manager.disconnect_student(sockets.pop(student.session_id))
+            elif choice < 0.8:
+                student.reset_for_new_activity()
+            elif choice < 0.85:
+                student.reset_all_progress()
+            else:
+                snapshot = student.to_snapshot("worker-2")
+                snapshot["session_id"] = f"remoto-{rng.randrange(5)}"
+                snapshot["name"] = f"Remoto {rng.randrange(5)}"
+                snapshot["status"] = rng.choice(list(main.StudentConnectionStatus)).value
+                manager.apply_snapshot(snapshot)
+        yield step
+
+
+def test_dashboard_aggregates_match_full_recount(tmp_path):
+    manager = make_manager(tmp_path)
+    for step in random_class_activity(manager, random.Random(11), 1500):
+        if step % 25:
+            continue
+        connected = manager.get_connected_students()
+        for activity_id in ("a0", "a1", "a2"):
+            votes = {}
+            for student in connected:
+                answer = student.responses.answer(activity_id)
+                if answer is not None:
+                    votes[str(answer)] = votes.get(str(answer), 0) + 1
+            summary = manager.get_dashboard_summary(activity_id)
+            assert summary["voteCounts"] == votes
+        responded = sum(s.status == main.StudentConnectionStatus.RESPONDED for s in connected)
+        assert summary["totalStudents"] == len(connected)
+        assert summary["respondedCount"] == responded
+        assert summary["notRespondedCount"] == sum(
+            s.status == main.StudentConnectionStatus.NOT_RESPONDED for s in connected)
+        assert summary["students"] == [s.to_summary() for s in connected]
+        expected = sorted(connected, key=lambda s: -s.accumulated_percentage)
+        assert [e["percentage"] for e in manager.get_ranking(5)] == [
+            s.accumulated_percentage for s in expected[:5]]
+        assert manager.aggregates.total == len(manager.students)
+
+
+def test_dashboard_deltas_rebuild_the_full_roster(tmp_path):
+    manager = make_manager(tmp_path)
+    rng = random.Random(5)
+    for _ in random_class_activity(manager, rng, 50):
+        pass
+    full = manager.get_dashboard_summary("a0")
+    roster = {entry["sessionId"]: entry for entry in full["students"]}
+    version = full["version"]
+    for step in random_class_activity(manager, rng, 800):
+        if step % 7:
+            continue
+        # Por el subprotocolo binario, como lo recibe el docente
+        message = {"type": "DASHBOARD_UPDATE", "data": manager.take_dashboard_delta("a0")}
+        delta = expand_keys(msgpack.unpackb(encode_binary(message), raw=False))["data"]
+        assert delta["delta"] and delta["baseVersion"] == version
+        for session_id in delta["removed"]:
+            roster.pop(session_id, None)
+        for entry in delta["changed"]:
+            roster[entry["sessionId"]] = entry
+        version = delta["version"]
+        full = manager.get_dashboard_summary("a0")
+        assert full["version"] == version
+        assert roster == {entry["sessionId"]: entry for entry in full["students"]}
+        assert {k: delta[k] for k in ("totalStudents", "respondedCount", "voteCounts")} == {
+            k: full[k] for k in ("totalStudents", "respondedCount", "voteCounts")}
+    # Sin cambios el delta viaja vacío
+    manager.take_dashboard_delta("a0")
+    empty = manager.take_dashboard_delta("a0")
+    assert empty["changed"] == [] and empty["removed"] == [] and empty["baseVersion"] == version + 1
+
+
+def expected_order(scores, entered):
+    """Orden de referencia: porcentaje desc, luego orden de entrada"""
+    return sorted(scores, key=lambda session_id: (-scores[session_id], entered[session_id]))
+
+
+def test_leaderboard_matches_sorted_order():
+    rng = random.Random(7)
+    board = main.Leaderboard()
+    scores, entered = {}, {}
+    for step in range(2000):
+        session_id = f"s{rng.randrange(60)}"
+        if rng.random() < 0.2:
+            board.remove(session_id)
+            scores.pop(session_id, None)
+            entered.pop(session_id, None)
+        else:
+            score = rng.choice((0.0, 10.0, 20.0, 35.5, 50.0, 100.0))
+            board.update(session_id, score)
+            scores[session_id] = score
+            entered.setdefault(session_id, step)
+        if step % 50 == 0:
+            order = expected_order(scores, entered)
+            assert len(board) == len(order)
+            assert board.top(10) == order[:10]
+            assert board.top(len(order) + 5) == order
+            for position, sid in enumerate(order, start=1):
+                assert board.rank(sid) == position
+    assert board.rank("desconocido") is None
+    assert "desconocido" not in board
+
+
+def test_leaderboard_ties_and_removal():
+    board = main.Leaderboard()
+    for session_id in ("a", "b", "c"):
+        board.update(session_id, 50.0)
+    # Reposicionar con el mismo puntaje conserva el desempate
+    board.update("a", 50.0)
+    assert board.top(3) == ["a", "b", "c"]
+    board.update("c", 60.0)
+    assert board.top(3) == ["c", "a", "b"]
+    assert board.rank("b") == 3
+    # Quitar no deja rastro: al volver entra detrás de los empatados
+    board.remove("a")
+    assert len(board) == 2 and board.rank("a") is None
+    assert board._keys.keys() == {"b", "c"}
+    board.update("a", 50.0)
+    assert board.top(3) == ["c", "b", "a"]
+    for session_id in ("a", "b", "c"):
+        board.remove(session_id)
+    assert len(board) == 0 and board.top(5) == [] and not board._keys
+
+
+class StuckWebSocket:
+    """Websocket cuyo primer envío no termina (cliente con mala señal)"""
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self._never = asyncio.Event()
+
+    async def send_text(self, text):
+        await self._never.wait()
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        await self.send_text(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_superseded_frames_do_not_count_as_backlog():
+    async def scenario():
+        websocket = StuckWebSocket()
+        connection = main.ClientConnection(websocket, max_size=4)
+        connection.session = main.StudentSession("s1")  # Con seq: descarta y agrega al final
+        connection.enqueue('{"type":"STATE_UPDATE"}')
+        await asyncio.sleep(0)  # El escritor toma el primero y queda trabado
+        for i in range(50):
+            connection.enqueue('{"type":"RANKING_UPDATE","n":%d}' % i, "RANKING_UPDATE")
+        assert not connection.closed
+        assert connection._live == 1
+        # Los lugares de los descartados no se acumulan sin límite
+        assert len(connection._queue) < 2 * connection.max_size
+
+        # Un atraso real sí desconecta al cliente
+        for i in range(2 * connection.max_size):
+            connection.enqueue('{"type":"ACTIVITY_UNLOCKED","n":%d}' % i)
+        assert connection.closed
+        await asyncio.sleep(0.01)
+        assert websocket.closed_with == 1013
+
+    asyncio.run(scenario())
+
+
+def test_ticker_coalesces_updates_per_tick():
+    async def scenario():
+        emitted = []
+
+        async def emit_ranking():
+            emitted.append("ranking")
+
+        async def emit_dashboard(activity_id):
+            emitted.append(("dashboard", activity_id))
+
+        ticker = main.BroadcastTicker(0.05, emit_ranking, emit_dashboard)
+        # Sin iniciar: se envía al instante
+        await ticker.mark_ranking()
+        assert emitted == ["ranking"]
+        emitted.clear()
+
+        ticker.start()
+        for i in range(10):
+            await ticker.mark_ranking()
+            await ticker.mark_dashboard(f"a{i}")
+        assert emitted == []
+        await asyncio.sleep(0.1)
+        # Una sola actualización de cada una; el dashboard con el último pedido
+        assert emitted == ["ranking", ("dashboard", "a9")]
+        assert ticker.ticks == 1 and ticker.coalesced == 18
+
+        await ticker.mark_dashboard("a1")
+        await ticker.stop()  # Lo pendiente sale al detener
+        assert emitted[-1] == ("dashboard", "a1") and ticker.ticks == 2
+        await asyncio.sleep(0.1)
+        assert len(emitted) == 3
+
+    asyncio.run(scenario())
+
+
+def test_cached_frames_follow_state_changes():
+    state = main.ClassState()
+    activity = state.apply_event("REGISTER_ACTIVITY", {
+        "activityId": "a1", "question": "¿Quién escribió Eclesiastés?",
+        "options": ["Salomón", "David"], "correctIndex": 0, "timeLimitSeconds": 30}, 1000.0)
+    student_frame = activity.frame("ACTIVITY_UNLOCKED")
+    teacher_frame = activity.frame("ACTIVITY_UNLOCKED", "teacher")
+    assert activity.frame("ACTIVITY_UNLOCKED") is student_frame
+    assert "correctIndex" not in decode(student_frame.text)["data"]
+    assert decode(teacher_frame.text)["data"]["correctIndex"] == 0
+    assert expand_keys(msgpack.unpackb(student_frame.binary, raw=False)) == decode(student_frame.text)
+
+    lobby = state.frame()
+    assert state.frame() is lobby
+    state.set_state("LOBBY")  # Sin cambio real: sigue el mismo
+    assert state.frame() is lobby
+
+    state.apply_event("UNLOCK_ACTIVITY", {"activityId": "a1"}, 1000.0)
+    unlocked = activity.frame("ACTIVITY_UNLOCKED")
+    assert unlocked is not student_frame
+    assert decode(unlocked.text)["data"]["state"] == "active"
+    current = state.frame()
+    assert current is not lobby
+    assert decode(current.text) == {"type": "STATE_UPDATE", "data": state.to_dict()}
+
+    # La actividad actual se cierra por tiempo sin pasar por set_current_activity
+    activity.state = main.ActivityState.CLOSED
+    assert decode(state.frame().text)["data"]["currentActivity"]["state"] == "closed"
+    state.set_slide(3, 1)
+    assert decode(state.frame().text)["data"]["slide"] == 3
+
+
+def test_rooms_are_isolated_and_survive_eviction(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "ROOMS_DIR", str(tmp_path))
+    assert main.normalize_class_code(" mate-3a ") == "MATE-3A"
+    assert main.normalize_class_code("no válido") is None
+
+    async def scenario():
+        registry = main.ClassroomRegistry(idle_seconds=0)
+        # Sin crear: un aula que no existe no deja carpeta
+        assert await registry.open("MATE", create=False) is None
+        assert not (tmp_path / "MATE").exists()
+        first, second = await asyncio.gather(registry.open("MATE"), registry.open("MATE"))
+        assert first is second and (tmp_path / "MATE").is_dir()
+        other = await registry.open("HIST")
+
+        for action, payload in (("SET_STATE", {"state": "LESSON"}), ("SET_SLIDE", {"slide": 4})):
+            first.state.apply_event(action, payload, 1000.0)
+            first.record_event(action, payload, 1000.0)
+        websocket = object()
+        student, _ = first.student_manager.register_student("Ana Gómez", websocket)
+        student.add_response("a1", 1, True, 10.0)
+        first.student_manager.save_response(student, "a1")
+        assert other.state.current_state == "LOBBY"
+        assert other.student_manager.validate_name("Ana Gómez") == (True, "OK")
+
+        # Con conexiones el aula no se descarga
+        await registry.evict_idle()
+        assert registry.get("MATE") is first and registry.get("HIST") is None
+        first.student_manager.disconnect_student(websocket)
+        await registry.evict_idle()
+        assert registry.get("MATE") is None
+        reopened = await registry.open("MATE", create=False)
+        assert reopened is not first
+        assert (reopened.state.current_state, reopened.state.current_slide_index) == ("LESSON", 4)
+        assert reopened.student_manager.validate_name("ana gomez") == (True, "RESTORE")
+        assert reopened.student_manager.store.load_student("Ana Gómez")["accumulated_percentage"] == 10.0
+        await registry.stop()
+
+    asyncio.run(scenario())
+
+
+def test_activity_timers_close_only_current_deadline(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "ROOMS_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "ACTIVITY_TIME_GRACE_SECONDS", 0.0)
+
+    async def scenario():
+        registry = main.ClassroomRegistry(idle_seconds=60)
+        monkeypatch.setattr(main, "classrooms", registry)
+        timers = main.ActivityTimers()
+        timers.start()
+        room = await registry.open("MATE")
+        for activity_id in ("a1", "a2"):
+            room.state.apply_event("REGISTER_ACTIVITY", {
+                "activityId": activity_id, "options": ["Sí", "No"], "timeLimitSeconds": 1}, 0.0)
+        # a1 vence en 50 ms; a2 se reabre con más tiempo antes de vencer
+        a1 = room.state.apply_event("UNLOCK_ACTIVITY", {"activityId": "a1"}, time.time() - 0.95)
+        timers.schedule(room, a1)
+        a2 = room.state.apply_event("UNLOCK_ACTIVITY", {"activityId": "a2"}, time.time() - 0.95)
+        timers.schedule(room, a2)
+        stale_deadline = a2.closes_at
+        a2.activate(time.time() + 60)
+        timers.schedule(room, a2)
+        assert len(timers) == 3
+
+        await asyncio.sleep(0.2)
+        assert a1.state == main.ActivityState.CLOSED
+        assert a2.state == main.ActivityState.ACTIVE and room.state.current_activity is a2
+        assert timers.expired == 1 and len(timers) == 1
+        # Un EXPIRE_ACTIVITY de una apertura anterior no cierra la actual
+        assert room.state.apply_event(main.EXPIRE_ACTIVITY_EVENT,
+                                      {"activityId": "a2", "closesAt": stale_deadline}, time.time()) is None
+        await timers.stop()
+        await registry.stop()
+
+        # El cierre quedó en el log del aula: al reabrir sigue cerrada
+        reopened = main.Classroom("MATE")
+        reopened.restore_state()
+        assert reopened.state.get_activity("a1").state == main.ActivityState.CLOSED
+        await reopened.close()
+
+    asyncio.run(scenario())
+
+
+class RecordingWebSocket:
+    """Websocket que guarda lo enviado"""
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        pass
+
+
+def test_session_missed_since():
+    session = main.StudentSession("s1")
+    messages = [{"type": "ACTIVITY_UNLOCKED", "data": {"n": i}} for i in range(5)]
+    frames = [session.stamp(main.encode_message(m), m) for m in messages]
+    assert [decode(f)["seq"] for f in frames] == [1, 2, 3, 4, 5]
+    assert session.missed_since(2) == [(3, messages[2]), (4, messages[3]), (5, messages[4])]
+    assert session.missed_since(5) == []
+    assert session.missed_since(6) is None  # El cliente dice tener más de lo enviado
+
+    for i in range(main.RESUME_BUFFER_SIZE):
+        session.record({"type": "ACTIVITY_UNLOCKED", "data": {"n": 5 + i}})
+    # Lo que el buffer circular ya sobrescribió pide un snapshot completo
+    assert session.missed_since(4) is None
+    assert len(session.missed_since(5)) == main.RESUME_BUFFER_SIZE
+    session.expire()
+    assert session.missed_since(session.seq) is None
+
+
+def test_replay_frames_keeps_original_seq():
+    async def scenario(binary):
+        session = main.StudentSession("s1")
+        messages = [
+            {"type": "RANKING_UPDATE", "data": {"ranking": ["a"]}},
+            {"type": "ACTIVITY_UNLOCKED", "data": {"activityId": "a1"}},
+            main.EncodedMessage({"type": "SLIDE_CHANGED", "data": {"slide": 2}}),
+            {"type": "RANKING_UPDATE", "data": {"ranking": ["b", "a"]}},
+        ]
+        for message in messages:
+            session.record(message)
+        websocket = RecordingWebSocket()
+        connection = main.ClientConnection(websocket, binary=binary)
+        connection.session = session
+        assert main.replay_frames(connection, session.missed_since(0)) == 3
+        await asyncio.sleep(0.01)
+        if binary:
+            return [msgpack.unpackb(frame, raw=False) for frame in websocket.sent]
+        return [decode(frame) for frame in websocket.sent]
+
+    for binary in (False, True):
+        received = asyncio.run(scenario(binary))
+        # El ranking viejo se omite: basta con el último
+        assert [(m["seq"], m["type"]) for m in received] == [
+            (2, "ACTIVITY_UNLOCKED"), (3, "SLIDE_CHANGED"), (4, "RANKING_UPDATE")]
+        assert received[-1]["data"][("rk" if binary else "ranking")] == ["b", "a"]
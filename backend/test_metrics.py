@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de metrics.py: lo que se registra vuelve igual al leer el texto de
+Prometheus (etiquetas escapadas, buckets acumulados, gauges calculados en
+el scrape), y el /metrics del servidor es texto válido.
+
+    python -m pytest test_metrics.py
+"""
+import re
+
+import main
+from metrics import Registry
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def unescape(value):
+    return re.sub(r'\\(.)', lambda m: "\n" if m.group(1) == "n" else m.group(1), value)
+
+
+def parse(text):
+    """{(nombre, ((etiqueta, valor), ...)): número} y {nombre: tipo}"""
+    samples, types = {}, {}
+    assert text.endswith("\n")
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+            continue
+        if line.startswith("#"):
+            continue
+        name, labels, value = SAMPLE.match(line).groups()
+        key = tuple((k, unescape(v)) for k, v in LABEL.findall(labels or ""))
+        samples[(name, key)] = float(value)
+    return samples, types
+
+
+def test_render_round_trip():
+    registry = Registry()
+    messages = registry.counter("ws_messages", "Mensajes", ["role", "action"])
+    messages.labels("student", "SUBMIT_ANSWER").inc()
+    messages.labels("student", "SUBMIT_ANSWER").inc(2)
+    messages.labels("teacher", 'raro "x"\\\n').inc()
+    scrapes = []
+    registry.on_render(lambda: scrapes.append(1))
+    registry.gauge("rooms", "Aulas", ["room"], function=lambda: {("MATE",): 3, ("HIST",): 0})
+    students = registry.gauge("students", "Estudiantes")
+    students.set(12)
+    latency = registry.histogram("latency_seconds", "Latencia", buckets=(0.01, 0.1))
+    for value in (0.005, 0.01, 0.05, 2.0):
+        latency.observe(value)
+
+    samples, types = parse(registry.render())
+    assert scrapes == [1]
+    assert types == {"ws_messages": "counter", "rooms": "gauge", "students": "gauge",
+                     "latency_seconds": "histogram"}
+    assert samples[("ws_messages_total", (("role", "student"), ("action", "SUBMIT_ANSWER")))] == 3
+    assert samples[("ws_messages_total", (("role", "teacher"), ("action", 'raro "x"\\\n')))] == 1
+    assert samples[("rooms", (("room", "MATE"),))] == 3
+    assert samples[("rooms", (("room", "HIST"),))] == 0
+    assert samples[("students", ())] == 12
+    # Buckets acumulados; el límite es inclusivo
+    assert [samples[("latency_seconds_bucket", (("le", le),))] for le in ("0.01", "0.1", "+Inf")] == [2, 3, 4]
+    assert samples[("latency_seconds_count", ())] == 4
+    assert abs(samples[("latency_seconds_sum", ())] - 2.065) < 1e-9
+    registry.render()
+    assert scrapes == [1, 1]
+
+
+def test_server_metrics_parse():
+    samples, types = parse(main.METRICS.render())
+    assert set(types.values()) <= {"counter", "gauge", "histogram"}
+    assert all(name.startswith(tuple(types)) for name, _ in samples)
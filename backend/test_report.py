@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de report.py: el XLSX generado desde el volcado NDJSON se lee de
+vuelta con zipfile y ElementTree (pestañas, valores por celda, nombres de
+hoja válidos y únicos, tiempos guardados inválidos).
+
+    python -m pytest test_report.py
+"""
+import json
+import zipfile
+import xml.etree.ElementTree as ET
+
+from report import SPREADSHEET_NS, build_class_report, column_letter
+
+NS = {"s": SPREADSHEET_NS}
+ACTIVITIES = {
+    "a1": {"question": "¿Quién escribió Eclesiastés?", "options": ["Salomón", "David"], "correctIndex": 0},
+    "a2": {"question": "Vanidad de vanidades", "options": ["Sí", "No"], "correctIndex": 1},
+}
+
+
+def response(activity_id, answer, correct, ms):
+    return {"activity_id": activity_id, "answer": answer, "is_correct": correct,
+            "percentage_value": 10.0 if correct else 0.0, "answered_at": "2024-05-01T10:00:00",
+            "response_time_ms": ms}
+
+
+RECORDS = [
+    {"name": "Luis", "accumulated_percentage": 10.0, "classification": "bajo",
+     "responses": {"a1": response("a1", 1, False, 3000), "a2": response("a2", 1, True, "2000")},
+     "reflections": []},
+    {"name": "Ana/Gómez", "accumulated_percentage": 20.0, "classification": "alto",
+     "responses": {"a1": response("a1", 0, True, 1000), "a2": response("a2", 1, True, None)},
+     "reflections": [{"id": "r1", "topic": "Repaso", "content": "<todo> & más", "created_at": "2024-05-01"}]},
+    {"name": "ana/gómez", "accumulated_percentage": 0.0, "classification": "bajo",
+     "responses": {}, "reflections": []},
+]
+
+
+def cell_value(cell):
+    kind = cell.get("t")
+    if kind == "inlineStr":
+        return cell.find("s:is/s:t", NS).text
+    value = cell.find("s:v", NS).text
+    if kind == "b":
+        return value == "1"
+    return float(value)
+
+
+def read_book(path):
+    """{nombre de pestaña: filas}, con las celdas vacías como None"""
+    with zipfile.ZipFile(path) as book:
+        assert book.testzip() is None
+        content_types = book.read("[Content_Types].xml").decode("utf-8")
+        workbook = ET.fromstring(book.read("xl/workbook.xml"))
+        sheets = {}
+        for i, sheet in enumerate(workbook.find("s:sheets", NS), 1):
+            assert f"/xl/worksheets/sheet{i}.xml" in content_types
+            rows = []
+            for row in ET.fromstring(book.read(f"xl/worksheets/sheet{i}.xml")).iter(f"{{{SPREADSHEET_NS}}}row"):
+                values = {}
+                for cell in row:
+                    ref = cell.get("r")
+                    values[ref.rstrip("0123456789")] = cell_value(cell)
+                width = max((j for j in range(30) if column_letter(j) in values), default=-1) + 1
+                rows.append([values.get(column_letter(j)) for j in range(width)])
+            sheets[sheet.get("name")] = rows
+        return sheets
+
+
+def test_report_round_trip(tmp_path):
+    records_path = tmp_path / "records.ndjson"
+    with open(records_path, "w", encoding="utf-8") as f:
+        for record in RECORDS:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    output = tmp_path / "reporte.xlsx"
+    result = build_class_report(str(records_path), str(output), "MATE", ACTIVITIES,
+                                ["alto", "bajo"], max_student_sheets=10)
+    assert result["students"] == 3 and result["studentSheets"] == 3 and result["responses"] == 4
+
+    sheets = read_book(output)
+    # Nombres de hoja sin "/" y únicos sin distinguir mayúsculas
+    assert list(sheets) == ["Resumen", "Estudiantes", "Actividades", "Ana_Gómez", "ana_gómez (2)", "Luis"]
+    summary = {row[0]: row[1:] for row in sheets["Resumen"] if row}
+    assert summary["Reporte de clase"] == ["MATE"]
+    assert summary["Respuestas"] == [4.0] and summary["Precisión general (%)"] == [75.0]
+    assert summary["alto"] == [1.0, 33.3] and summary["bajo"] == [2.0, 66.7]
+
+    header, *students = sheets["Estudiantes"]
+    assert header[0] == "Nombre"
+    assert [s[:6] for s in students] == [
+        ["Ana/Gómez", 20.0, "alto", 2.0, 2.0, 100.0],
+        ["Luis", 10.0, "bajo", 2.0, 1.0, 50.0],
+        ["ana/gómez", 0.0, "bajo", 0.0, 0.0, None],
+    ]
+    # Un tiempo guardado como texto ("2000") se descarta sin romper el reporte
+    assert students[1][6] == 3.0
+
+    _, a1, a2 = sheets["Actividades"]
+    # Empate en la más elegida: la primera que aparece en el volcado
+    assert a1 == ["a1", ACTIVITIES["a1"]["question"], 2.0, 1.0, 50.0, 2.0, "David", 1.0]
+    assert a2 == ["a2", ACTIVITIES["a2"]["question"], 2.0, 2.0, 100.0, None, "No", 2.0]
+
+    ana = sheets["Ana_Gómez"]
+    assert ana[1][:4] == ["a1", ACTIVITIES["a1"]["question"], "Salomón", True]
+    assert [None, "Repaso", "<todo> & más", "2024-05-01"] in ana
+
+
+def test_report_limits_student_sheets(tmp_path):
+    records_path = tmp_path / "records.ndjson"
+    records_path.write_text("".join(json.dumps(r) + "\n" for r in RECORDS), encoding="utf-8")
+    output = tmp_path / "reporte.xlsx"
+    result = build_class_report(str(records_path), str(output), "MATE", ACTIVITIES, ["alto", "bajo"],
+                                max_student_sheets=1)
+    assert result["studentSheets"] == 1
+    # La hoja que queda es la del primero del ranking
+    assert list(read_book(output)) == ["Resumen", "Estudiantes", "Actividades", "Ana_Gómez"]
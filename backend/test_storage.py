@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de storage.py: el progreso guardado vuelve igual al reabrir (JSON y
+SQLite), al abrir el JSON solo se indexa y se lee del disco a pedido, se
+reconstruye desde el diario tras un cierre abrupto, el estado de la clase se reconstruye igual desde el último
+snapshot más los eventos posteriores, y flush() no vuelve antes de que
+termine la escritura en curso.
+
+    python -m pytest test_storage.py
+"""
+import asyncio
+import json
+import time
+
+import pytest
+
+from storage import (ClassStateLog, JsonProgressStore, PersistenceScheduler, ProgressStore,
+                     create_progress_store)
+
+
+class SlowStore(ProgressStore):
+    """Almacenamiento en memoria con escrituras lentas"""
+    def __init__(self):
+        self.saved = []
+        self.bytes_written = 0
+
+    def save_students(self, students_data):
+        time.sleep(0.2)
+        self.saved.extend(students_data)
+
+
+class SavedStudent:
+    def __init__(self, name):
+        self.name = name
+
+    def to_saveable(self):
+        return {"name": self.name, "accumulated_percentage": 0.0, "responses": {}, "reflections": []}
+
+
+def response(activity_id, answer, percentage):
+    return {"activity_id": activity_id, "answer": answer, "is_correct": percentage > 0,
+            "percentage_value": percentage, "answered_at": "2024-05-01T10:00:00",
+            "response_time_ms": 1500}
+
+
+def reflection(reflection_id, name, content):
+    return {"id": reflection_id, "student_session_id": "s-" + name, "student_name": name,
+            "topic": "Repaso", "content": content, "created_at": "2024-05-01T10:05:00"}
+
+
+def open_json_store(tmp_path, compact_threshold=500):
+    return JsonProgressStore(str(tmp_path / "student_progress.json"),
+                             str(tmp_path / "student_progress.journal"), compact_threshold)
+
+
+def open_store(tmp_path, backend):
+    return create_progress_store(backend, str(tmp_path / "student_progress.json"),
+                                 str(tmp_path / "student_progress.journal"),
+                                 str(tmp_path / "student_progress.db"))
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_progress_store_round_trip(tmp_path, backend):
+    ana = {"name": "Ana", "accumulated_percentage": 10.0,
+           "responses": {"a1": response("a1", {"x": [1, 2]}, 10.0)},
+           "reflections": [reflection("r1", "Ana", "Me costó la parte dos")]}
+    jose = {"name": "José", "accumulated_percentage": 0.0, "responses": {}, "reflections": []}
+    store = open_store(tmp_path, backend)
+    store.save_students({"Ana": ana, "José": jose})
+    store.save_changes([
+        {"op": "response", "name": "José", "response": response("a1", "ñandú", 0.0),
+         "accumulated_percentage": 0.0},
+        {"op": "response", "name": "José", "response": response("a2", 42, 20.0),
+         "accumulated_percentage": 20.0},
+        {"op": "reflection", "name": "José", "reflection": reflection("r2", "José", "Bien"),
+         "accumulated_percentage": 20.0},
+    ])
+    store.close()
+
+    reopened = open_store(tmp_path, backend)
+    assert reopened.count() == 2
+    assert reopened.load_student("ANA") == ana
+    # Búsqueda sin distinguir mayúsculas ni acentos
+    assert reopened.has_student("jose") and not reopened.has_student("Pedro")
+    assert reopened.load_student("jose") == {
+        "name": "José", "accumulated_percentage": 20.0,
+        "responses": {"a1": response("a1", "ñandú", 0.0), "a2": response("a2", 42, 20.0)},
+        "reflections": [reflection("r2", "José", "Bien")],
+    }
+    assert sorted(s["name"] for s in reopened.iter_students()) == ["Ana", "José"]
+    assert sorted(reopened.iter_index()) == [("Ana", 10.0), ("José", 20.0)]
+    reopened.clear()
+    assert reopened.count() == 0 and reopened.load_student("Ana") is None
+    reopened.close()
+
+
+def test_sqlite_imports_existing_json_progress(tmp_path):
+    store = open_store(tmp_path, "json")
+    store.save_changes([{"op": "response", "name": "Ana", "response": response("a1", "B", 10.0),
+                         "accumulated_percentage": 10.0}])
+    store.close()
+    imported = open_store(tmp_path, "sqlite")
+    assert imported.count() == 1
+    assert imported.load_student("Ana")["responses"] == {"a1": response("a1", "B", 10.0)}
+    imported.close()
+
+
+def test_json_store_loads_only_the_index(tmp_path):
+    store = open_json_store(tmp_path)
+    store.save_students({
+        name: {"name": name, "accumulated_percentage": float(i),
+               "responses": {"a1": response("a1", name, float(i))}, "reflections": []}
+        for i, name in enumerate(("Ana", "José", "Luis"))
+    })
+    store.close()
+
+    reopened = open_json_store(tmp_path)
+    # Solo el índice en memoria: ningún registro parseado al abrir
+    assert reopened.count() == 3 and not reopened.changed
+    assert reopened.load_student("luis")["responses"]["a1"]["answer"] == "Luis"
+    # Cambio parcial escrito distinto: parte del registro guardado y queda uno solo
+    reopened.save_changes([{"op": "response", "name": "jose", "response": response("a2", "x", 5.0),
+                            "accumulated_percentage": 6.0}])
+    assert list(reopened.changed) == ["jose"]
+    assert sorted(reopened.load_student("JOSÉ")["responses"]) == ["a1", "a2"]
+    reopened.close()
+
+    compacted = open_json_store(tmp_path)
+    assert compacted.count() == 3 and not compacted.changed
+    assert compacted.load_student("José")["accumulated_percentage"] == 6.0
+    assert compacted.load_student("Ana")["responses"] == {"a1": response("a1", "Ana", 0.0)}
+    compacted.close()
+
+
+def test_json_store_converts_indented_snapshot(tmp_path):
+    ana = {"name": "Ana", "accumulated_percentage": 10.0,
+           "responses": {"a1": response("a1", "B", 10.0)}, "reflections": []}
+    with open(tmp_path / "student_progress.json", "w", encoding="utf-8") as f:
+        json.dump({"last_updated": "2024-05-01T10:00:00", "students": {"Ana": ana}}, f, indent=2)
+    store = open_json_store(tmp_path)
+    assert store.load_student("ana") == ana
+    store.close()
+    with open(tmp_path / "student_progress.json", "rb") as f:
+        assert f.readline().startswith(b'{"format":"lines-v1"')
+    assert open_json_store(tmp_path).load_student("Ana") == ana
+
+
+def test_journal_replay_after_abrupt_stop(tmp_path):
+    store = open_json_store(tmp_path)
+    store.save_changes([
+        {"op": "response", "name": "Ana", "response": response("a1", "B", 10.0),
+         "accumulated_percentage": 10.0},
+        {"op": "response", "name": "Ana", "response": response("a2", "C", 0.0),
+         "accumulated_percentage": 10.0},
+        {"op": "reflection", "name": "Ana", "reflection": reflection("r1", "Ana", "Entendí todo"),
+         "accumulated_percentage": 10.0},
+        {"op": "response", "name": "Luis", "response": response("a1", "A", 0.0),
+         "accumulated_percentage": 0.0},
+    ])
+    # Sin close(): el snapshot no se escribió, todo está solo en el diario
+    assert not (tmp_path / "student_progress.json").exists()
+    store.journal.close()
+    with open(tmp_path / "student_progress.journal", "a", encoding="utf-8") as f:
+        f.write('{"op":"response","name":"Lu')  # Línea cortada por el corte de luz
+
+    reopened = open_json_store(tmp_path)
+    assert reopened.journal.record_count == 4
+    ana = reopened.load_student("ana")
+    assert ana["accumulated_percentage"] == 10.0
+    assert ana["responses"] == {"a1": response("a1", "B", 10.0), "a2": response("a2", "C", 0.0)}
+    assert ana["reflections"] == [reflection("r1", "Ana", "Entendí todo")]
+    assert reopened.load_student("Luis")["responses"] == {"a1": response("a1", "A", 0.0)}
+
+    # Un reinicio en el diario borra lo anterior
+    reopened.clear()
+    reopened.journal.close()
+    assert open_json_store(tmp_path).count() == 0
+
+
+def open_log(tmp_path, snapshot_every=100):
+    return ClassStateLog(str(tmp_path / "class_state.json"), str(tmp_path / "class_events.jsonl"),
+                         snapshot_every)
+
+
+def test_class_state_log_replay_after_snapshot(tmp_path):
+    log = open_log(tmp_path)
+    log.append("SET_STATE", {"state": "lesson"}, 1.0)
+    log.append("SET_SLIDE", {"slide": 1}, 2.0)
+    log.write_snapshot({"state": "lesson", "slide": 1})
+    log.append("SET_SLIDE", {"slide": 2}, 3.0)
+    log.append("UNLOCK_ACTIVITY", {"activityId": "a1"}, 4.0)
+    log.close()
+
+    reopened = open_log(tmp_path)
+    snapshot, events = reopened.load()
+    assert snapshot == {"state": "lesson", "slide": 1}
+    assert [(e["seq"], e["action"], e["payload"]) for e in events] == [
+        (3, "SET_SLIDE", {"slide": 2}),
+        (4, "UNLOCK_ACTIVITY", {"activityId": "a1"}),
+    ]
+    assert reopened.journal.record_count == 2
+    # Los eventos nuevos siguen la numeración
+    assert reopened.append("LOCK_ACTIVITY", {"activityId": "a1"}, 5.0)["seq"] == 5
+    reopened.close()
+
+
+def test_class_state_log_skips_events_already_in_snapshot(tmp_path):
+    log = open_log(tmp_path)
+    for slide in range(3):
+        log.append("SET_SLIDE", {"slide": slide}, float(slide))
+    log.close()
+    # Corte entre escribir el snapshot y vaciar el diario: el snapshot ya incluye seq 2
+    with open(tmp_path / "class_state.json", "w", encoding="utf-8") as f:
+        json.dump({"seq": 2, "state": {"slide": 1}}, f)
+
+    reopened = open_log(tmp_path)
+    snapshot, events = reopened.load()
+    assert snapshot == {"slide": 1}
+    assert [e["seq"] for e in events] == [3]
+    # Solo cuenta el evento que se re-aplica, no los ya incluidos en el snapshot
+    assert reopened.journal.record_count == 1
+    reopened.close()
+
+
+def test_class_state_log_without_files(tmp_path):
+    log = open_log(tmp_path)
+    assert log.load() == (None, [])
+    assert log.journal.record_count == 0
+
+
+def test_flush_waits_for_batch_in_flight():
+    store = SlowStore()
+    scheduler = PersistenceScheduler(store, interval=0.0)
+
+    async def scenario():
+        scheduler.mark_dirty(SavedStudent("Ana"))
+        # Lote tomado por la tarea de fondo y todavía escribiéndose
+        in_flight = asyncio.ensure_future(scheduler.flush())
+        await asyncio.sleep(0.01)
+        assert not store.saved
+        await scheduler.flush()  # Nada pendiente: espera el lote en curso
+        assert store.saved == ["Ana"]
+        await in_flight
+
+    asyncio.run(scenario())
+    scheduler._executor.shutdown(wait=True)